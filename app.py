@@ -2,12 +2,32 @@ import os
 import logging
 import json
 import random
-from flask import Flask, render_template, request, jsonify
+import time
+import uuid
+from collections import deque, OrderedDict
+
+# eventlet's green DNS resolver imports dnspython, a large share of the
+# import time. Nothing resolves names on the event loop (cloud requests run
+# in worker threads), so the system resolver is enough.
+os.environ.setdefault("EVENTLET_NO_GREENDNS", "yes")
+
+from flask import Flask, Response, render_template, request, jsonify
 from flask_socketio import SocketIO, emit
 import speech_recognition_service as srs
 import sentiment_analysis as sa
 import noise_reduction as nr
+import voice_activity_detection as vad
+import audio_normalization as an
+import audio_codec as ac
 import performance_metrics as pm
+import pipeline
+import transcription_cache as tc
+import cloud_http as ch
+import batch_transcription as bt
+import tracing
+import shared_metrics as sm
+import metrics_broadcast as mb
+import model_router as mr
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -17,11 +37,38 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key")
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+pipeline.configure(socketio.sleep)
+metrics_broadcaster = mb.MetricsBroadcaster(socketio)
 
 # Global variables to store active model and processing settings
 active_model = "google"  # Default model
 noise_reduction_enabled = True
 sentiment_analysis_enabled = True
+vad_enabled = True
+
+# Pseudo-model that runs every available model on each chunk
+COMPARE_MODE = "compare"
+
+# Admission control limits
+MAX_SESSION_QUEUE = int(os.environ.get("MAX_SESSION_QUEUE", 3))  # Queued chunks per session
+MAX_GLOBAL_IN_FLIGHT = int(os.environ.get("MAX_GLOBAL_IN_FLIGHT", 64))  # Queued + processing chunks
+STALE_CHUNK_SECONDS = float(os.environ.get("STALE_CHUNK_SECONDS", 10))  # Drop chunks that waited longer
+MIN_RETRY_AFTER_MS = 500
+
+# Batch transcription jobs of uploaded recordings, oldest first
+MAX_BATCH_JOBS = int(os.environ.get("MAX_BATCH_JOBS", 100))  # Finished jobs kept for polling
+batch_jobs = OrderedDict()
+
+# Audio chunks waiting to be processed, and sessions with a running pipeline task
+session_queues = {}
+active_sessions = set()
+in_flight_chunks = 0
+
+# Live PCM frames (100-200ms each, see static/js/pcm-capture-worklet.js) are
+# joined into clips of this many seconds for models that recognize whole
+# clips; streaming models get every frame as it arrives
+PCM_CLIP_SECONDS = float(os.environ.get("PCM_CLIP_SECONDS", 2.0))
+pcm_buffers = {}
 
 @app.route('/')
 def index():
@@ -34,10 +81,41 @@ def get_models():
     models = srs.get_available_models()
     return jsonify(models)
 
+@app.route('/api/models/health', methods=['GET'])
+def get_models_health():
+    """Get load state and availability of each speech recognition backend"""
+    return jsonify(srs.get_backend_health())
+
+@app.route('/metrics', methods=['GET'])
+def get_prometheus_metrics():
+    """Metrics of all worker processes in the Prometheus text exposition format"""
+    return Response(sm.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/traces', methods=['GET'])
+def get_traces():
+    """
+    Download the recent pipeline spans
+    
+    ?format=chrome (default) gives a Chrome trace for chrome://tracing or
+    Perfetto; ?format=otlp gives OTLP/JSON for OpenTelemetry tooling.
+    """
+    trace_format = request.args.get('format', 'chrome')
+    if trace_format not in tracing.EXPORTERS:
+        return jsonify({'error': f'Unknown format: {trace_format}'}), 400
+    
+    response = jsonify(tracing.EXPORTERS[trace_format](tracing.get_spans()))
+    response.headers['Content-Disposition'] = f'attachment; filename=traces-{trace_format}.json'
+    return response
+
+@app.route('/api/router', methods=['GET'])
+def get_router_stats():
+    """Get the auto mode router's per-backend statistics and decisions"""
+    return jsonify(mr.router.get_stats())
+
 @app.route('/api/settings', methods=['POST'])
 def update_settings():
     """Update application settings"""
-    global active_model, noise_reduction_enabled, sentiment_analysis_enabled
+    global active_model, noise_reduction_enabled, sentiment_analysis_enabled, vad_enabled
     
     data = request.json
     if 'model' in data:
@@ -46,13 +124,104 @@ def update_settings():
         noise_reduction_enabled = data['noiseReduction']
     if 'sentimentAnalysis' in data:
         sentiment_analysis_enabled = data['sentimentAnalysis']
+    if 'voiceActivityDetection' in data:
+        vad_enabled = data['voiceActivityDetection']
     
     return jsonify({'status': 'success', 'settings': {
         'model': active_model,
         'noiseReduction': noise_reduction_enabled,
-        'sentimentAnalysis': sentiment_analysis_enabled
+        'sentimentAnalysis': sentiment_analysis_enabled,
+        'voiceActivityDetection': vad_enabled
     }})
 
+@app.route('/api/transcribe', methods=['POST'])
+def start_batch_transcription():
+    """
+    Start transcribing an uploaded recording
+    
+    Accepts the recording as an 'audio' file field or as the raw request
+    body. Optional 'model' and 'sid' (Socket.IO session id to send
+    batch_progress and batch_complete events to) can be form fields or
+    query parameters.
+    """
+    upload = request.files.get('audio')
+    audio_data = upload.read() if upload else request.get_data()
+    model = request.values.get('model') or active_model
+    sid = request.values.get('sid')
+    
+    if not audio_data:
+        return jsonify({'error': 'No audio data received'}), 400
+    if model == mr.AUTO_MODEL:
+        # One backend for the whole recording, picked when the job starts
+        model = mr.router.choose()
+    if srs.get_backend(model) is None:
+        return jsonify({'error': f'Unknown model: {model}'}), 400
+    
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'model': model,
+        'completed': 0,
+        'total': None,
+        'result': None,
+        'error': None,
+        'created': pm.get_current_time()
+    }
+    batch_jobs[job['id']] = job
+    while len(batch_jobs) > MAX_BATCH_JOBS:
+        batch_jobs.popitem(last=False)
+    
+    declared_format = upload.mimetype if upload else request.content_type
+    socketio.start_background_task(run_batch_job, job, audio_data, sid, declared_format)
+    return jsonify(job), 202
+
+@app.route('/api/transcribe/<job_id>')
+def get_batch_transcription(job_id):
+    """Get the status and, once finished, the result of a batch transcription job"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+def run_batch_job(job, audio_data, sid, declared_format):
+    """Run a batch transcription job, reporting progress to the session that started it"""
+    def report_progress(completed, total, segment):
+        job['completed'], job['total'] = completed, total
+        if sid:
+            socketio.emit('batch_progress', {
+                'job_id': job['id'],
+                'completed': completed,
+                'total': total,
+                'segment': segment
+            }, to=sid)
+    
+    job['status'] = 'running'
+    tracing.start_trace(job['id'], 'batch', model=job['model'], input_bytes=len(audio_data))
+    try:
+        result = bt.transcribe_recording(
+            audio_data, job['model'], progress=report_progress,
+            noise_reduction=noise_reduction_enabled, declared_format=declared_format
+        )
+        if sentiment_analysis_enabled and result['text']:
+            # One pool task for the whole recording instead of one per segment
+            texts = [segment['text'] for segment in result['segments']] + [result['text']]
+            sentiments = pipeline.cpu_pool.run(sa.analyze_batch, texts)
+            for segment, sentiment in zip(result['segments'], sentiments):
+                if segment['text']:
+                    segment['sentiment'] = sentiment
+            result['sentiment'] = sentiments[-1]
+        job['result'] = result
+        job['status'] = 'completed'
+    except Exception as e:
+        logger.error(f"Batch transcription job {job['id']} failed: {str(e)}")
+        job['status'], job['error'] = 'failed', str(e)
+        tracing.annotate(job['id'], error=type(e).__name__)
+    finally:
+        tracing.end_trace(job['id'])
+    
+    if sid:
+        socketio.emit('batch_complete', job, to=sid)
+
 @socketio.on('connect')
 def handle_connect():
     """Handle client connection"""
@@ -60,13 +229,29 @@ def handle_connect():
     emit('settings', {
         'model': active_model,
         'noiseReduction': noise_reduction_enabled,
-        'sentimentAnalysis': sentiment_analysis_enabled
+        'sentimentAnalysis': sentiment_analysis_enabled,
+        'voiceActivityDetection': vad_enabled
     })
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
     logger.debug('Client disconnected')
+    queue = session_queues.pop(request.sid, None)
+    if queue:
+        # The session's pipeline task stops before its next chunk; the
+        # chunks it won't get to are released here
+        release_chunks(len(queue))
+        queue.clear()
+    release_session_state(request.sid)
+
+def release_session_state(sid):
+    """Release the state the pipeline stages keep for a session"""
+    pcm_buffers.pop(sid, None)
+    nr.release_stream_reducer(sid)
+    vad.release_stream_vad(sid)
+    an.release_session(sid)
+    srs.release_session(sid)
 
 @socketio.on('audio_data')
 def handle_audio_data(data):
@@ -89,10 +274,484 @@ def handle_audio_data(data):
             text = demo_data.get('text', '')
             
             pm.update_metrics(model, processing_time, confidence, len(text) if text else 0)
-            emit('performance_metrics', pm.get_metrics())
+            metrics_broadcaster.mark_dirty()
             
             return
         
+        # Shed load when the whole server is saturated. This is checked
+        # before live PCM frames are buffered, so clips already collected
+        # aren't lost; a frame joining a queued frame of its stream takes no
+        # new slot and is let through.
+        sid = request.sid
+        if in_flight_chunks >= MAX_GLOBAL_IN_FLIGHT and not can_join_stream_frame(session_queues.get(sid), data):
+            reject_busy(sid)
+            return
+        
+        # Live PCM frames are collected into clips first
+        for chunk in buffer_pcm_frame(sid, data):
+            # Validate audio data
+            if not chunk.get('audio') and not chunk.get('final') and not chunk.get('force_demo_mode', False):
+                logger.warning("No audio data received and not in demo mode")
+                emit('error', {'message': 'No audio data received'})
+                continue
+            enqueue_chunk(sid, chunk)
+        
+    except Exception as e:
+        logger.error(f"Error processing audio data: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        emit('error', {'message': str(e)})
+
+def buffer_pcm_frame(sid, data):
+    """
+    Join a session's live PCM frames into clips for models that recognize whole clips
+    
+    A clip is complete once it holds PCM_CLIP_SECONDS of audio or the client
+    marks a frame as 'final' (recording stopped). A change of format or model
+    completes the clip collected so far.
+    
+    Returns:
+        List of chunks to queue: the data itself if it isn't a PCM frame or
+        its model streams, otherwise the completed clips, if any. Empty
+        frames are only queued to end a stream.
+    """
+    declared_format = data.get('format') or ''
+    model = data.get('model') or active_model
+    if (not isinstance(data.get('audio'), (bytes, bytearray, memoryview))
+            or not declared_format.lower().startswith(ac.PCM_MIME_TYPE)):
+        return [data]
+    if srs.supports_streaming(model):
+        # The final frame ends the utterance in progress, even when it is empty
+        return [data] if len(data['audio']) or data.get('final') else []
+    
+    audio_format = ac.parse_pcm_format(declared_format)
+    chunks = []
+    buffer = pcm_buffers.get(sid)
+    if buffer is not None and (buffer['format'] != declared_format or buffer['model'] != model):
+        chunks.append(flush_pcm_buffer(sid))
+        buffer = None
+    if buffer is None:
+        buffer = pcm_buffers[sid] = {'format': declared_format, 'model': model, 'frames': [], 'bytes': 0}
+    
+    buffer['frames'].append(bytes(data['audio']))
+    buffer['bytes'] += len(data['audio'])
+    buffer['data'] = data
+    
+    clip_bytes = PCM_CLIP_SECONDS * audio_format.frame_rate * audio_format.channels * audio_format.sample_width
+    if buffer['bytes'] >= clip_bytes or data.get('final'):
+        chunks.append(flush_pcm_buffer(sid))
+    return [chunk for chunk in chunks if chunk['audio']]
+
+def flush_pcm_buffer(sid):
+    """Take a session's buffered PCM frames as one chunk (with the fields of its last frame)"""
+    buffer = pcm_buffers.pop(sid)
+    return {**buffer['data'], 'audio': b''.join(buffer['frames'])}
+
+def enqueue_chunk(sid, data):
+    """
+    Queue a chunk for the session's pipeline
+    
+    Each session's chunks are processed in order by a background task so the
+    handler never blocks the event loop. A session that outpaces the server
+    loses its oldest queued chunk, except for live stream frames, which are
+    joined instead (see join_stream_frame).
+    """
+    queue = session_queues.setdefault(sid, deque())
+    if join_stream_frame(queue, data):
+        return
+    if len(queue) >= MAX_SESSION_QUEUE:
+        queue.popleft()
+        release_chunks(1)
+        pm.record_pipeline_event('dropped_overflow')
+        logger.warning(f"Session {sid} queue full, dropped oldest chunk")
+    
+    queue.append((time.perf_counter_ns(), data))
+    admit_chunk()
+    if sid not in active_sessions:
+        active_sessions.add(sid)
+        socketio.start_background_task(run_session_pipeline, sid)
+
+def can_join_stream_frame(queue, data):
+    """Whether a chunk is a streaming model's PCM frame that join_stream_frame can add to the queue's last chunk"""
+    if not queue:
+        return False
+    queued = queue[-1][1]
+    declared_format = data.get('format') or ''
+    model = data.get('model') or active_model
+    return (declared_format.lower().startswith(ac.PCM_MIME_TYPE)
+            and isinstance(data.get('audio'), (bytes, bytearray, memoryview))
+            and isinstance(queued.get('audio'), (bytes, bytearray, memoryview))
+            and queued.get('format') == declared_format and (queued.get('model') or active_model) == model
+            and not queued.get('final') and not queued.get('force_demo_mode')
+            and srs.supports_streaming(model))
+
+def join_stream_frame(queue, data):
+    """
+    Append a streaming model's PCM frame to the frame of the same stream queued before it
+    
+    Live frames are short (100-200ms), so a queue of MAX_SESSION_QUEUE of
+    them would hold well under a second of audio, and dropping one cuts
+    audio out of the middle of the stream and corrupts the recognizer's
+    decoder state. Frames waiting behind each other are joined instead,
+    which also means fewer, larger recognizer calls once the pipeline
+    catches up.
+    
+    Returns:
+        True if the frame was joined, False if it needs its own queue entry
+    """
+    if not can_join_stream_frame(queue, data):
+        return False
+    
+    # The joined chunk keeps the first frame's receive time for the staleness check
+    received_at, queued = queue[-1]
+    queue[-1] = (received_at, {**data, 'audio': bytes(queued['audio']) + bytes(data['audio'])})
+    pm.record_pipeline_event('coalesced')
+    return True
+
+def update_queue_gauges():
+    """Publish queue depth and in-flight counts to the performance metrics"""
+    queue_depth = sum(len(queue) for queue in session_queues.values())
+    pm.update_pipeline_gauges(queue_depth, in_flight_chunks, pipeline.get_pool_stats())
+
+def admit_chunk():
+    """Count a chunk entering the pipeline"""
+    global in_flight_chunks
+    in_flight_chunks += 1
+    pm.record_pipeline_event('accepted')
+    update_queue_gauges()
+
+def release_chunks(count):
+    """Count chunks leaving the pipeline (processed or dropped)"""
+    global in_flight_chunks
+    in_flight_chunks = max(0, in_flight_chunks - count)
+    update_queue_gauges()
+
+def get_retry_after_ms():
+    """Estimate how long a rejected client should wait before sending more audio"""
+    backlog = in_flight_chunks / max(1, pipeline.stream_pool.max_workers)
+    return max(MIN_RETRY_AFTER_MS, int(pm.get_average_processing_time() * backlog))
+
+def reject_busy(sid):
+    """Tell a client the server is overloaded and when to retry"""
+    pm.record_pipeline_event('rejected_busy')
+    retry_after = get_retry_after_ms()
+    logger.warning(f"Server busy, rejecting audio chunk from {sid} (retry after {retry_after}ms)")
+    socketio.emit('busy', {'message': 'Server busy', 'retry_after': retry_after}, to=sid)
+
+def run_session_pipeline(sid):
+    """
+    Process the queued audio chunks of a session in order, skipping stale ones
+    
+    Stops once the client disconnects (handle_disconnect removes its queue).
+    Each chunk's in-flight slot is released here once it is taken off the
+    queue, or by handle_disconnect if it is still queued.
+    """
+    queue = session_queues.get(sid)
+    try:
+        while queue and session_queues.get(sid) is queue:
+            received_at, data = queue.popleft()
+            # The chunk's trace starts when it was received, so it includes the queue wait
+            tracing.start_trace(sid, 'chunk', start_ns=received_at)
+            tracing.span(sid, 'queue', start_ns=received_at).end()
+            try:
+                if (time.perf_counter_ns() - received_at) / 1e9 > STALE_CHUNK_SECONDS:
+                    pm.record_pipeline_event('dropped_stale')
+                    tracing.annotate(sid, dropped='stale')
+                    logger.warning(f"Dropped stale audio chunk for session {sid}")
+                    continue
+                process_audio_data(sid, data)
+            finally:
+                tracing.end_trace(sid)
+                release_chunks(1)
+    finally:
+        active_sessions.discard(sid)
+        if queue is not None and session_queues.get(sid) is not queue:
+            # The client disconnected while a chunk was being processed,
+            # which may have created session state again
+            release_session_state(sid)
+
+def finish_utterance(sid, model):
+    """
+    Finalize the utterance in progress of a live stream
+    
+    Returns:
+        List of (text, confidence) tuples for the finalized utterance
+    """
+    # The denoised overlap-add tail still belongs to this utterance; the
+    # next one starts with empty buffers (noise estimates are kept)
+    tail = nr.flush_stream_reducer(sid) if noise_reduction_enabled else None
+    nr.reset_stream_reducer(sid)
+    vad.reset_stream_vad(sid)
+    with tracing.span(sid, 'recognize', model=model), mr.router.track(model):
+        finals = []
+        if tail:
+            finals, _ = pipeline.stream_pool.run(srs.recognize_stream, tail, sid, model)
+        return finals + pipeline.stream_pool.run(srs.finish_stream, sid, model)
+
+def feed_stream_chunk(sid, audio_data, model):
+    """
+    Feed a chunk of a live stream to the session's streaming recognizer
+    
+    Returns:
+        List of (text, confidence) tuples for utterances completed by this chunk
+    """
+    # Skip silence between utterances before any denoising or decoding
+    # work. Pauses inside an utterance are still decoded, and only
+    # sustained silence ends it (see vad.StreamingVAD).
+    end_of_utterance = False
+    if vad_enabled:
+        with tracing.span(sid, 'vad'):
+            audio_data, vad_stats = pipeline.stream_pool.run(vad.apply_vad, audio_data, session_id=sid)
+        pm.record_vad_result(vad_stats['duration'], vad_stats['skipped'])
+        
+        if audio_data is None:
+            return []
+        end_of_utterance = vad_stats['end_of_utterance']
+    
+    # Apply noise reduction if enabled
+    if noise_reduction_enabled:
+        logger.debug("Applying noise reduction")
+        with tracing.span(sid, 'denoise'):
+            audio_data = pipeline.stream_pool.run(nr.reduce_noise, audio_data, session_id=sid)
+    
+    logger.debug(f"Processing with session {model} recognizer")
+    with tracing.span(sid, 'recognize', model=model), mr.router.track(model):
+        finals, partial = pipeline.stream_pool.run(srs.recognize_stream, audio_data, sid, model)
+    
+    if end_of_utterance:
+        logger.debug("Silence after speech, finishing current utterance")
+        return finals + finish_utterance(sid, model)
+    
+    if partial:
+        with tracing.span(sid, 'emit'):
+            socketio.emit('transcription_partial', {
+                'text': partial,
+                'model': model,
+                'timestamp': pm.get_current_time()
+            }, to=sid)
+    
+    return finals
+
+def recognize_stream_chunk(sid, audio_data, model, final=False):
+    """
+    Recognize a chunk of a live stream
+    
+    Args:
+        sid: Session id
+        audio_data: Normalized audio of the chunk (may be empty for the final chunk)
+        model: Streaming model
+        final: The recording stopped with this chunk; the utterance in
+            progress is finalized instead of waiting for an endpoint
+    
+    Returns:
+        List of (text, confidence) tuples for utterances completed by this chunk
+    """
+    finals = feed_stream_chunk(sid, audio_data, model) if audio_data else []
+    if final:
+        logger.debug("Stream ended, finishing current utterance")
+        finals = finals + finish_utterance(sid, model)
+    return finals
+
+def normalize_audio(sid, audio_data, model, declared_format=None, routed=False):
+    """
+    Convert a chunk to the mono sample rate its model wants
+    
+    Live streams keep their resampler state between chunks; other chunks are
+    resampled on their own. Compare mode uses the default rate for all models.
+    Routed chunks are never streamed, since the next chunk of the session may
+    go to a different model.
+    """
+    stream = model != COMPARE_MODE and not routed and srs.supports_streaming(model)
+    target_rate = an.TARGET_RATE if model == COMPARE_MODE else srs.get_sample_rate(model)
+    with tracing.span(sid, 'resample') as span:
+        audio_data, stats = pipeline.stream_pool.run(
+            an.normalize_audio, audio_data, target_rate,
+            session_id=sid, stream=stream, declared_format=declared_format
+        )
+        span.attributes.update(container=stats['container'], frame_rate=stats['frame_rate'])
+    pm.record_normalization(stats['input_bytes'], stats['output_bytes'], stats['duration'])
+    return audio_data
+
+def get_cache_key(audio_data, model):
+    """Transcription cache key for a clip recognized with the current settings"""
+    try:
+        pcm, frame_rate = srs.extract_pcm(audio_data)
+    except Exception:
+        pcm, frame_rate = audio_data, 0
+    
+    return tc.make_key(pcm, frame_rate, model, srs.get_model_version(model),
+                       noise_reduction_enabled, vad_enabled)
+
+def preprocess_clip(sid, audio_data):
+    """
+    Run voice activity detection and noise reduction on a self-contained clip
+    
+    Returns:
+        Processed audio bytes, or None if the clip has no speech
+    """
+    # Skip silent chunks and trim silence off the rest before any
+    # denoising or recognition work
+    if vad_enabled:
+        with tracing.span(sid, 'vad'):
+            audio_data, vad_stats = pipeline.stream_pool.run(vad.apply_vad, audio_data, trim=True)
+        pm.record_vad_result(vad_stats['duration'], vad_stats['skipped'])
+        
+        if audio_data is None:
+            logger.debug("Skipping silent audio chunk")
+            return None
+    
+    # Apply noise reduction if enabled. Clips are trimmed and not contiguous,
+    # so each is denoised on its own rather than with the session's
+    # streaming reducer, whose overlap and noise estimate would carry over
+    if noise_reduction_enabled:
+        logger.debug("Applying noise reduction")
+        with tracing.span(sid, 'denoise'):
+            audio_data = pipeline.stream_pool.run(nr.reduce_noise, audio_data)
+    
+    return audio_data
+
+def get_recognition_pool(model):
+    """Worker pool for a model: local decoding is CPU work, cloud models are network calls"""
+    return pipeline.stream_pool if srs.is_local_model(model) else pipeline.io_pool
+
+def recognize_clip(sid, audio_data, model):
+    """
+    Recognize a self-contained audio chunk, reusing cached results for
+    audio that has been recognized before
+    
+    Returns:
+        Tuple of (text, confidence), or None if the chunk has no speech
+    """
+    with tracing.span(sid, 'cache'):
+        cache_key = get_cache_key(audio_data, model)
+        cached = tc.cache.get(cache_key)
+    if cached is not None:
+        logger.debug("Using cached transcription")
+        return cached
+    
+    audio_data = preprocess_clip(sid, audio_data)
+    if audio_data is None:
+        return None
+    
+    # Process with selected model
+    logger.debug(f"Processing with {model} model")
+    with tracing.span(sid, 'recognize', model=model), mr.router.track(model):
+        text, confidence = get_recognition_pool(model).run(srs.recognize_speech, audio_data, model)
+    
+    if text:
+        tc.cache.put(cache_key, text, confidence)
+    
+    return text, confidence
+
+def analyze_sentiment(text):
+    """Sentiment of a transcription, from the cache or computed in the CPU pool"""
+    sentiment = sa.get_cached_sentiment(text)
+    if sentiment is None:
+        sentiment = pipeline.cpu_pool.run(sa.analyze_sentiment, text)
+        sa.cache_sentiment(text, sentiment)
+    return sentiment
+
+def emit_comparison_result(sid, comparison_id, model, text, confidence, processing_time, cached=False):
+    """Send one model's result of a comparison to the client and record its metrics"""
+    response = {
+        'text': text,
+        'model': model,
+        'confidence': confidence,
+        'processing_time': processing_time,
+        'demo_mode': False,
+        'cached': cached,
+        'comparison_id': comparison_id,
+        'timestamp': pm.get_current_time()
+    }
+    
+    if sentiment_analysis_enabled and text:
+        with tracing.span(sid, 'sentiment'):
+            response['sentiment'] = analyze_sentiment(text)
+    
+    if not cached:
+        pm.update_metrics(model, processing_time, confidence, len(text) if text else 0)
+    
+    with tracing.span(sid, 'emit'):
+        socketio.emit('transcription_result', response, to=sid)
+
+def run_comparison(sid, audio_data, chunk_id=None):
+    """
+    Recognize one clip with every available model concurrently
+    
+    The clip is decoded, checked for speech and denoised once, then sent to
+    all backends at the same time. Each result is emitted as soon as its
+    model finishes, followed by a comparison_complete summary with the
+    per-model latencies.
+    """
+    comparison_id = uuid.uuid4().hex
+    models = [m['id'] for m in srs.get_available_models() if m['available']]
+    summary = {}
+    
+    # Serve cached results straight away
+    with tracing.span(sid, 'cache'):
+        cache_keys = {model: get_cache_key(audio_data, model) for model in models}
+        cached_results = {model: tc.cache.get(cache_keys[model]) for model in models}
+    to_recognize = []
+    for model in models:
+        cached = cached_results[model]
+        if cached is None:
+            to_recognize.append(model)
+            continue
+        text, confidence = cached
+        emit_comparison_result(sid, comparison_id, model, text, confidence, 0, cached=True)
+        summary[model] = {'text': text, 'confidence': confidence, 'processing_time': 0, 'cached': True}
+    
+    if to_recognize:
+        processed = preprocess_clip(sid, audio_data)
+        
+        if processed is not None:
+            start_time = pm.start_timer()
+            futures = {
+                get_recognition_pool(model).submit(srs.recognize_speech, processed, model): model
+                for model in to_recognize
+            }
+            # The models run side by side, so each gets its own timeline lane
+            spans = {future: tracing.span(sid, 'recognize', lane=f"{sid} {model}", start_ns=start_time, model=model)
+                     for future, model in futures.items()}
+            
+            # Take each model's latency when it finishes, not when we get to it
+            finish_times = {}
+            for future in futures:
+                future.add_done_callback(lambda f: finish_times.setdefault(f, time.perf_counter_ns()))
+            
+            for future in pipeline.as_completed(futures):
+                model = futures[future]
+                finished_at = finish_times.get(future, time.perf_counter_ns())
+                spans[future].end(finished_at)
+                processing_time = (finished_at - start_time) / 1e6
+                error = None
+                try:
+                    text, confidence = future.result()
+                except Exception as e:
+                    logger.error(f"Error in {model} comparison: {str(e)}")
+                    text, confidence, error = "", 0.0, str(e)
+                
+                if text:
+                    tc.cache.put(cache_keys[model], text, confidence)
+                emit_comparison_result(sid, comparison_id, model, text, confidence, processing_time)
+                summary[model] = {'text': text, 'confidence': confidence,
+                                  'processing_time': processing_time, 'cached': False}
+                if error:
+                    summary[model]['error'] = error
+    
+    complete = {
+        'comparison_id': comparison_id,
+        'results': summary,
+        'timestamp': pm.get_current_time()
+    }
+    if chunk_id is not None:
+        complete['chunk_id'] = chunk_id
+    socketio.emit('comparison_complete', complete, to=sid)
+    metrics_broadcaster.mark_dirty()
+
+def process_audio_data(sid, data):
+    """Run an audio chunk through the processing pipeline and emit the results to its session"""
+    try:
         # Check if we're in forced demo mode
         force_demo_mode = data.get('force_demo_mode', False)
         
@@ -103,32 +762,73 @@ def handle_audio_data(data):
         # Use client model if provided, otherwise use active model
         model_to_use = model_pref if model_pref else active_model
         
-        # Validate audio data
-        if not audio_data and not force_demo_mode:
-            logger.warning("No audio data received and not in demo mode")
-            emit('error', {'message': 'No audio data received'})
-            return
-        
         # Log info about the received data
         if audio_data:
-            audio_prefix = audio_data.split(',')[0] if ',' in audio_data else 'unknown'
+            if isinstance(audio_data, (bytes, bytearray, memoryview)):
+                audio_prefix = data.get('format', 'binary')
+            else:
+                audio_prefix = audio_data.split(',')[0] if ',' in audio_data else 'unknown'
             audio_length = len(audio_data)
             logger.debug(f"Audio data received: format={audio_prefix}, length={audio_length}")
         
         # Start timing the processing
-        start_time = pm.get_current_time()
+        start_time = pm.start_timer()
+        
+        # In auto mode the router picks the backend of each chunk
+        routed = model_to_use == mr.AUTO_MODEL
+        if routed:
+            model_to_use = mr.router.choose()
+        tracing.annotate(sid, model=model_to_use, routed=routed)
+        
+        # The last chunk of a live stream finalizes its utterance in progress
+        end_of_stream = bool(data.get('final')) and not routed and srs.supports_streaming(model_to_use)
         
         # Process the audio if not in demo mode
-        if not force_demo_mode and audio_data:
+        if not force_demo_mode and (audio_data or end_of_stream):
             try:
-                # Apply noise reduction if enabled
-                if noise_reduction_enabled:
-                    logger.debug("Applying noise reduction")
-                    audio_data = nr.reduce_noise(audio_data)
+                # Decode the payload once; binary frames are used as-is and
+                # everything downstream works on the raw bytes
+                if audio_data:
+                    with tracing.span(sid, 'decode'):
+                        audio_data = nr.audio_payload_to_bytes(audio_data)
+                    audio_data = normalize_audio(sid, audio_data, model_to_use, data.get('format'), routed)
                 
-                # Process with selected model
-                logger.debug(f"Processing with {model_to_use} model")
-                text, confidence = srs.recognize_speech(audio_data, model_to_use)
+                # Compare mode runs every available model on the same clip
+                if model_to_use == COMPARE_MODE:
+                    run_comparison(sid, audio_data, data.get('chunk_id'))
+                    return
+                
+                # Streaming models (Vosk) decode the live stream incrementally per session
+                if not routed and srs.supports_streaming(model_to_use):
+                    finals = recognize_stream_chunk(sid, audio_data, model_to_use, final=end_of_stream)
+                    
+                    # No endpoint in this chunk yet: wait for more audio
+                    # rather than falling back to demo text
+                    if not finals:
+                        return
+                    
+                    text = ' '.join(final_text for final_text, _ in finals)
+                    confidence = sum(conf for _, conf in finals) / len(finals)
+                else:
+                    try:
+                        result = recognize_clip(sid, audio_data, model_to_use)
+                    except ch.UpstreamError as e:
+                        # A routed chunk is retried on the local fallback rather than lost
+                        fallback = mr.router.get_fallback(model_to_use) if routed else None
+                        if fallback is None:
+                            raise
+                        logger.warning(f"{model_to_use} failed ({str(e)}), retrying with {fallback}")
+                        if srs.get_sample_rate(fallback) != srs.get_sample_rate(model_to_use):
+                            audio_data = normalize_audio(sid, audio_data, fallback, routed=True)
+                        model_to_use = fallback
+                        tracing.annotate(sid, model=model_to_use, failover=True)
+                        result = recognize_clip(sid, audio_data, model_to_use)
+                    
+                    # Nothing to recognize in a silent chunk
+                    if result is None:
+                        return
+                    
+                    text, confidence = result
                 
                 # Check if we got a result
                 if text:
@@ -137,8 +837,11 @@ def handle_audio_data(data):
                 else:
                     logger.warning("No text recognized, falling back to demo mode")
                     use_demo_mode = True
+            except (pipeline.QueueFullError, ch.UpstreamError):
+                raise
             except Exception as e:
                 logger.error(f"Error in speech recognition: {str(e)}")
+                sm.inc('stt_backend_errors_total', backend=model_to_use, reason='error')
                 use_demo_mode = True
         else:
             logger.info("Using demo mode as requested")
@@ -177,39 +880,55 @@ def handle_audio_data(data):
             'demo_mode': use_demo_mode,
             'timestamp': pm.get_current_time()
         }
+        if routed:
+            response['routed'] = True
+        
+        # Echo the client's chunk id so it can match results to chunks
+        if 'chunk_id' in data:
+            response['chunk_id'] = data['chunk_id']
         
         # Add sentiment analysis if enabled
         if sentiment_analysis_enabled and text:
             logger.debug("Analyzing sentiment")
-            sentiment = sa.analyze_sentiment(text)
+            with tracing.span(sid, 'sentiment'):
+                sentiment = analyze_sentiment(text)
             response['sentiment'] = sentiment
         
         # Update performance metrics
         pm.update_metrics(model_to_use, processing_time, confidence, len(text) if text else 0)
         
         # Send the results back to the client
-        emit('transcription_result', response)
-        logger.debug("Sent transcription result to client")
+        with tracing.span(sid, 'emit'):
+            socketio.emit('transcription_result', response, to=sid)
+            logger.debug("Sent transcription result to client")
         
-        # Send updated performance metrics
-        emit('performance_metrics', pm.get_metrics())
+        # Subscribers get the updated metrics with the next push
+        metrics_broadcaster.mark_dirty()
         
+    except pipeline.QueueFullError as e:
+        logger.warning(f"Dropping audio chunk: {str(e)}")
+        reject_busy(sid)
+    except ch.UpstreamError as e:
+        # Tell the client instead of answering with demo text
+        logger.warning(f"Recognition backend unavailable: {str(e)}")
+        socketio.emit('error', {'message': str(e), 'model': data.get('model') or active_model}, to=sid)
     except Exception as e:
         logger.error(f"Error processing audio data: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        emit('error', {'message': str(e)})
+        socketio.emit('error', {'message': str(e)}, to=sid)
 
 @socketio.on('get_performance_metrics')
 def handle_get_performance_metrics():
-    """Send performance metrics to client"""
-    emit('performance_metrics', pm.get_metrics())
+    """Send performance metrics to client and subscribe it to updates"""
+    metrics_broadcaster.subscribe(request.sid)
 
 @socketio.on('reset_performance_metrics')
 def handle_reset_performance_metrics():
     """Reset performance metrics"""
     pm.reset_metrics()
-    emit('performance_metrics', pm.get_metrics())
+    metrics_broadcaster.mark_dirty()
+    metrics_broadcaster.send_snapshot(request.sid)
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,210 @@
+import logging
+import struct
+from collections import namedtuple
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# WAV format tags
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Sample format of a PCM buffer
+AudioFormat = namedtuple('AudioFormat', ['frame_rate', 'channels', 'sample_width', 'is_float'])
+
+# 16kHz mono 16-bit, what the recognizers expect
+PCM16_MONO_16K = AudioFormat(16000, 1, 2, False)
+
+# MIME type of headerless little-endian PCM, e.g. 'audio/pcm;rate=16000;channels=1'
+# (add 'encoding=f32le' for 32-bit float samples)
+PCM_MIME_TYPE = 'audio/pcm'
+PCM_ENCODINGS = {'s16le': (2, False), 'f32le': (4, True)}
+
+class AudioFormatError(ValueError):
+    """Raised when audio data can't be parsed as a supported WAV/PCM format"""
+
+def parse_pcm_format(declared_format):
+    """
+    Get the sample format declared for headerless PCM
+
+    Args:
+        declared_format: MIME type sent by the client, e.g.
+            'audio/pcm;rate=16000;channels=1'
+
+    Returns:
+        AudioFormat, or None if the type isn't headerless PCM
+
+    Raises:
+        AudioFormatError: The parameters are invalid
+    """
+    if not declared_format:
+        return None
+    mime_type, *params = [part.strip() for part in declared_format.split(';')]
+    if mime_type.lower() != PCM_MIME_TYPE:
+        return None
+
+    values = dict(param.split('=', 1) for param in params if '=' in param)
+    try:
+        frame_rate = int(values.get('rate', PCM16_MONO_16K.frame_rate))
+        channels = int(values.get('channels', 1))
+        sample_width, is_float = PCM_ENCODINGS[values.get('encoding', 's16le').lower()]
+    except (ValueError, KeyError):
+        raise AudioFormatError(f"Invalid PCM format: {declared_format}")
+    if not 0 < frame_rate <= 384000 or not 0 < channels <= 8:
+        raise AudioFormatError(f"Invalid PCM format: {declared_format}")
+    return AudioFormat(frame_rate, channels, sample_width, is_float)
+
+def is_wav(audio_bytes):
+    """Whether the bytes start with a RIFF/WAVE header"""
+    return len(audio_bytes) >= 12 and bytes(audio_bytes[:4]) == b'RIFF' and bytes(audio_bytes[8:12]) == b'WAVE'
+
+def parse_wav(audio_bytes):
+    """
+    Locate the format and sample data of a WAV file without copying
+
+    Args:
+        audio_bytes: WAV file contents (bytes, bytearray or memoryview)
+
+    Returns:
+        Tuple of (AudioFormat, data) where data is a memoryview of the
+        sample bytes inside audio_bytes
+    """
+    view = memoryview(audio_bytes).cast('B')
+    if not is_wav(view):
+        raise AudioFormatError("Not a RIFF/WAVE file")
+
+    audio_format = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        chunk_size = struct.unpack_from('<I', view, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b'fmt ':
+            format_tag, channels, frame_rate = struct.unpack_from('<HHI', view, body)
+            bits_per_sample = struct.unpack_from('<H', view, body + 14)[0]
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # The real format tag is the start of the sub-format GUID
+                format_tag = struct.unpack_from('<H', view, body + 24)[0]
+            if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                raise AudioFormatError(f"Unsupported WAV format tag: {format_tag:#06x}")
+            if channels == 0 or frame_rate == 0 or bits_per_sample // 8 == 0:
+                raise AudioFormatError(f"Invalid WAV format: {channels} channels, {frame_rate} Hz, "
+                                       f"{bits_per_sample} bits per sample")
+            audio_format = AudioFormat(frame_rate, channels, bits_per_sample // 8,
+                                       format_tag == WAVE_FORMAT_IEEE_FLOAT)
+        elif chunk_id == b'data':
+            if audio_format is None:
+                raise AudioFormatError("WAV data chunk before fmt chunk")
+            # Streamed WAVs may have a placeholder size; clamp to what we have
+            end = min(body + chunk_size, len(view))
+            frame_bytes = audio_format.channels * audio_format.sample_width
+            end -= (end - body) % frame_bytes
+            return audio_format, view[body:end]
+
+        # Chunks are padded to an even size
+        offset = body + chunk_size + (chunk_size & 1)
+
+    raise AudioFormatError("WAV file has no data chunk")
+
+def pcm_to_array(data, audio_format):
+    """
+    Interpret PCM bytes as integer or float samples
+
+    16/32-bit integer and float data is returned as a read-only view of the
+    buffer; 8-bit and 24-bit data has to be converted.
+
+    Returns:
+        (n_frames, channels) array; channel i is the strided view [:, i]
+    """
+    width = audio_format.sample_width
+    if audio_format.is_float:
+        dtypes = {4: '<f4', 8: '<f8'}
+    else:
+        dtypes = {1: 'u1', 2: '<i2', 4: '<i4'}
+
+    if width in dtypes:
+        samples = np.frombuffer(data, dtype=dtypes[width])
+    elif width == 3 and not audio_format.is_float:
+        # Sign-extend packed little-endian 24-bit samples into int32
+        raw = np.frombuffer(data, dtype='u1').reshape(-1, 3).astype('<i4')
+        samples = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8
+    else:
+        raise AudioFormatError(f"Unsupported sample width: {width} bytes "
+                               f"({'float' if audio_format.is_float else 'integer'})")
+
+    return samples.reshape(-1, audio_format.channels)
+
+def array_to_float(samples, audio_format):
+    """Convert integer or float samples to float32 in [-1, 1]"""
+    if audio_format.is_float:
+        return samples.astype(np.float32, copy=False)
+    if audio_format.sample_width == 1:
+        # 8-bit WAV is unsigned
+        return (samples.astype(np.float32) - 128.0) / 128.0
+    scale = float(1 << (8 * audio_format.sample_width - 1))
+    return samples.astype(np.float32) / scale
+
+def decode_wav(audio_bytes):
+    """
+    Decode a WAV file to float samples
+
+    Returns:
+        Tuple of (samples, AudioFormat) with samples a float32
+        (n_frames, channels) array in [-1, 1]
+    """
+    audio_format, data = parse_wav(audio_bytes)
+    return array_to_float(pcm_to_array(data, audio_format), audio_format), audio_format
+
+def float_to_pcm16(samples):
+    """Convert float samples in [-1, 1] to little-endian 16-bit PCM bytes"""
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+def wav_header(data_size, frame_rate, channels=1, sample_width=2, is_float=False):
+    """Build a 44-byte canonical WAV header"""
+    format_tag = WAVE_FORMAT_IEEE_FLOAT if is_float else WAVE_FORMAT_PCM
+    block_align = channels * sample_width
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, format_tag, channels, frame_rate,
+                       frame_rate * block_align, block_align, sample_width * 8,
+                       b'data', data_size)
+
+def encode_wav(samples, frame_rate, channels=1):
+    """
+    Encode float samples as a 16-bit PCM WAV file
+
+    Args:
+        samples: Float samples in [-1, 1], interleaved 1-D or (n_frames, channels)
+        frame_rate: Sample rate
+        channels: Number of channels
+
+    Returns:
+        WAV file bytes
+    """
+    data = float_to_pcm16(samples)
+    return wav_header(len(data), frame_rate, channels) + data
+
+def to_pcm16_mono(audio_bytes):
+    """
+    Get 16-bit mono PCM for the recognizers
+
+    16-bit mono WAV data is returned as a view into the input without
+    copying; other formats are downmixed and converted. Headerless input is
+    assumed to already be 16kHz mono 16-bit PCM.
+
+    Returns:
+        Tuple of (pcm, frame_rate)
+    """
+    if not is_wav(audio_bytes):
+        return audio_bytes, PCM16_MONO_16K.frame_rate
+
+    audio_format, data = parse_wav(audio_bytes)
+    if audio_format.channels == 1 and audio_format.sample_width == 2 and not audio_format.is_float:
+        return data, audio_format.frame_rate
+
+    samples = array_to_float(pcm_to_array(data, audio_format), audio_format)
+    return float_to_pcm16(samples.mean(axis=1)), audio_format.frame_rate
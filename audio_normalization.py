@@ -0,0 +1,324 @@
+import os
+import logging
+import shutil
+import subprocess
+from math import gcd
+from functools import lru_cache
+import numpy as np
+import audio_codec as ac
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Sample rate the recognizers decode at, unless a backend asks for another
+TARGET_RATE = int(os.environ.get("AUDIO_TARGET_RATE", 16000))
+# ffmpeg is only needed to decode compressed uploads (WebM/Ogg/MP4 from MediaRecorder)
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH") or shutil.which("ffmpeg")
+FFMPEG_TIMEOUT = 30  # Seconds
+
+# Anti-aliasing filter parameters (same defaults as scipy.signal.resample_poly)
+FILTER_HALF_WIDTH = 10  # Zero crossings of the sinc on each side
+KAISER_BETA = 5.0
+# Output samples computed per block, bounds the memory of the gather step
+RESAMPLE_BLOCK = 16384
+
+# Container magic numbers
+CONTAINER_MAGIC = [
+    (0, b'RIFF', 'wav'),
+    (0, b'\x1aE\xdf\xa3', 'webm'),
+    (0, b'OggS', 'ogg'),
+    (4, b'ftyp', 'mp4'),
+]
+
+# Per-session resamplers, keyed by (input rate, output rate)
+session_resamplers = {}
+
+@lru_cache(maxsize=32)
+def design_filter(up, down):
+    """
+    Design the polyphase anti-aliasing filter for a rational rate change
+
+    Args:
+        up: Upsampling factor
+        down: Downsampling factor
+
+    Returns:
+        Tuple of (phases, taps, delay). phases is a read-only (up, taps)
+        array whose row p holds the filter coefficients of phase p in
+        reverse order, so a phase is applied as a dot product with the
+        last `taps` input samples. delay is the filter's group delay in
+        upsampled samples.
+    """
+    max_rate = max(up, down)
+    half_len = FILTER_HALF_WIDTH * max_rate
+    n = np.arange(2 * half_len + 1) - half_len
+
+    # Windowed sinc low-pass at the lower of the two Nyquist rates
+    cutoff = 1.0 / max_rate
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(len(n), KAISER_BETA)
+    h *= up / h.sum()
+
+    # Split into `up` phases: phase p holds h[p], h[p + up], h[p + 2 * up], ...
+    taps = -(-len(h) // up)
+    h = np.pad(h, (0, taps * up - len(h)))
+    phases = np.ascontiguousarray(h.reshape(taps, up).T[:, ::-1], dtype=np.float32)
+    phases.flags.writeable = False
+
+    logger.debug(f"Designed {up}/{down} resampling filter: {up} phases x {taps} taps")
+    return phases, taps, half_len
+
+class Resampler:
+    """
+    Vectorized polyphase resampler between two fixed sample rates
+
+    Only the output samples that are kept are computed: each one is a dot
+    product of one filter phase with a window of input samples, gathered for
+    a whole block at once. In streaming mode the input history and phase are
+    carried between chunks, so chunk boundaries don't produce clicks.
+    """
+
+    def __init__(self, in_rate, out_rate):
+        """
+        Args:
+            in_rate: Input sample rate
+            out_rate: Output sample rate
+        """
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        divisor = gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.phases, self.taps, self.delay = design_filter(self.up, self.down)
+        self.reset()
+
+    def reset(self):
+        """Forget the stream history"""
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.consumed = 0  # Input samples seen by process()
+        self.produced = 0  # Output samples returned by process()
+
+    def _filter(self, buffer, base, positions):
+        """
+        Compute output samples from a buffer of input samples
+
+        Args:
+            buffer: Input samples, buffer[0] is input sample number `base`
+            base: Input sample number of the first buffer entry
+            positions: Upsampled positions of the output samples
+        """
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, self.taps)
+        output = np.empty(len(positions), dtype=np.float32)
+        for start in range(0, len(positions), RESAMPLE_BLOCK):
+            block = positions[start:start + RESAMPLE_BLOCK]
+            # Window ending at input sample block // up, filtered by phase block % up
+            rows = block // self.up - base - (self.taps - 1)
+            output[start:start + len(block)] = np.einsum(
+                'ij,ij->i', windows[rows], self.phases[block % self.up])
+        return output
+
+    def resample(self, samples):
+        """
+        Resample a complete clip
+
+        The filter delay is compensated, so the output lines up with the input.
+
+        Args:
+            samples: 1-D float samples
+
+        Returns:
+            1-D float32 samples at the output rate
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.up == self.down or len(samples) == 0:
+            return samples
+
+        n_out = -(-len(samples) * self.up // self.down)
+        positions = np.arange(n_out, dtype=np.int64) * self.down + self.delay
+        tail = self.delay // self.up + 1
+        buffer = np.concatenate([np.zeros(self.taps - 1, dtype=np.float32), samples,
+                                 np.zeros(tail, dtype=np.float32)])
+        return self._filter(buffer, -(self.taps - 1), positions)
+
+    def process(self, samples):
+        """
+        Resample the next chunk of a stream
+
+        Output is delayed by the filter's group delay (about 1 ms) rather than
+        waiting for future input.
+
+        Args:
+            samples: 1-D float samples following the previous chunk
+
+        Returns:
+            1-D float32 samples at the output rate
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.up == self.down or len(samples) == 0:
+            return samples
+
+        buffer = np.concatenate([self.history, samples])
+        base = self.consumed - (self.taps - 1)
+        self.consumed += len(samples)
+
+        # Every output whose last input sample has arrived
+        end = (self.consumed * self.up - 1) // self.down + 1
+        positions = np.arange(self.produced, end, dtype=np.int64) * self.down
+        self.produced = end
+
+        self.history = buffer[len(buffer) - (self.taps - 1):].copy()
+        return self._filter(buffer, base, positions)
+
+def get_session_resampler(session_id, in_rate, out_rate):
+    """Get the resampler for a session and rate pair, creating it if needed"""
+    resamplers = session_resamplers.setdefault(session_id, {})
+    resampler = resamplers.get((in_rate, out_rate))
+    if resampler is None:
+        logger.debug(f"Creating {in_rate} -> {out_rate} Hz resampler for session {session_id}")
+        resampler = Resampler(in_rate, out_rate)
+        resamplers[(in_rate, out_rate)] = resampler
+    return resampler
+
+def release_session(session_id):
+    """Release a session's resamplers"""
+    session_resamplers.pop(session_id, None)
+
+def resample(samples, in_rate, out_rate):
+    """Resample a complete clip (the filter design is cached per rate pair)"""
+    return Resampler(in_rate, out_rate).resample(samples)
+
+def detect_container(audio_bytes, declared_format=None):
+    """
+    Identify the container of an audio payload from its header
+
+    Args:
+        audio_bytes: Audio payload
+        declared_format: MIME type sent by the client, used for headerless data
+
+    Returns:
+        'wav', 'webm', 'ogg', 'mp4' or 'pcm'
+    """
+    # Declared raw PCM has no header that could be mistaken for one
+    if declared_format and declared_format.lower().startswith(ac.PCM_MIME_TYPE):
+        return 'pcm'
+
+    head = bytes(audio_bytes[:12])
+    for offset, magic, container in CONTAINER_MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return container
+
+    if declared_format:
+        for container in ('webm', 'ogg', 'mp4'):
+            if container in declared_format:
+                logger.debug(f"No {container} header found, trusting declared format {declared_format}")
+                return container
+    return 'pcm'
+
+def decode_compressed(audio_bytes, target_rate):
+    """
+    Decode a compressed recording with ffmpeg, straight to mono float samples
+
+    Returns:
+        1-D float32 samples at target_rate, or None if ffmpeg isn't available
+        or can't decode the data
+    """
+    if not FFMPEG_PATH:
+        return None
+
+    try:
+        result = subprocess.run(
+            [FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+             '-f', 'f32le', '-ac', '1', '-ar', str(target_rate), 'pipe:1'],
+            input=bytes(audio_bytes), capture_output=True, timeout=FFMPEG_TIMEOUT
+        )
+        if result.returncode != 0:
+            logger.error(f"ffmpeg failed to decode audio: {result.stderr.decode(errors='replace').strip()}")
+            return None
+        return np.frombuffer(result.stdout, dtype='<f4')
+    except Exception as e:
+        logger.error(f"Error running ffmpeg: {str(e)}")
+        return None
+
+def normalize_audio(audio_bytes, target_rate=TARGET_RATE, session_id=None, stream=False,
+                    declared_format=None):
+    """
+    Convert an audio payload to 16-bit mono WAV at the recognizers' sample rate
+
+    Reads the actual container header instead of assuming 16kHz mono, then
+    downmixes and resamples. WAV audio already in the target format is
+    returned unchanged without copying; headerless PCM in the target format
+    only gets a WAV header.
+
+    Args:
+        audio_bytes: Audio payload (WAV, WebM/Ogg/MP4, or headerless PCM in the
+            declared format, 16kHz mono 16-bit if none is declared)
+        target_rate: Sample rate the recognition backend wants
+        session_id: Reuse the session's resampler
+        stream: Chunks are contiguous parts of a live stream; keep filter state
+            between them (requires session_id)
+        declared_format: MIME type sent by the client
+
+    Returns:
+        Tuple of (audio, stats). audio is the normalized WAV bytes, or the
+        input unchanged if it is already normalized or can't be decoded.
+        stats has the container, input rate and channels, the duration in
+        seconds (None if unknown) and byte counts.
+    """
+    stats = {'container': None, 'frame_rate': None, 'channels': None, 'duration': None,
+             'input_bytes': len(audio_bytes), 'output_bytes': len(audio_bytes)}
+
+    try:
+        container = detect_container(audio_bytes, declared_format)
+        stats['container'] = container
+
+        if container == 'pcm':
+            # Headerless data in the format the client declared (16kHz mono 16-bit by default)
+            audio_format = ac.parse_pcm_format(declared_format) or ac.PCM16_MONO_16K
+            stats['frame_rate'], stats['channels'] = audio_format.frame_rate, audio_format.channels
+            frame_bytes = audio_format.channels * audio_format.sample_width
+            stats['duration'] = len(audio_bytes) // frame_bytes / audio_format.frame_rate
+            data = memoryview(audio_bytes).cast('B')
+            data = data[:len(data) - len(data) % frame_bytes]
+            if audio_format == ac.PCM16_MONO_16K._replace(frame_rate=target_rate):
+                # Only needs a header, which VAD and noise reduction read the format from
+                normalized = ac.wav_header(len(data), target_rate) + bytes(data)
+                stats['output_bytes'] = len(normalized)
+                return normalized, stats
+
+            samples = ac.array_to_float(ac.pcm_to_array(data, audio_format), audio_format)
+            samples = samples[:, 0] if audio_format.channels == 1 else samples.mean(axis=1)
+            frame_rate = audio_format.frame_rate
+        elif container == 'wav':
+            audio_format, data = ac.parse_wav(audio_bytes)
+            stats['frame_rate'], stats['channels'] = audio_format.frame_rate, audio_format.channels
+            stats['duration'] = len(data) / (audio_format.channels * audio_format.sample_width) / audio_format.frame_rate
+            if audio_format == ac.PCM16_MONO_16K._replace(frame_rate=target_rate):
+                return audio_bytes, stats
+
+            samples = ac.array_to_float(ac.pcm_to_array(data, audio_format), audio_format)
+            samples = samples[:, 0] if audio_format.channels == 1 else samples.mean(axis=1)
+            frame_rate = audio_format.frame_rate
+        else:
+            # ffmpeg downmixes and resamples compressed audio itself
+            samples = decode_compressed(audio_bytes, target_rate)
+            if samples is None:
+                logger.warning(f"Can't decode {container} audio without ffmpeg, passing it through unchanged")
+                return audio_bytes, stats
+            frame_rate = target_rate
+            stats['duration'] = len(samples) / frame_rate
+
+        if frame_rate != target_rate:
+            if session_id is not None:
+                resampler = get_session_resampler(session_id, frame_rate, target_rate)
+            else:
+                resampler = Resampler(frame_rate, target_rate)
+            samples = resampler.process(samples) if stream else resampler.resample(samples)
+
+        normalized = ac.encode_wav(samples, target_rate)
+        stats['output_bytes'] = len(normalized)
+        logger.debug(f"Normalized {container} audio ({stats['frame_rate']} Hz, {stats['channels']} ch) "
+                     f"to {target_rate} Hz mono: {stats['input_bytes']} -> {stats['output_bytes']} bytes")
+        return normalized, stats
+    except Exception as e:
+        logger.error(f"Error normalizing audio: {str(e)}")
+        return audio_bytes, stats
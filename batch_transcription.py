@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import logging
+import time
+import argparse
+import numpy as np
+import audio_codec as ac
+import audio_normalization as an
+import noise_reduction as nr
+import voice_activity_detection as vad
+import speech_recognition_service as srs
+import cloud_http as ch
+import pipeline
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Segmentation settings (overridable through environment variables)
+SEGMENT_MAX_SECONDS = float(os.environ.get("BATCH_SEGMENT_MAX_SECONDS", 30))
+SEGMENT_MIN_SECONDS = float(os.environ.get("BATCH_SEGMENT_MIN_SECONDS", 5))
+# Audio analysed by VAD at a time, bounds memory use on hour-long recordings
+VAD_BLOCK_SECONDS = 300
+
+def detect_speech(samples, frame_rate):
+    """
+    Run voice activity detection over a whole recording, block by block
+
+    Args:
+        samples: 1-D int16 samples
+        frame_rate: Sample rate
+
+    Returns:
+        Tuple of (speech_mask, frame_size) with one mask entry per VAD frame
+    """
+    frame_size = int(vad.FRAME_MS / 1000 * frame_rate)
+    block_size = frame_size * int(VAD_BLOCK_SECONDS * 1000 / vad.FRAME_MS)
+
+    masks = []
+    for start in range(0, len(samples), block_size):
+        block = samples[start:start + block_size].astype(np.float32) / 32768.0
+        mask, _ = vad.detect_speech_frames(block, frame_rate)
+        masks.append(mask)
+
+    return (np.concatenate(masks) if masks else np.zeros(0, dtype=bool)), frame_size
+
+def find_segments(speech, frame_size, n_samples, frame_rate,
+                  max_seconds=SEGMENT_MAX_SECONDS, min_seconds=SEGMENT_MIN_SECONDS):
+    """
+    Choose segment boundaries at silences
+
+    Each segment is at most max_seconds long. It ends in the middle of the
+    longest silence between min_seconds and max_seconds after its start, or
+    at max_seconds if there is no silence in that range. Segments without
+    speech are dropped.
+
+    Args:
+        speech: Per-frame speech mask
+        frame_size: Samples per VAD frame
+        n_samples: Length of the recording in samples
+        frame_rate: Sample rate
+
+    Returns:
+        List of (start_sample, end_sample) tuples
+    """
+    frames_per_second = frame_rate / frame_size
+    max_frames = max(1, int(max_seconds * frames_per_second))
+    min_frames = min(max_frames - 1, int(min_seconds * frames_per_second))
+    n_frames = len(speech)
+
+    segments = []
+    start = 0
+    while start < n_frames:
+        cut = min(start + max_frames, n_frames)
+        if cut < n_frames:
+            silent = ~speech[start + min_frames:cut]
+            if silent.any():
+                # Longest run of silent frames in the window
+                edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.astype(np.int8), [0]))))
+                run_starts, run_ends = edges[::2], edges[1::2]
+                longest = np.argmax(run_ends - run_starts)
+                cut = start + min_frames + (run_starts[longest] + run_ends[longest]) // 2
+
+        if speech[start:cut].any():
+            end = n_samples if cut >= n_frames else cut * frame_size
+            segments.append((start * frame_size, end))
+        start = cut
+
+    return segments
+
+def recognize_segment(audio_bytes, model, noise_reduction=False):
+    """Recognize one segment (runs on a worker)"""
+    if noise_reduction:
+        audio_bytes = nr.reduce_noise(audio_bytes)
+    return srs.recognize_speech(audio_bytes, model)
+
+def prepare_recording(audio_bytes, model, declared_format=None,
+                      max_seconds=SEGMENT_MAX_SECONDS, min_seconds=SEGMENT_MIN_SECONDS):
+    """
+    Decode a recording and choose its segments
+
+    Returns:
+        Tuple of (pcm, frame_rate, boundaries) with pcm the 16-bit mono
+        samples at the model's rate and boundaries from find_segments
+
+    Raises:
+        audio_codec.AudioFormatError: If the recording can't be decoded
+    """
+    audio_bytes, stats = an.normalize_audio(audio_bytes, srs.get_sample_rate(model),
+                                            declared_format=declared_format)
+    if stats['container'] not in ('wav', 'pcm') and not ac.is_wav(audio_bytes):
+        raise ac.AudioFormatError(f"Can't decode {stats['container']} audio (is ffmpeg installed?)")
+
+    pcm, frame_rate = srs.extract_pcm(audio_bytes)
+    samples = np.frombuffer(pcm, dtype='<i2')
+    speech, frame_size = detect_speech(samples, frame_rate)
+    boundaries = find_segments(speech, frame_size, len(samples), frame_rate, max_seconds, min_seconds)
+    return pcm, frame_rate, boundaries
+
+def transcribe_recording(audio_bytes, model, progress=None, noise_reduction=False,
+                         declared_format=None, pool=None,
+                         max_seconds=SEGMENT_MAX_SECONDS, min_seconds=SEGMENT_MIN_SECONDS):
+    """
+    Transcribe a long recording in concurrently recognized segments
+
+    Decoding, segmentation and recognition all run on the pool's workers;
+    the caller only waits, so this can run in a server green thread.
+
+    Args:
+        audio_bytes: Recording (any format audio_normalization can read)
+        model: Recognition model id
+        progress: Optional callback(completed, total, segment) called as each
+            segment finishes
+        noise_reduction: Apply noise reduction to each segment
+        declared_format: MIME type of the upload
+        pool: Worker pool for the segments (default: pipeline.batch_pool)
+        max_seconds: Maximum segment length
+        min_seconds: Minimum segment length when cutting at a silence
+
+    Returns:
+        Dict with the stitched text, the ordered segments (start and end in
+        seconds, text, confidence, and error if the segment failed), the
+        recording duration and the processing time in seconds
+
+    Raises:
+        audio_codec.AudioFormatError: If the recording can't be decoded
+    """
+    pool = pool or pipeline.batch_pool
+    started = time.perf_counter()
+
+    pcm, frame_rate, boundaries = pool.run(prepare_recording, audio_bytes, model, declared_format,
+                                           max_seconds, min_seconds)
+    duration = len(pcm) / 2 / frame_rate
+    logger.info(f"Transcribing {duration:.1f}s recording with {model} in {len(boundaries)} segments")
+
+    segments = [{'index': i, 'start': round(start / frame_rate, 3), 'end': round(end / frame_rate, 3),
+                 'text': "", 'confidence': 0.0}
+                for i, (start, end) in enumerate(boundaries)]
+    if progress:
+        progress(0, len(segments), None)
+
+    # Keep at most one task per worker queued, so a long recording neither
+    # overflows the pool's queue nor holds every segment's audio at once
+    waiting = list(range(len(segments)))
+    futures = {}
+    completed = 0
+    while waiting or futures:
+        while waiting and len(futures) < pool.max_workers:
+            index = waiting.pop(0)
+            start, end = boundaries[index]
+            segment_audio = ac.wav_header((end - start) * 2, frame_rate) + bytes(pcm[start * 2:end * 2])
+            futures[pool.submit(recognize_segment, segment_audio, model, noise_reduction)] = index
+
+        future = next(pipeline.as_completed(futures))
+        segment = segments[futures.pop(future)]
+        try:
+            segment['text'], segment['confidence'] = future.result()
+        except ch.UpstreamError as e:
+            logger.warning(f"Segment {segment['index']} failed: {str(e)}")
+            segment['error'] = str(e)
+
+        completed += 1
+        if progress:
+            progress(completed, len(segments), segment)
+
+    return {
+        'model': model,
+        'text': ' '.join(segment['text'] for segment in segments if segment['text']),
+        'segments': segments,
+        'duration': duration,
+        'processing_time': time.perf_counter() - started,
+        'errors': sum(1 for segment in segments if 'error' in segment)
+    }
+
+def format_timestamp(seconds):
+    """Format seconds as HH:MM:SS.mmm"""
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a long recording in parallel segments")
+    parser.add_argument('path', help='Audio file (WAV, or WebM/Ogg/MP4 with ffmpeg installed)')
+    parser.add_argument('--model', default='google', help='Recognition model')
+    parser.add_argument('--workers', type=int, default=pipeline.BATCH_WORKERS, help='Segments recognized at once')
+    parser.add_argument('--max-segment', type=float, default=SEGMENT_MAX_SECONDS, help='Maximum segment length in seconds')
+    parser.add_argument('--noise-reduction', action='store_true', help='Apply noise reduction to each segment')
+    parser.add_argument('--json', action='store_true', help='Print the full result as JSON')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if srs.get_backend(args.model) is None:
+        parser.error(f"unknown model: {args.model}")
+
+    with open(args.path, 'rb') as f:
+        audio_bytes = f.read()
+
+    def report(completed, total, segment):
+        print(f"\r{completed}/{total} segments", end='', file=sys.stderr, flush=True)
+
+    pool = pipeline.WorkerPool("batch", "thread", args.workers, args.workers * pipeline.QUEUE_FACTOR)
+    try:
+        result = transcribe_recording(audio_bytes, args.model, progress=report,
+                                      noise_reduction=args.noise_reduction, pool=pool,
+                                      max_seconds=args.max_segment,
+                                      min_seconds=min(SEGMENT_MIN_SECONDS, args.max_segment / 2))
+    finally:
+        pool.shutdown()
+    print(file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for segment in result['segments']:
+            text = segment['text'] or f"[{segment.get('error', 'no speech recognized')}]"
+            print(f"[{format_timestamp(segment['start'])} - {format_timestamp(segment['end'])}] {text}")
+        print(f"\n{result['duration']:.1f}s of audio transcribed in {result['processing_time']:.1f}s "
+              f"({len(result['segments'])} segments, {result['errors']} failed)", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
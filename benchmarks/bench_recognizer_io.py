@@ -0,0 +1,95 @@
+"""
+Benchmark preparing audio for the Google and Whisper backends through a
+temporary WAV file (the previous approach) against building it in memory.
+
+Usage:
+    python benchmarks/bench_recognizer_io.py [--dir /tmp] [--repeat 50]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+import speech_recognition as sr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio_codec as ac
+import speech_recognition_service as srs
+
+DURATIONS = [1, 10, 60]
+FRAME_RATE = 16000
+
+def write_temp_wav(pcm, frame_rate, directory):
+    """Write PCM frames to a temporary WAV file, as the backends used to"""
+    temp_audio = tempfile.NamedTemporaryFile(suffix=".wav", dir=directory, delete=True)
+    with wave.open(temp_audio.name, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(frame_rate)
+        wf.writeframes(pcm)
+    return temp_audio
+
+def google_temp_file(audio_bytes, recognizer, directory):
+    """Previous Google path: temp file, then sr.AudioFile"""
+    pcm, frame_rate = srs.extract_pcm(audio_bytes)
+    with write_temp_wav(pcm, frame_rate, directory) as temp_audio:
+        with sr.AudioFile(temp_audio.name) as source:
+            return recognizer.record(source).get_wav_data()
+
+def google_in_memory(audio_bytes):
+    """Current Google path: sr.AudioData straight from the PCM"""
+    pcm, frame_rate = srs.extract_pcm(audio_bytes)
+    return sr.AudioData(bytes(pcm), frame_rate, 2).get_wav_data()
+
+def whisper_temp_file(audio_bytes, directory):
+    """Previous Whisper path: temp file, reopened for the upload"""
+    pcm, frame_rate = srs.extract_pcm(audio_bytes)
+    with write_temp_wav(pcm, frame_rate, directory) as temp_audio:
+        with open(temp_audio.name, "rb") as audio_file:
+            return audio_file.read()
+
+def whisper_in_memory(audio_bytes):
+    """Current Whisper path: named in-memory buffer"""
+    return srs.wav_file(audio_bytes).read()
+
+def best_time(func, repeat, *args):
+    """Best wall time of several runs, in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dir', default=None, help='Directory for temporary files (default: system temp dir)')
+    parser.add_argument('--repeat', type=int, default=50, help='Runs per measurement')
+    args = parser.parse_args()
+    
+    logging.disable(logging.CRITICAL)
+    recognizer = sr.Recognizer()
+    rng = np.random.default_rng(0)
+    
+    print(f"{'backend':>8}  {'duration':>8}  {'temp file ms':>12}  {'in memory ms':>12}  {'speedup':>8}")
+    for seconds in DURATIONS:
+        audio = ac.encode_wav(0.1 * rng.standard_normal(seconds * FRAME_RATE), FRAME_RATE)
+        
+        # Both paths must hand the same audio to the backend
+        assert google_temp_file(audio, recognizer, args.dir) == google_in_memory(audio)
+        assert whisper_temp_file(audio, args.dir) == whisper_in_memory(audio)
+        
+        for backend, temp_path, memory_path, extra in (
+                ('google', google_temp_file, google_in_memory, (recognizer, args.dir)),
+                ('whisper', whisper_temp_file, whisper_in_memory, (args.dir,))):
+            temp_ms = best_time(temp_path, args.repeat, audio, *extra)
+            memory_ms = best_time(memory_path, args.repeat, audio)
+            print(f"{backend:>8}  {seconds:>7}s  {temp_ms:>12.2f}  {memory_ms:>12.2f}  {temp_ms / memory_ms:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""
+Evaluate the recognizer backends on a labeled corpus: word and character
+error rates, real-time factor and latency per backend and noise reduction
+setting.
+
+The corpus is a directory of WAV files with a same-named .txt transcript
+next to each, or a JSONL manifest of {"audio": path, "text": transcript}
+lines. Recordings are recognized in parallel worker processes.
+
+Cloud backends talk to a local stub. In replay mode (the default) it
+answers with responses recorded earlier, after the recorded latency, so
+evaluations run offline and repeatably. In record mode it forwards the
+requests to the real APIs and saves their responses.
+
+Usage:
+    python benchmarks/evaluate_backends.py CORPUS [--models google whisper vosk]
+        [--noise-reduction off on] [--workers 4] [--cloud replay|record|live]
+        [--recordings benchmarks/recordings.json] [--output benchmarks/results/report.json]
+        [--markdown report.md]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio_codec as ac
+
+DEFAULT_RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings.json')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')  # Ignored by git
+CLOUD_MODELS = ('google', 'whisper')
+
+def normalize_text(text):
+    """Lowercase and strip punctuation for scoring"""
+    return ' '.join(re.sub(r"[^\w']+", ' ', text.lower()).split())
+
+def edit_distance(reference, hypothesis):
+    """Levenshtein distance between two sequences"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_item in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_item in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_item != hyp_item)))
+        previous = current
+    return previous[-1]
+
+def load_corpus(path):
+    """
+    Read a corpus
+
+    Returns:
+        List of {'name', 'audio' (path), 'text'} dicts
+    """
+    items = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.wav'):
+                continue
+            transcript = os.path.join(path, name[:-4] + '.txt')
+            if not os.path.exists(transcript):
+                logging.warning(f"No transcript for {name}, skipping it")
+                continue
+            with open(transcript) as f:
+                items.append({'name': name, 'audio': os.path.join(path, name), 'text': f.read().strip()})
+    else:
+        base = os.path.dirname(os.path.abspath(path))
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    audio = os.path.join(base, entry['audio'])
+                    items.append({'name': entry.get('name', os.path.basename(audio)), 'audio': audio,
+                                  'text': entry['text']})
+    return items
+
+class RecordingStub:
+    """
+    Local stand-in for the Google and OpenAI endpoints
+
+    Responses are keyed by backend and a hash of the audio in the request.
+    In 'replay' mode recorded responses are served after their recorded
+    latency; in 'record' mode requests are forwarded upstream and the
+    responses saved.
+    """
+
+    def __init__(self, mode, recordings_path, upstreams, replay_latency=True):
+        """
+        Args:
+            mode: 'replay' or 'record'
+            recordings_path: JSON file of recorded responses
+            upstreams: Real base URLs by backend, used in record mode
+            replay_latency: Wait the recorded latency before replaying
+        """
+        self.mode = mode
+        self.recordings_path = recordings_path
+        self.upstreams = upstreams
+        self.replay_latency = replay_latency
+        self.recordings = {}
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.exists(recordings_path):
+            with open(recordings_path) as f:
+                self.recordings = json.load(f).get('responses', {})
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, content_type, payload = stub.handle(self.path, self.headers, body)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def request_key(backend, headers, body):
+        """Key of a request: the backend and a hash of the audio it carries"""
+        audio = body
+        if backend == 'whisper':
+            # The audio is the multipart 'file' part; the boundary changes every request
+            boundary = re.search(r'boundary=([^;]+)', headers.get('Content-Type', ''))
+            if boundary:
+                for part in body.split(b'--' + boundary.group(1).strip('"').encode()):
+                    head, _, content = part.partition(b'\r\n\r\n')
+                    if b'name="file"' in head:
+                        audio = content[:-2] if content.endswith(b'\r\n') else content
+        return f"{backend}:{hashlib.sha256(audio).hexdigest()}"
+
+    def handle(self, path, headers, body):
+        backend = 'whisper' if path.startswith('/whisper') else 'google'
+        key = self.request_key(backend, headers, body)
+
+        if self.mode == 'replay':
+            recording = self.recordings.get(key)
+            if recording is None:
+                with self._lock:
+                    self.misses += 1
+                return 404, 'text/plain', b'no recorded response for this audio'
+            if self.replay_latency:
+                time.sleep(recording['latency_ms'] / 1000)
+            return recording['status'], recording['content_type'], recording['body'].encode()
+
+        # Record: forward to the real API
+        url = self.upstreams[backend].rstrip('/') + path[len(backend) + 1:]
+        forward_headers = {name: value for name, value in headers.items()
+                           if name.lower() not in ('host', 'content-length', 'connection')}
+        started = time.perf_counter()
+        response = requests.post(url, data=body, headers=forward_headers, timeout=60)
+        latency_ms = (time.perf_counter() - started) * 1000
+        content_type = response.headers.get('Content-Type', 'text/plain')
+        if response.status_code < 500:
+            with self._lock:
+                self.recordings[key] = {'status': response.status_code, 'content_type': content_type,
+                                        'body': response.text, 'latency_ms': round(latency_ms, 1)}
+        return response.status_code, content_type, response.content
+
+    def save(self):
+        with open(self.recordings_path, 'w') as f:
+            json.dump({'version': 1, 'responses': self.recordings}, f, indent=1, sort_keys=True)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+def init_worker(models):
+    """Load the backends once per worker process, before timing anything"""
+    logging.disable(logging.CRITICAL)
+    import speech_recognition_service as srs
+    srs.warmup(models)
+
+def evaluate_item(item, model, noise_reduction):
+    """
+    Recognize one recording (runs in a worker process)
+
+    Returns:
+        Dict with the hypothesis, confidence, audio duration, processing
+        time in milliseconds and any error
+    """
+    import audio_normalization as an
+    import noise_reduction as nr
+    import speech_recognition_service as srs
+
+    result = {'name': item['name'], 'model': model, 'noise_reduction': noise_reduction,
+              'reference': item['text'], 'hypothesis': '', 'confidence': 0.0, 'error': None}
+    with open(item['audio'], 'rb') as f:
+        audio = f.read()
+    audio, stats = an.normalize_audio(audio, srs.get_sample_rate(model))
+    result['duration'] = stats['duration'] or 0.0
+
+    backend = srs.get_backend(model)
+    if backend is None or not backend.load():
+        result['error'] = f"{model} not available: {backend.load_error if backend else 'unknown model'}"
+        result['processing_time'] = 0.0
+        return result
+
+    started = time.perf_counter()
+    try:
+        if noise_reduction:
+            audio = nr.reduce_noise(audio)
+        result['hypothesis'], result['confidence'] = srs.recognize_speech(audio, model)
+    except Exception as e:
+        result['error'] = str(e)
+    result['processing_time'] = (time.perf_counter() - started) * 1000
+    return result
+
+def summarize(results):
+    """Corpus-level scores of one backend and setting"""
+    scored = [r for r in results if r['error'] is None]
+    word_edits = word_count = char_edits = char_count = 0
+    for r in scored:
+        reference, hypothesis = normalize_text(r['reference']), normalize_text(r['hypothesis'])
+        word_edits += edit_distance(reference.split(), hypothesis.split())
+        word_count += len(reference.split())
+        char_edits += edit_distance(reference, hypothesis)
+        char_count += len(reference)
+
+    times = [r['processing_time'] for r in scored]
+    audio_seconds = sum(r['duration'] for r in scored)
+    summary = {
+        'items': len(results),
+        'errors': len(results) - len(scored),
+        'audio_seconds': round(audio_seconds, 2),
+        'wer': round(word_edits / word_count, 4) if word_count else None,
+        'cer': round(char_edits / char_count, 4) if char_count else None,
+        'rtf': round(sum(times) / 1000 / audio_seconds, 4) if audio_seconds else None,
+        'mean_confidence': round(float(np.mean([r['confidence'] for r in scored])), 3) if scored else None
+    }
+    if times:
+        p50, p95, p99 = np.percentile(times, [50, 95, 99])
+        summary['latency_ms'] = {'p50': round(float(p50), 1), 'p95': round(float(p95), 1),
+                                 'p99': round(float(p99), 1), 'mean': round(float(np.mean(times)), 1)}
+    return summary
+
+def markdown_report(report):
+    lines = ["| Backend | Noise reduction | WER | CER | RTF | p50 ms | p95 ms | p99 ms | Confidence | Errors |",
+             "|---|---|---|---|---|---|---|---|---|---|"]
+    for entry in report['results']:
+        latency = entry.get('latency_ms', {})
+        cells = [entry['model'], 'on' if entry['noise_reduction'] else 'off',
+                 entry['wer'], entry['cer'], entry['rtf'], latency.get('p50'), latency.get('p95'),
+                 latency.get('p99'), entry['mean_confidence'], f"{entry['errors']}/{entry['items']}"]
+        lines.append('| ' + ' | '.join('-' if cell is None else str(cell) for cell in cells) + ' |')
+    return '\n'.join(lines) + '\n'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('corpus', help='Directory of .wav/.txt pairs, or a JSONL manifest')
+    parser.add_argument('--models', nargs='+', default=['google', 'whisper', 'vosk'], help='Backends to evaluate')
+    parser.add_argument('--noise-reduction', nargs='+', choices=['off', 'on'], default=['off', 'on'],
+                        help='Noise reduction settings to evaluate')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--cloud', choices=['replay', 'record', 'live'], default='replay',
+                        help='Cloud backends: recorded responses, record new ones, or call the APIs directly')
+    parser.add_argument('--recordings', default=DEFAULT_RECORDINGS, help='Recorded cloud responses')
+    parser.add_argument('--no-replay-latency', action='store_true', help="Replay responses without the recorded latency")
+    parser.add_argument('--output', default=os.path.join(RESULTS_DIR, f"evaluation-{time.strftime('%Y%m%d-%H%M%S')}.json"),
+                        help='JSON report (default: a new file in benchmarks/results)')
+    parser.add_argument('--markdown', help='Also write the comparison table as Markdown')
+    args = parser.parse_args()
+
+    # The service modules configure DEBUG logging on import
+    logging.getLogger().setLevel(logging.WARNING)
+    items = load_corpus(args.corpus)
+    if not items:
+        parser.error(f"no labeled recordings found in {args.corpus}")
+
+    stub = None
+    if args.cloud != 'live' and any(model in CLOUD_MODELS for model in args.models):
+        import speech_recognition_service as srs
+        upstreams = {'google': srs.GOOGLE_SPEECH_ENDPOINT, 'whisper': srs.OPENAI_BASE_URL}
+        stub = RecordingStub(args.cloud, args.recordings, upstreams, not args.no_replay_latency)
+        # Worker processes read these when they start
+        os.environ['GOOGLE_SPEECH_ENDPOINT'] = f"{stub.url}/google"
+        os.environ['OPENAI_BASE_URL'] = f"{stub.url}/whisper"
+        if args.cloud == 'replay':
+            os.environ.setdefault('OPENAI_API_KEY', 'replay')
+
+    settings = [setting == 'on' for setting in args.noise_reduction]
+    tasks = [(item, model, setting) for model in args.models for setting in settings for item in items]
+    print(f"Evaluating {len(items)} recordings x {len(args.models)} backends x {len(settings)} settings "
+          f"with {args.workers} workers", file=sys.stderr)
+
+    started = time.perf_counter()
+    results = []
+    try:
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(args.models,)) as pool:
+            futures = [pool.submit(evaluate_item, *task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                results.append(future.result())
+                print(f"\r{done}/{len(tasks)}", end='', file=sys.stderr, flush=True)
+        print(file=sys.stderr)
+    finally:
+        if stub:
+            if args.cloud == 'record':
+                stub.save()
+            stub.shutdown()
+
+    report = {
+        'corpus': args.corpus,
+        'items': len(items),
+        'cloud': args.cloud,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'elapsed_seconds': round(time.perf_counter() - started, 2),
+        'results': [],
+        'details': sorted(results, key=lambda r: (r['model'], r['noise_reduction'], r['name']))
+    }
+    for model in args.models:
+        for setting in settings:
+            group = [r for r in results if r['model'] == model and r['noise_reduction'] == setting]
+            report['results'].append({'model': model, 'noise_reduction': setting, **summarize(group)})
+    if stub and args.cloud == 'replay':
+        report['replay_misses'] = stub.misses
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    table = markdown_report(report)
+    if args.markdown:
+        with open(args.markdown, 'w') as f:
+            f.write(table)
+
+    print(table)
+    if report.get('replay_misses'):
+        print(f"{report['replay_misses']} cloud requests had no recorded response; "
+              f"run with --cloud record to record them", file=sys.stderr)
+    print(f"Report written to {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""
+Load test the server: replay WAV files as audio_data events from concurrent
+Socket.IO sessions and report throughput, latency, stage timings and
+server CPU/RSS.
+
+The server is started in a subprocess with the Google and Whisper backends
+pointed at an in-process stub with configurable latency and error rate;
+Vosk uses the bundled model. Results are written as JSON so runs can be
+compared across releases.
+
+Usage:
+    python benchmarks/load_test.py [--sessions 10] [--duration 30] [--speed 1]
+        [--model google] [--corpus a.wav b.wav ...] [--stub-latency-ms 300]
+        [--stub-error-rate 0.05] [--output benchmarks/results/run.json]
+    python benchmarks/load_test.py --url http://host:5000 ...  # existing server, no stubs
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+import socketio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio_codec as ac
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')  # Ignored by git
+FRAME_RATE = 16000
+QUIET_SECONDS = 3  # Drain ends when no result arrived for this long
+STUB_TRANSCRIPTS = [
+    "this is a load test transcription",
+    "the quick brown fox jumps over the lazy dog",
+    "speech recognition under concurrent load",
+    "i am happy with the latency today",
+]
+
+class StubBackendHandler(BaseHTTPRequestHandler):
+    """Answers like the Google Web Speech API and OpenAI transcriptions endpoint"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        config = self.server.config
+        config['requests'] += 1
+
+        latency = max(0.0, random.gauss(config['latency_ms'], config['jitter_ms'])) / 1000
+        time.sleep(latency)
+
+        text = random.choice(STUB_TRANSCRIPTS)
+        if random.random() < config['error_rate']:
+            config['errors'] += 1
+            self.send_response(503)
+            body = b'stub error'
+        elif self.path.endswith('/audio/transcriptions'):
+            self.send_response(200)
+            body = json.dumps({'text': text}).encode()
+        else:
+            self.send_response(200)
+            result = {'result': [{'alternative': [{'transcript': text, 'confidence': 0.9}], 'final': True}],
+                      'result_index': 0}
+            body = b'{"result":[]}\n' + json.dumps(result).encode() + b'\n'
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_stub(latency_ms, jitter_ms, error_rate):
+    """Start the stub backend server in a background thread"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBackendHandler)
+    server.daemon_threads = True
+    server.config = {'latency_ms': latency_ms, 'jitter_ms': jitter_ms, 'error_rate': error_rate,
+                     'requests': 0, 'errors': 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(port, stub_url, env_overrides):
+    """Start the app in a subprocess and wait until it answers"""
+    env = dict(os.environ,
+               GOOGLE_SPEECH_ENDPOINT=f"{stub_url}/speech",
+               OPENAI_BASE_URL=f"{stub_url}/v1",
+               OPENAI_API_KEY="stub",
+               METRICS_DIR=tempfile.mkdtemp(prefix="load-test-metrics-"),
+               **env_overrides)
+    code = ("import logging; logging.disable(logging.CRITICAL); "
+            "from app import app, socketio; "
+            f"socketio.run(app, host='127.0.0.1', port={port}, log_output=False)")
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=REPO_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            requests.get(f"{url}/api/models", timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.kill()
+    raise RuntimeError("Server didn't start within 120s")
+
+def synthetic_corpus(seconds=20, count=3):
+    """Speech-like test recordings: voiced bursts with pauses and noise"""
+    rng = np.random.default_rng(0)
+    corpus = []
+    for i in range(count):
+        t = np.arange(seconds * FRAME_RATE) / FRAME_RATE
+        pitch = 120 + 40 * i
+        voiced = np.sin(2 * np.pi * pitch * t) + 0.5 * np.sin(2 * np.pi * 2 * pitch * t)
+        envelope = ((t % 2.5) < 1.8) * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+        samples = 0.25 * voiced * envelope + 0.003 * rng.standard_normal(len(t))
+        corpus.append((f"synthetic-{i}", samples.astype(np.float32)))
+    return corpus
+
+def load_corpus(paths):
+    """Read WAV files (any rate and channel count) as mono float samples at 16 kHz"""
+    import audio_normalization as an
+
+    corpus = []
+    for path in paths:
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.wav')] \
+            if os.path.isdir(path) else [path]
+        for file in files:
+            with open(file, 'rb') as f:
+                samples, audio_format = ac.decode_wav(f.read())
+            mono = samples.mean(axis=1)
+            corpus.append((os.path.basename(file), an.resample(mono, audio_format.frame_rate, FRAME_RATE)))
+    return corpus
+
+def split_chunks(samples, chunk_seconds):
+    """Cut a recording into WAV chunks like the browser recorder sends"""
+    size = int(chunk_seconds * FRAME_RATE)
+    return [ac.encode_wav(samples[start:start + size], FRAME_RATE)
+            for start in range(0, len(samples) - size + 1, size)]
+
+class SimulatedSession:
+    """One client streaming a recording in real time (or faster)"""
+
+    def __init__(self, index, url, chunks, args):
+        self.index = index
+        self.url = url
+        self.chunks = chunks
+        self.args = args
+        self.sent = {}
+        self.latencies = []
+        self.last_result = None
+        self.counts = {'sent': 0, 'results': 0, 'partials': 0, 'busy': 0, 'errors': 0, 'demo': 0}
+        self.done = threading.Event()
+        self.client = socketio.Client(reconnection=False)
+        # Compare mode sends one result per model, then comparison_complete
+        result_event = 'comparison_complete' if args.model == 'compare' else 'transcription_result'
+        self.client.on(result_event, self.on_result)
+        self.client.on('transcription_partial', lambda data: self.count('partials'))
+        self.client.on('busy', lambda data: self.count('busy'))
+        self.client.on('error', lambda data: self.count('errors'))
+
+    def count(self, counter):
+        self.counts[counter] += 1
+
+    def on_result(self, result):
+        received = time.perf_counter()
+        self.last_result = received
+        sent = self.sent.pop(result.get('chunk_id'), None)
+        if sent is None:
+            return
+        self.counts['results'] += 1
+        if result.get('demo_mode'):
+            self.counts['demo'] += 1
+        self.latencies.append((received - sent) * 1000)
+
+    def run(self, stop_at):
+        self.client.connect(self.url, transports=['websocket', 'polling'] if self.args.websocket else ['polling'])
+        interval = self.args.chunk_seconds / self.args.speed
+        # Spread the sessions' first chunks over one interval
+        next_send = time.perf_counter() + interval * self.index / max(1, self.args.sessions)
+        position = self.index % len(self.chunks)
+        try:
+            while time.perf_counter() < stop_at:
+                time.sleep(max(0.0, next_send - time.perf_counter()))
+                chunk_id = uuid.uuid4().hex
+                self.sent[chunk_id] = time.perf_counter()
+                self.client.emit('audio_data', {'audio': self.chunks[position], 'format': 'audio/wav',
+                                                'model': self.args.model, 'chunk_id': chunk_id})
+                self.counts['sent'] += 1
+                position = (position + 1) % len(self.chunks)
+                next_send += interval
+
+            # Wait for the results of the chunks still in flight. Silent
+            # chunks get no result, so stop once results stop arriving.
+            drain_until = time.perf_counter() + self.args.drain_timeout
+            while self.sent and time.perf_counter() < drain_until:
+                if time.perf_counter() - max(self.last_result or 0, stop_at) > QUIET_SECONDS:
+                    break
+                time.sleep(0.05)
+        finally:
+            self.client.disconnect()
+            self.done.set()
+
+class ProcessSampler:
+    """Samples CPU time and RSS of a process and its children from /proc (Linux only)"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.samples = []
+        self.stop = threading.Event()
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def process_tree(self):
+        pids = [self.pid]
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        if int(f.read().rsplit(')', 1)[1].split()[1]) == self.pid:
+                            pids.append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass
+        return pids
+
+    def sample(self):
+        cpu, rss = 0.0, 0
+        for pid in self.process_tree():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / self.clock_ticks
+                rss += int(fields[21]) * self.page_size
+            except (OSError, IndexError, ValueError):
+                pass
+        return cpu, rss
+
+    def run(self):
+        while not self.stop.is_set():
+            cpu, rss = self.sample()
+            self.samples.append((time.perf_counter(), cpu))
+            self.peak_rss = max(self.peak_rss, rss)
+            self.stop.wait(self.interval)
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return None
+        (start, cpu_start), (end, cpu_end) = self.samples[0], self.samples[-1]
+        return {
+            'cpu_seconds': round(cpu_end - cpu_start, 3),
+            'cpu_percent': round(100 * (cpu_end - cpu_start) / (end - start), 1),
+            'peak_rss_mb': round(self.peak_rss / 2 ** 20, 1)
+        }
+
+def fetch_stage_metrics(url):
+    """Per-stage timings from the server's performance metrics"""
+    client = socketio.Client(reconnection=False)
+    received = {}
+    ready = threading.Event()
+
+    @client.on('performance_metrics')
+    def on_metrics(snapshot):
+        received.update(snapshot.get('metrics', {}))
+        ready.set()
+
+    client.connect(url, transports=['polling'])
+    client.emit('get_performance_metrics')
+    ready.wait(10)
+    client.disconnect()
+    return received.get('stages', {})
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 1), 'p95': round(float(p95), 1), 'p99': round(float(p99), 1),
+            'mean': round(float(np.mean(values)), 1), 'max': round(float(np.max(values)), 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='Test a running server instead of starting one (no stub backends)')
+    parser.add_argument('--sessions', type=int, default=10, help='Concurrent simulated sessions')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to send audio for')
+    parser.add_argument('--speed', type=float, default=1.0, help='Playback speed (2 = twice real time)')
+    parser.add_argument('--chunk-seconds', type=float, default=1.0, help='Audio per audio_data event')
+    parser.add_argument('--model', default='google', help='Model to request (google, whisper, vosk, compare)')
+    parser.add_argument('--corpus', nargs='*', default=[], help='WAV files or directories (default: synthetic audio)')
+    parser.add_argument('--stub-latency-ms', type=float, default=300, help='Mean stub backend latency')
+    parser.add_argument('--stub-jitter-ms', type=float, default=100, help='Standard deviation of the stub latency')
+    parser.add_argument('--stub-error-rate', type=float, default=0.0, help='Fraction of stub requests that fail with 503')
+    parser.add_argument('--no-noise-reduction', action='store_true', help='Turn noise reduction off on the server')
+    parser.add_argument('--no-sentiment', action='store_true', help='Turn sentiment analysis off on the server')
+    parser.add_argument('--cache', action='store_true', help='Keep the transcription cache on (replayed chunks then hit it)')
+    parser.add_argument('--websocket', action='store_true', help='Prefer the WebSocket transport (needs websocket-client)')
+    parser.add_argument('--drain-timeout', type=float, default=15, help='Seconds to wait for outstanding results')
+    parser.add_argument('--output', default=os.path.join(RESULTS_DIR, f"load-test-{time.strftime('%Y%m%d-%H%M%S')}.json"),
+                        help='Results file (default: a new file in benchmarks/results)')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    chunks = [chunk for _, samples in corpus for chunk in split_chunks(samples, args.chunk_seconds)]
+    if not chunks:
+        parser.error("the corpus has no audio as long as one chunk")
+
+    stub, process, sampler = None, None, None
+    url = args.url
+    if url is None:
+        stub = start_stub(args.stub_latency_ms, args.stub_jitter_ms, args.stub_error_rate)
+        env_overrides = {} if args.cache else {'TRANSCRIPTION_CACHE_SIZE': '0'}
+        process, url = start_server(free_port(), f"http://127.0.0.1:{stub.server_address[1]}", env_overrides)
+        sampler = ProcessSampler(process.pid)
+
+    try:
+        requests.post(f"{url}/api/settings", json={
+            'model': args.model,
+            'noiseReduction': not args.no_noise_reduction,
+            'sentimentAnalysis': not args.no_sentiment
+        }, timeout=10)
+
+        sessions = [SimulatedSession(i, url, chunks, args) for i in range(args.sessions)]
+        if sampler:
+            threading.Thread(target=sampler.run, daemon=True).start()
+
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        threads = [threading.Thread(target=session.run, args=(stop_at,), daemon=True) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Until the last result, not the end of the drain wait
+        finished = max([stop_at] + [session.last_result for session in sessions if session.last_result])
+        elapsed = finished - started
+        if sampler:
+            sampler.stop.set()
+
+        stages = fetch_stage_metrics(url)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(10)
+        if stub:
+            stub.shutdown()
+
+    latencies = [latency for session in sessions for latency in session.latencies]
+    totals = {counter: sum(session.counts[counter] for session in sessions) for counter in sessions[0].counts}
+    results = {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'elapsed_seconds': round(elapsed, 2),
+        'corpus': [name for name, _ in corpus],
+        'counts': {**totals, 'unanswered': totals['sent'] - totals['results']},
+        'throughput': {
+            'results_per_second': round(totals['results'] / elapsed, 2),
+            'audio_seconds_per_second': round(totals['results'] * args.chunk_seconds / elapsed, 2)
+        },
+        'latency_ms': percentiles(latencies),
+        'stages_ms': {stage: {key: round(value, 2) for key, value in data.items()} for stage, data in stages.items()},
+        'server': sampler.summary() if sampler else None,
+        'stub': {key: stub.config[key] for key in ('requests', 'errors')} if stub else None
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{args.sessions} sessions, {elapsed:.1f}s: {totals['sent']} chunks sent, {totals['results']} results, "
+          f"{totals['busy']} busy, {totals['errors']} errors")
+    print(f"throughput: {results['throughput']['results_per_second']} results/s, "
+          f"{results['throughput']['audio_seconds_per_second']} audio s/s")
+    if latencies:
+        latency = results['latency_ms']
+        print(f"latency ms: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    if stages:
+        print(f"{'stage':>16}  {'count':>6}  {'avg ms':>8}  {'p95 ms':>8}")
+        for stage, data in sorted(stages.items(), key=lambda item: -item[1]['total_time']):
+            print(f"{stage:>16}  {data['count']:>6}  {data['avg_time']:>8.2f}  {data['p95_time']:>8.2f}")
+    if results['server']:
+        server = results['server']
+        print(f"server: {server['cpu_seconds']} CPU s ({server['cpu_percent']}%), peak RSS {server['peak_rss_mb']} MB")
+    print(f"results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+import os
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import tracing
+import shared_metrics as sm
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Defaults for cloud backends; each can be overridden per backend with
+# CLOUD_<BACKEND>_<SETTING>, e.g. CLOUD_WHISPER_READ_TIMEOUT=60
+CONNECT_TIMEOUT = 3.05  # Seconds
+READ_TIMEOUT = 15.0  # Seconds
+MAX_CONCURRENCY = 8  # Requests in flight per backend
+MAX_RETRIES = 2  # Retries per request, if the retry budget allows
+RETRY_BUDGET_RATIO = float(os.environ.get("CLOUD_RETRY_BUDGET", 0.2))  # Retries per request
+RETRY_BUDGET_MIN_PER_SECOND = 1.0  # Retries always allowed at low traffic
+RETRY_BACKOFF = 0.1  # Seconds, doubled on every retry
+BREAKER_FAILURES = int(os.environ.get("CLOUD_BREAKER_FAILURES", 5))  # Consecutive failures that open the circuit
+BREAKER_RESET_TIMEOUT = float(os.environ.get("CLOUD_BREAKER_RESET_TIMEOUT", 30))  # Seconds before a probe request
+
+# Responses worth retrying: rate limiting and server-side errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Client counters exported to /metrics, with their metric name and labels
+EXPORTED_COUNTERS = {
+    'requests': ('stt_backend_requests_total', {}),
+    'retries': ('stt_backend_retries_total', {}),
+    'failures': ('stt_backend_errors_total', {'reason': 'failed'}),
+    'rejected': ('stt_backend_errors_total', {'reason': 'rejected'}),
+}
+
+class UpstreamError(Exception):
+    """Raised when a cloud backend can't produce a response"""
+
+class CircuitOpenError(UpstreamError):
+    """Raised when a backend's circuit breaker is open"""
+
+class BackendBusyError(UpstreamError):
+    """Raised when a backend has no free request slot"""
+
+def get_setting(backend, name, default):
+    """Read CLOUD_<BACKEND>_<NAME> from the environment, converted like the default"""
+    value = os.environ.get(f"CLOUD_{backend.upper()}_{name}")
+    return type(default)(value) if value is not None else default
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend that keeps failing
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    requests fail immediately. Once `reset_timeout` has passed a single
+    probe request is let through: success closes the circuit, failure opens
+    it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Whether a request may be sent now (claims the probe when half open)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def is_open(self):
+        """Whether requests are currently being refused"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == self.HALF_OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the request rate
+
+    Every request deposits `ratio` tokens and every retry spends one, so
+    retries can't multiply the load on a backend that is already failing.
+    A small per-second allowance keeps retries possible at low traffic.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND, max_tokens=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        now = time.monotonic()
+        amount += (now - self.updated) * self.min_per_second
+        self.updated = now
+        self.tokens = min(self.max_tokens, self.tokens + amount)
+
+    def record_request(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_spend(self):
+        """Take a token for a retry; False if the budget is exhausted"""
+        with self._lock:
+            self._refill(0.0)
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+class CloudClient:
+    """
+    Outbound HTTP client for one cloud backend
+
+    Connections are pooled and kept alive between requests. Every request
+    has connect and read timeouts, waits for one of a fixed number of
+    request slots, is retried on connection errors and 5xx/429 responses
+    within the retry budget, and goes through a circuit breaker.
+    """
+
+    def __init__(self, backend, name=None):
+        """
+        Args:
+            backend: Backend id, used for the CLOUD_<BACKEND>_* settings
+            name: Display name used in error messages
+        """
+        self.backend = backend
+        self.name = name or backend
+        self.timeout = (get_setting(backend, "CONNECT_TIMEOUT", CONNECT_TIMEOUT),
+                        get_setting(backend, "READ_TIMEOUT", READ_TIMEOUT))
+        self.max_concurrency = get_setting(backend, "MAX_CONCURRENCY", MAX_CONCURRENCY)
+        self.max_retries = get_setting(backend, "MAX_RETRIES", MAX_RETRIES)
+        self.breaker = CircuitBreaker()
+        self.retry_budget = RetryBudget()
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'in_flight': 0}
+        self._stats_lock = threading.Lock()
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _count(self, counter, amount=1):
+        with self._stats_lock:
+            self.stats[counter] += amount
+        if counter in EXPORTED_COUNTERS:
+            name, labels = EXPORTED_COUNTERS[counter]
+            sm.inc(name, amount, backend=self.backend, **labels)
+
+    def is_available(self):
+        """Whether the circuit breaker currently lets requests through"""
+        return not self.breaker.is_open()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request with timeouts, retries and the circuit breaker
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            **kwargs: Passed on to requests.Session.request. File-like bodies
+                are rewound before a retry.
+
+        Returns:
+            requests.Response; 4xx responses other than 408/429 are returned
+            for the caller to handle
+
+        Raises:
+            BackendBusyError: No request slot freed up within the connect timeout
+            CircuitOpenError: The backend has been failing and is cooling down
+            UpstreamError: The request failed after all allowed retries
+        """
+        if not self._slots.acquire(timeout=self.timeout[0]):
+            self._count('rejected')
+            raise BackendBusyError(f"{self.name} is busy ({self.max_concurrency} requests in flight)")
+
+        try:
+            self._count('in_flight')
+            if not self.breaker.allow_request():
+                self._count('rejected')
+                raise CircuitOpenError(f"{self.name} is temporarily unavailable after repeated failures")
+
+            self._count('requests')
+            self.retry_budget.record_request()
+            attempt = 0
+            while True:
+                try:
+                    result = self._attempt(method, url, kwargs)
+                except Exception as e:
+                    # Unexpected errors count as failures too, or a half-open
+                    # probe hitting one would keep the probe slot forever
+                    self._count('failures')
+                    self.breaker.record_failure()
+                    raise UpstreamError(f"{self.name} request failed: {e}") from e
+                if isinstance(result, requests.Response):
+                    self.breaker.record_success()
+                    return result
+                error = result
+
+                if attempt >= self.max_retries or not self.retry_budget.try_spend():
+                    self._count('failures')
+                    self.breaker.record_failure()
+                    raise UpstreamError(f"{self.name} request failed: {error}") from error
+
+                attempt += 1
+                self._count('retries')
+                delay = RETRY_BACKOFF * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                logger.warning(f"{self.name} request failed ({error}), retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+        finally:
+            self._count('in_flight', -1)
+            self._slots.release()
+
+    def _attempt(self, method, url, kwargs):
+        """Send one attempt; returns the response, or the exception to retry on"""
+        for value in kwargs.get('files', {}).values():
+            file = value[1] if isinstance(value, tuple) else value
+            if hasattr(file, 'seek'):
+                file.seek(0)
+
+        # Time spent waiting on the backend, apart from local processing
+        try:
+            with tracing.span(None, f"http.{self.backend}", method=method):
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            return e
+
+        if response.status_code in RETRYABLE_STATUS:
+            response.close()
+            return UpstreamError(f"HTTP {response.status_code}")
+        return response
+
+    def get_stats(self):
+        """Get request counters and the circuit breaker state"""
+        return {
+            **self.stats,
+            'max_concurrency': self.max_concurrency,
+            'timeout': list(self.timeout),
+            'circuit': self.breaker.state,
+            'circuit_trips': self.breaker.trips,
+            'retry_tokens': round(self.retry_budget.tokens, 2)
+        }
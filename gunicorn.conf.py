@@ -0,0 +1,44 @@
+import os
+import glob
+import tempfile
+
+# Models to load in the master process before workers are forked, e.g.
+# PRELOAD_MODELS=vosk or PRELOAD_MODELS=all. Forked workers then share the
+# loaded model memory copy-on-write instead of each loading its own copy.
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "")
+
+# Skip importing eventlet's green DNS resolver (see app.py)
+os.environ.setdefault("EVENTLET_NO_GREENDNS", "yes")
+
+# Workers add up their /metrics values through files in this directory
+# (see shared_metrics.py); it has to be set before they start
+if not os.environ.get("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="speech-to-text-metrics-")
+
+# The app has to be imported in the master for the preloaded models to be shared
+preload_app = bool(PRELOAD_MODELS)
+
+def on_starting(server):
+    """Clear the metrics files of a previous run so counters start from zero"""
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.db")):
+        os.remove(path)
+
+def when_ready(server):
+    """Warm up the configured recognizer backends and the audio stages before forking workers"""
+    if not PRELOAD_MODELS:
+        return
+
+    import warmup
+
+    # Sentiment analysis runs in spawned CPU pool processes, which warm up
+    # themselves (see post_worker_init), so it isn't warmed up here
+    models = None if PRELOAD_MODELS == "all" else [m.strip() for m in PRELOAD_MODELS.split(",") if m.strip()]
+    results = warmup.warmup(['audio', 'models'], models)
+    server.log.info("Warmed up: " + ", ".join(
+        f"{name} {result['seconds']:.2f}s{'' if result['ok'] else ' (failed)'}" for name, result in results.items()))
+
+def post_worker_init(worker):
+    """Start the worker's CPU pool, whose processes load the sentiment lexicon as they start"""
+    import pipeline
+
+    pipeline.cpu_pool.start()
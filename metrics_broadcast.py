@@ -0,0 +1,130 @@
+import os
+import logging
+import performance_metrics as pm
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Seconds between metrics pushes; updates in between are coalesced
+METRICS_PUSH_INTERVAL = float(os.environ.get("METRICS_PUSH_INTERVAL", 1.0))
+
+# Socket.IO room of the clients subscribed to metrics updates
+METRICS_ROOM = "performance_metrics"
+
+def diff_metrics(old, new):
+    """
+    Compute the changes between two metrics snapshots
+
+    Nested dictionaries are compared key by key, so only the values that
+    changed are included. Removed keys map to None.
+
+    Returns:
+        Dict of changes, empty if nothing changed
+    """
+    changes = {}
+    for key, value in new.items():
+        if key not in old:
+            changes[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested = diff_metrics(old[key], value)
+            if nested:
+                changes[key] = nested
+        elif value != old[key]:
+            changes[key] = value
+
+    for key in old:
+        if key not in new:
+            changes[key] = None
+
+    return changes
+
+class MetricsBroadcaster:
+    """
+    Pushes performance metrics to subscribed clients at a fixed rate
+
+    Processed chunks only mark the metrics as changed. Once per interval a
+    single snapshot is computed, diffed against the previous one and the
+    changes are sent to all subscribers in one room emit, so the payload is
+    serialized once however many clients are connected. New subscribers get
+    the current full snapshot.
+
+    Every snapshot has a version; a delta carries the version it applies to
+    ('base'), so a client that missed one can ask for a full snapshot again.
+    """
+
+    def __init__(self, socketio, interval=METRICS_PUSH_INTERVAL):
+        """
+        Args:
+            socketio: Flask-SocketIO server
+            interval: Seconds between pushes
+        """
+        self.socketio = socketio
+        self.interval = interval
+        self.snapshot = None
+        self.version = 0
+        self.dirty = True
+        self.running = False
+        self.stats = {'pushes': 0, 'snapshots': 0, 'full_sends': 0}
+
+    def mark_dirty(self):
+        """Note that the metrics changed; they're sent with the next push"""
+        self.dirty = True
+
+    def _refresh(self):
+        """Recompute the snapshot if the metrics changed; returns the changes"""
+        if not self.dirty and self.snapshot is not None:
+            return {}
+
+        self.dirty = False
+        snapshot = pm.get_metrics()
+        self.stats['snapshots'] += 1
+        changes = diff_metrics(self.snapshot, snapshot) if self.snapshot is not None else snapshot
+        if changes or self.snapshot is None:
+            self.snapshot = snapshot
+            self.version += 1
+        return changes
+
+    def subscribe(self, sid):
+        """
+        Add a client to the subscribers and send it the current snapshot
+
+        Args:
+            sid: Socket.IO session id
+        """
+        self.socketio.server.enter_room(sid, METRICS_ROOM, namespace='/')
+        self.send_snapshot(sid)
+        if not self.running:
+            self.running = True
+            self.socketio.start_background_task(self._run)
+
+    def send_snapshot(self, sid):
+        """Send the full current snapshot to one client"""
+        base = self.version
+        changes = self._refresh()
+        if changes and base and self.version != base:
+            # The snapshot moved on; the other subscribers get the same changes
+            self._push(changes, base)
+        self.stats['full_sends'] += 1
+        self.socketio.emit('performance_metrics', {'version': self.version, 'metrics': self.snapshot}, to=sid)
+
+    def _push(self, changes, base):
+        self.stats['pushes'] += 1
+        self.socketio.emit('performance_metrics_delta', {
+            'version': self.version,
+            'base': base,
+            'changes': changes
+        }, to=METRICS_ROOM)
+
+    def _run(self):
+        """Push the changes of each interval until the server stops"""
+        logger.debug(f"Pushing metrics updates every {self.interval}s")
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                base = self.version
+                changes = self._refresh()
+                if changes:
+                    self._push(changes, base)
+            except Exception as e:
+                logger.error(f"Error pushing metrics update: {str(e)}")
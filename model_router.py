@@ -0,0 +1,255 @@
+import os
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import performance_metrics as pm
+import pipeline
+import shared_metrics as sm
+import speech_recognition_service as srs
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Pseudo-model that lets the router pick the backend of each request
+AUTO_MODEL = "auto"
+
+# Backends the router picks from, most preferred first
+ROUTER_MODELS = [model.strip() for model in os.environ.get("ROUTER_MODELS", "google,whisper,vosk").split(",")
+                 if model.strip()]
+
+# Local backend used when the cloud backends are slow or down
+ROUTER_FALLBACK_MODEL = os.environ.get("ROUTER_FALLBACK_MODEL", "vosk")
+
+# A backend is only picked if its expected p95 latency is within this many milliseconds
+ROUTER_LATENCY_SLO_MS = float(os.environ.get("ROUTER_LATENCY_SLO_MS", 2000))
+
+# Backends failing more often than this over the window are skipped
+ROUTER_MAX_ERROR_RATE = float(os.environ.get("ROUTER_MAX_ERROR_RATE", 0.25))
+
+# Recent recognitions per backend the decisions are based on; a short
+# window so the router reacts within seconds to a backend slowing down
+ROUTER_WINDOW = int(os.environ.get("ROUTER_WINDOW", 50))
+
+# Results needed before a backend's latency is trusted; until then it is tried
+ROUTER_MIN_SAMPLES = 5
+
+# Seconds after which a skipped backend gets one request again, so its
+# statistics reflect how it is doing now rather than when it was last used
+ROUTER_PROBE_INTERVAL = float(os.environ.get("ROUTER_PROBE_INTERVAL", 30))
+
+class BackendStats:
+    """Recent latencies, errors and in-flight requests of one backend"""
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.latencies = pm.RingBuffer(window)
+        self.errors = pm.RingBuffer(window)  # 1.0 for each failed request
+        self.in_flight = 0
+        self.last_routed = 0.0
+        self.routed = 0
+
+    def record(self, latency, failed):
+        self.latencies.append(latency)
+        self.errors.append(1.0 if failed else 0.0)
+
+    def error_rate(self):
+        return self.errors.mean()
+
+class ModelRouter:
+    """
+    Picks a backend for each request in auto mode
+
+    Backends are tried in preference order. One is picked if it is
+    available (configured, loaded without errors and its circuit breaker
+    closed), fails less often than ROUTER_MAX_ERROR_RATE, and its expected
+    latency is within the SLO. The expected latency is the recent p95 plus
+    the time to work through the requests already in flight ahead of this
+    one. If no backend qualifies the local fallback model is used, so
+    transcription keeps working when the cloud backends are slow or down.
+
+    Every recognition reports its latency and outcome through track(),
+    whichever way its model was chosen.
+    """
+
+    def __init__(self, models=ROUTER_MODELS, fallback=ROUTER_FALLBACK_MODEL, slo_ms=ROUTER_LATENCY_SLO_MS):
+        """
+        Args:
+            models: Candidate model ids, most preferred first
+            fallback: Model used when no candidate meets the SLO
+            slo_ms: Latency objective in milliseconds
+        """
+        self.models = list(models)
+        self.fallback = fallback
+        self.slo_ms = slo_ms
+        self.stats = {}
+        self.decisions = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, model):
+        stats = self.stats.get(model)
+        if stats is None:
+            stats = self.stats[model] = BackendStats()
+        return stats
+
+    def get_capacity(self, model):
+        """Requests a backend works on at once"""
+        backend = srs.get_backend(model)
+        if backend is not None and backend.http is not None:
+            return backend.http.max_concurrency
+        return pipeline.stream_pool.max_workers
+
+    def estimate_latency(self, model):
+        """
+        Expected latency of a new request in milliseconds
+
+        Returns:
+            The estimate, or None if there are too few results to tell
+        """
+        stats = self._stats(model)
+        if stats.latencies.size < ROUTER_MIN_SAMPLES:
+            return None
+        p50, p95 = stats.latencies.percentiles((50, 95))
+        # Each full round of requests already in flight delays this one by about a median request
+        return p95 + p50 * (stats.in_flight // max(1, self.get_capacity(model)))
+
+    def evaluate(self, model):
+        """
+        Check whether a backend can take a request
+
+        Returns:
+            Tuple of (eligible, reason)
+        """
+        backend = srs.get_backend(model)
+        if backend is None or not backend.is_available():
+            return False, 'unavailable'
+
+        stats = self._stats(model)
+        if stats.errors.size >= ROUTER_MIN_SAMPLES and stats.error_rate() > ROUTER_MAX_ERROR_RATE:
+            return False, 'errors'
+
+        estimate = self.estimate_latency(model)
+        if estimate is None:
+            return True, 'warming_up'
+        if estimate > self.slo_ms:
+            return False, 'slow'
+        return True, 'within_slo'
+
+    def choose(self):
+        """
+        Pick the backend for a request
+
+        Returns:
+            Model id
+        """
+        with self._lock:
+            model, reason = self._choose()
+            stats = self._stats(model)
+            stats.last_routed = time.monotonic()
+            stats.routed += 1
+            self.decisions[(model, reason)] = self.decisions.get((model, reason), 0) + 1
+        sm.inc('stt_router_decisions_total', model=model, reason=reason)
+        logger.debug(f"Routing to {model} ({reason})")
+        return model
+
+    def _choose(self):
+        now = time.monotonic()
+        skipped = []
+        for model in self.models:
+            eligible, reason = self.evaluate(model)
+            if eligible:
+                return model, reason
+            if reason != 'unavailable':
+                skipped.append(model)
+
+        # Send one request now and then to a skipped backend to see if it recovered
+        for model in skipped:
+            if now - self._stats(model).last_routed >= ROUTER_PROBE_INTERVAL:
+                return model, 'probe'
+
+        backend = srs.get_backend(self.fallback)
+        if backend is not None and backend.is_available():
+            return self.fallback, 'fallback'
+
+        # Nothing is healthy: the least bad backend that can be reached at all
+        if skipped:
+            return min(skipped, key=lambda model: self.estimate_latency(model) or 0.0), 'best_effort'
+        return self.models[0], 'best_effort'
+
+    def get_fallback(self, model):
+        """Model to retry a request with after `model` failed, or None"""
+        if model == self.fallback:
+            return None
+        backend = srs.get_backend(self.fallback)
+        if backend is None or not backend.is_available():
+            return None
+        with self._lock:
+            self.decisions[(self.fallback, 'failover')] = self.decisions.get((self.fallback, 'failover'), 0) + 1
+        sm.inc('stt_router_decisions_total', model=self.fallback, reason='failover')
+        return self.fallback
+
+    @contextmanager
+    def track(self, model):
+        """
+        Count a recognition as in flight and record its latency and outcome
+
+        Any exception counts as a failure of the backend (backends raise
+        cloud_http.UpstreamError for error responses), except
+        pipeline.QueueFullError: a saturated local pool says nothing about
+        the backend, so nothing is recorded for it.
+        """
+        with self._lock:
+            self._stats(model).in_flight += 1
+        start = pm.start_timer()
+        failed, rejected = True, False
+        try:
+            yield
+            failed = False
+        except pipeline.QueueFullError:
+            rejected = True
+            raise
+        finally:
+            latency = pm.calculate_processing_time(start)
+            with self._lock:
+                stats = self._stats(model)
+                stats.in_flight -= 1
+                if not rejected:
+                    stats.record(latency, failed)
+
+    def get_stats(self):
+        """Get each backend's routing statistics and the decisions made so far"""
+        with self._lock:
+            backends = {}
+            for model in dict.fromkeys(self.models + [self.fallback]):
+                stats = self._stats(model)
+                eligible, reason = self.evaluate(model)
+                p50, p95, p99 = stats.latencies.percentiles(pm.LATENCY_PERCENTILES)
+                backends[model] = {
+                    'eligible': eligible,
+                    'reason': reason,
+                    'estimated_latency': self.estimate_latency(model),
+                    'p50_latency': p50,
+                    'p95_latency': p95,
+                    'p99_latency': p99,
+                    'error_rate': stats.error_rate(),
+                    'in_flight': stats.in_flight,
+                    'routed': stats.routed
+                }
+            decisions = {}
+            for (model, reason), count in self.decisions.items():
+                decisions.setdefault(model, {})[reason] = count
+        return {
+            'models': self.models,
+            'fallback': self.fallback,
+            'latency_slo_ms': self.slo_ms,
+            'backends': backends,
+            'decisions': decisions
+        }
+
+    def reset(self):
+        """Forget the collected statistics"""
+        with self._lock:
+            self.stats.clear()
+            self.decisions.clear()
+
+router = ModelRouter()
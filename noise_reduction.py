@@ -1,88 +1,135 @@
 import logging
 import base64
 import numpy as np
-import io
-import wave
-import struct
+import audio_codec as ac
+from functools import lru_cache
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+def audio_payload_to_bytes(audio_payload):
+    """
+    Get the raw audio bytes from an audio_data payload
+
+    Args:
+        audio_payload: Binary frame (bytes, bytearray or memoryview) or a
+            base64 string, optionally wrapped in a data URL
+
+    Returns:
+        Audio bytes (binary frames are returned as a memoryview, without copying)
+    """
+    if isinstance(audio_payload, (bytes, bytearray, memoryview)):
+        return memoryview(audio_payload)
+
+    # Extract the base64 part if it's a data URL
+    base64_part = audio_payload.split(',', 1)[1] if ',' in audio_payload else audio_payload
+    logger.debug(f"Base64 data length: {len(base64_part)}")
+    return base64.b64decode(base64_part)
+
+def wav_bytes_to_audio_array(audio_bytes):
+    """Convert WAV bytes to numpy array for processing"""
+    try:
+        if audio_bytes is None or len(audio_bytes) == 0:
+            logger.error("Empty audio data")
+            return None, None, None
+
+        logger.debug(f"Audio bytes length: {len(audio_bytes)}")
+
+        # Decode straight from the buffer (8/16/24/32-bit integer and float WAV)
+        samples, audio_format = ac.decode_wav(audio_bytes)
+        
+        logger.debug(f"Audio parameters: channels={audio_format.channels}, "
+                   f"sample_width={audio_format.sample_width}, float={audio_format.is_float}, "
+                   f"frame_rate={audio_format.frame_rate}, n_frames={len(samples)}")
+        
+        # Interleaved 1-D array, as the rest of the module expects
+        return samples.reshape(-1), audio_format.channels, audio_format.frame_rate
+    except Exception as e:
+        logger.error(f"Error converting WAV bytes to audio array: {str(e)}")
+        return None, None, None
+
 def base64_to_audio_array(base64_audio):
     """Convert base64 audio data to numpy array for processing"""
     try:
         logger.debug("Converting base64 audio to numpy array")
         
-        # Decode base64 string
         if not base64_audio:
             logger.error("Empty base64 audio data")
             return None, None, None
-            
-        # Extract the base64 part if it's a data URL
-        base64_part = base64_audio.split(',')[1] if ',' in base64_audio else base64_audio
-        logger.debug(f"Base64 data length: {len(base64_part)}")
-        
-        audio_bytes = base64.b64decode(base64_part)
-        logger.debug(f"Decoded audio bytes length: {len(audio_bytes)}")
-        
-        # Create a wave file from bytes
-        with io.BytesIO(audio_bytes) as wav_io:
-            with wave.open(wav_io, 'rb') as wav_file:
-                # Get audio file parameters
-                channels = wav_file.getnchannels()
-                sample_width = wav_file.getsampwidth()
-                frame_rate = wav_file.getframerate()
-                n_frames = wav_file.getnframes()
-                
-                logger.debug(f"Audio parameters: channels={channels}, sample_width={sample_width}, "
-                           f"frame_rate={frame_rate}, n_frames={n_frames}")
-                
-                # Read all frames
-                frames = wav_file.readframes(n_frames)
-                logger.debug(f"Read {len(frames)} bytes of audio frames")
-                
-                # Convert to numpy array
-                if sample_width == 2:
-                    format_str = f"{n_frames * channels}h"
-                    audio_array = np.array(struct.unpack(format_str, frames), dtype=np.float32)
-                    audio_array /= 32768.0  # Normalize to [-1, 1]
-                else:
-                    logger.warning(f"Unsupported sample width: {sample_width}")
-                    return None, None, None
-                
-                return audio_array, channels, frame_rate
+        
+        return wav_bytes_to_audio_array(audio_payload_to_bytes(base64_audio))
     except Exception as e:
         logger.error(f"Error converting base64 to audio array: {str(e)}")
         return None, None, None
 
+def audio_array_to_wav_bytes(audio_array, channels, frame_rate):
+    """Convert numpy array back to WAV bytes"""
+    try:
+        return ac.encode_wav(audio_array, frame_rate, channels)
+    except Exception as e:
+        logger.error(f"Error converting audio array to WAV bytes: {str(e)}")
+        return None
+
 def audio_array_to_base64(audio_array, channels, frame_rate):
     """Convert numpy array back to base64 audio data"""
     try:
-        # Scale back to 16-bit integers
-        audio_array = np.clip(audio_array, -1.0, 1.0)
-        audio_array = (audio_array * 32767).astype(np.int16)
-        
-        # Pack as binary data
-        format_str = f"{len(audio_array)}h"
-        frames = struct.pack(format_str, *audio_array)
-        
-        # Create wave file in memory
-        with io.BytesIO() as wav_io:
-            with wave.open(wav_io, 'wb') as wav_file:
-                wav_file.setnchannels(channels)
-                wav_file.setsampwidth(2)
-                wav_file.setframerate(frame_rate)
-                wav_file.writeframes(frames)
-            
-            # Get the wave file data and convert to base64
-            wav_data = wav_io.getvalue()
-            base64_data = base64.b64encode(wav_data).decode('utf-8')
-            return f"data:audio/wav;base64,{base64_data}"
+        wav_data = audio_array_to_wav_bytes(audio_array, channels, frame_rate)
+        if wav_data is None:
+            return None
+        
+        base64_data = base64.b64encode(wav_data).decode('utf-8')
+        return f"data:audio/wav;base64,{base64_data}"
     except Exception as e:
         logger.error(f"Error converting audio array to base64: {str(e)}")
         return None
 
+@lru_cache(maxsize=16)
+def hanning_window(size):
+    """Get a cached, read-only Hanning window of the given size"""
+    window = np.hanning(size)
+    window.setflags(write=False)
+    return window
+
+def frame_signal(audio_array, frame_size, frame_shift):
+    """
+    Split a signal into overlapping frames without copying
+    
+    Args:
+        audio_array: 1-D signal
+        frame_size: Samples per frame
+        frame_shift: Samples between frame starts
+        
+    Returns:
+        Read-only (n_frames, frame_size) strided view of the signal
+    """
+    n_frames = len(range(0, len(audio_array) - frame_size, frame_shift))
+    if n_frames <= 0:
+        return np.empty((0, frame_size), dtype=audio_array.dtype)
+    
+    windows = np.lib.stride_tricks.sliding_window_view(audio_array, frame_size)
+    return windows[::frame_shift][:n_frames]
+
+def overlap_add(frames, frame_shift, length):
+    """
+    Overlap-add frames back into a signal of the given length in one pass
+    
+    Args:
+        frames: (n_frames, frame_size) array of time-domain frames
+        frame_shift: Samples between frame starts
+        length: Length of the output signal
+        
+    Returns:
+        1-D float64 signal
+    """
+    n_frames, frame_size = frames.shape
+    if n_frames == 0:
+        return np.zeros(length)
+    
+    starts = np.arange(n_frames) * frame_shift
+    indices = starts[:, None] + np.arange(frame_size)[None, :]
+    return np.bincount(indices.ravel(), weights=frames.ravel(), minlength=length)[:length]
+
 def apply_spectral_subtraction(audio_array, frame_rate):
     """
     Apply spectral subtraction for noise reduction
@@ -90,6 +137,10 @@ def apply_spectral_subtraction(audio_array, frame_rate):
     This is a simplified implementation of spectral subtraction
     for demonstration purposes. A more sophisticated implementation
     would use a proper audio processing library.
+    
+    All frames are processed at once: the signal is framed with a strided
+    view, windowed, transformed with a single 2-D FFT and overlap-added
+    back in one pass.
     """
     try:
         if audio_array is None:
@@ -110,31 +161,19 @@ def apply_spectral_subtraction(audio_array, frame_rate):
         # Get noise spectrum
         noise_spec = np.abs(np.fft.rfft(noise_est))
         
-        # Process the signal in frames
-        result = np.zeros_like(audio_array)
+        # Frame, window and transform the whole signal at once
+        window = hanning_window(frame_size)
+        frames = frame_signal(audio_array, frame_size, frame_shift)
+        spec = np.fft.rfft(frames * window, axis=1)
+        spec_mag = np.abs(spec)
         
-        # Apply spectral subtraction for each frame
-        for start in range(0, len(audio_array) - frame_size, frame_shift):
-            # Extract frame
-            frame = audio_array[start:start + frame_size]
-            
-            # Apply window
-            windowed_frame = frame * np.hanning(len(frame))
-            
-            # Get spectrum
-            spec = np.fft.rfft(windowed_frame)
-            spec_mag = np.abs(spec)
-            spec_phase = np.angle(spec)
-            
-            # Subtract noise spectrum
-            gain = np.maximum(spec_mag - noise_spec[:len(spec_mag)] * 1.0, 0) / (spec_mag + 1e-10)
-            enhanced_spec = spec * gain
-            
-            # Inverse FFT
-            enhanced_frame = np.fft.irfft(enhanced_spec)
-            
-            # Add to result with overlap-add
-            result[start:start + frame_size] += enhanced_frame * np.hanning(len(enhanced_frame))
+        # Subtract noise spectrum
+        gain = np.maximum(spec_mag - noise_spec[:spec.shape[1]] * 1.0, 0) / (spec_mag + 1e-10)
+        enhanced_frames = np.fft.irfft(spec * gain, n=frame_size, axis=1)
+        
+        # Overlap-add the re-windowed frames
+        result = overlap_add(enhanced_frames * window, frame_shift, len(audio_array))
+        result = result.astype(audio_array.dtype, copy=False)
         
         # Normalize
         result = result / np.max(np.abs(result))
@@ -144,36 +183,186 @@ def apply_spectral_subtraction(audio_array, frame_rate):
         logger.error(f"Error applying spectral subtraction: {str(e)}")
         return audio_array  # Return original if error occurs
 
-def reduce_noise(base64_audio):
+class StreamingNoiseReducer:
+    """
+    Stateful spectral subtraction for a live audio stream
+    
+    Chunks are framed continuously: samples that don't fill a frame and the
+    overlap-add tail are carried over to the next chunk, so each call only
+    processes new samples and chunk boundaries don't produce artifacts. The
+    noise spectrum is kept for the whole stream and adapted with
+    VAD-gated recursive averaging, so speech at the start of a chunk is
+    not mistaken for noise.
+    """
+    
+    def __init__(self, frame_rate, noise_alpha=0.95, vad_threshold=2.0, over_subtraction=1.0):
+        """
+        Args:
+            frame_rate: Sample rate of the stream
+            noise_alpha: Smoothing factor for noise spectrum updates (per frame)
+            vad_threshold: Frames with energy below this multiple of the
+                noise energy are treated as noise
+            over_subtraction: Multiplier applied to the noise spectrum
+        """
+        self.frame_rate = frame_rate
+        self.frame_size = int(0.025 * frame_rate)  # 25ms
+        self.frame_shift = int(0.010 * frame_rate)  # 10ms
+        self.noise_alpha = noise_alpha
+        self.vad_threshold = vad_threshold
+        self.over_subtraction = over_subtraction
+        self.window = hanning_window(self.frame_size)
+        
+        # Constant gain correcting for analysis + synthesis windowing
+        # (replaces per-chunk peak normalization)
+        window_sq = overlap_add(np.tile(self.window ** 2, (self.frame_size, 1)),
+                                self.frame_shift, self.frame_size * self.frame_shift)
+        self.scale = 1.0 / np.mean(window_sq[self.frame_size:-self.frame_size])
+        
+        self.noise_spec = None
+        self.noise_frames = 0
+        self.reset()
+    
+    def reset(self):
+        """Drop buffered samples (the noise estimate is kept)"""
+        self._input_tail = np.zeros(0, dtype=np.float32)
+        self._output_tail = np.zeros(self.frame_size - self.frame_shift)
+    
+    def _update_noise(self, spec_mag):
+        """Update the noise spectrum from frames the VAD classifies as non-speech"""
+        frame_energy = np.sum(spec_mag ** 2, axis=1)
+        
+        if self.noise_spec is None:
+            # Minimum statistics bootstrap: average the quietest 10% of frames
+            quietest = np.argsort(frame_energy)[:max(1, len(frame_energy) // 10)]
+            self.noise_spec = np.mean(spec_mag[quietest], axis=0)
+        
+        noise_energy = np.sum(self.noise_spec ** 2) + 1e-10
+        noise_frames = spec_mag[frame_energy < self.vad_threshold * noise_energy]
+        
+        if len(noise_frames) > 0:
+            # Equivalent to applying the recursive average once per noise frame
+            weight = self.noise_alpha ** len(noise_frames)
+            self.noise_spec = weight * self.noise_spec + (1 - weight) * np.mean(noise_frames, axis=0)
+            self.noise_frames += len(noise_frames)
+    
+    def process(self, audio_array):
+        """
+        Denoise the next chunk of the stream
+        
+        Args:
+            audio_array: 1-D mono float samples in [-1, 1]
+            
+        Returns:
+            Denoised samples. Output lags input by one frame overlap, so the
+            length may differ slightly from the input chunk.
+        """
+        buffer = np.concatenate((self._input_tail, audio_array.astype(np.float32, copy=False)))
+        
+        n_frames = (len(buffer) - self.frame_size) // self.frame_shift + 1 if len(buffer) >= self.frame_size else 0
+        if n_frames <= 0:
+            self._input_tail = buffer
+            return np.zeros(0, dtype=np.float32)
+        
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, self.frame_size)[::self.frame_shift][:n_frames]
+        spec = np.fft.rfft(frames * self.window, axis=1)
+        spec_mag = np.abs(spec)
+        
+        self._update_noise(spec_mag)
+        
+        # Subtract noise spectrum
+        gain = np.maximum(spec_mag - self.noise_spec * self.over_subtraction, 0) / (spec_mag + 1e-10)
+        enhanced_frames = np.fft.irfft(spec * gain, n=self.frame_size, axis=1) * self.window
+        
+        # Overlap-add, including the tail left over from the previous chunk
+        consumed = n_frames * self.frame_shift
+        result = overlap_add(enhanced_frames, self.frame_shift, consumed + self.frame_size - self.frame_shift)
+        result[:len(self._output_tail)] += self._output_tail
+        
+        self._output_tail = result[consumed:]
+        self._input_tail = buffer[consumed:]
+        
+        return (result[:consumed] * self.scale).astype(np.float32)
+    
+    def flush(self):
+        """Return the remaining overlap tail and reset the stream buffers"""
+        tail = (self._output_tail * self.scale).astype(np.float32)
+        self.reset()
+        return tail
+
+# Streaming noise reducers for live sessions, keyed by session id
+stream_reducers = {}
+
+def get_stream_reducer(session_id, frame_rate):
+    """Get the streaming noise reducer for a session, creating it if needed"""
+    reducer = stream_reducers.get(session_id)
+    if reducer is None or reducer.frame_rate != frame_rate:
+        logger.debug(f"Creating streaming noise reducer for session {session_id} at {frame_rate} Hz")
+        reducer = StreamingNoiseReducer(frame_rate)
+        stream_reducers[session_id] = reducer
+    return reducer
+
+def reset_stream_reducer(session_id):
+    """Drop a session's buffered samples after a gap in the stream, keeping its noise profile"""
+    reducer = stream_reducers.get(session_id)
+    if reducer is not None:
+        reducer.reset()
+
+def flush_stream_reducer(session_id):
+    """
+    Get the denoised audio a session's reducer still holds at the end of an utterance
+
+    Returns:
+        WAV bytes of the overlap-add tail, or None if the session has no
+        reducer. The reducer's buffers are reset, keeping its noise profile.
+    """
+    reducer = stream_reducers.get(session_id)
+    if reducer is None:
+        return None
+    return audio_array_to_wav_bytes(reducer.flush(), 1, reducer.frame_rate)
+
+def release_stream_reducer(session_id):
+    """Discard the streaming noise reducer for a session"""
+    stream_reducers.pop(session_id, None)
+
+def reduce_noise(audio, session_id=None):
     """
     Apply noise reduction to the audio data
     
     Args:
-        base64_audio: Base64 encoded audio data
+        audio: WAV audio as bytes/memoryview, or base64 encoded audio data
+        session_id: Optional live session id. When given, the chunk is
+            processed as part of that session's stream with a persistent
+            noise profile (see StreamingNoiseReducer)
         
     Returns:
-        Base64 encoded audio data with noise reduction applied
+        Audio with noise reduction applied, in the same representation as
+        the input (WAV bytes for binary input, base64 data URL otherwise)
     """
+    binary_input = isinstance(audio, (bytes, bytearray, memoryview))
+    
     try:
         logger.debug("Starting noise reduction process")
         
         # Check if audio data is too short
-        if base64_audio and len(base64_audio) < 100:
-            logger.warning(f"Audio data too short, length: {len(base64_audio)}")
-            return base64_audio
+        if audio is not None and len(audio) < 100:
+            logger.warning(f"Audio data too short, length: {len(audio)}")
+            return audio
             
-        # Convert base64 to audio array
-        logger.debug("Converting base64 to audio array")
-        audio_array, channels, frame_rate = base64_to_audio_array(base64_audio)
+        # Convert to audio array
+        logger.debug("Converting audio to audio array")
+        if binary_input:
+            audio_array, channels, frame_rate = wav_bytes_to_audio_array(audio)
+        else:
+            audio_array, channels, frame_rate = base64_to_audio_array(audio)
         
         if audio_array is None:
-            logger.warning("Could not convert base64 to audio array, returning original")
-            return base64_audio
+            logger.warning("Could not convert audio to audio array, returning original")
+            return audio
             
         # Check if audio array is valid
         if len(audio_array) == 0:
             logger.warning("Empty audio array, returning original")
-            return base64_audio
+            return audio
             
         # Some basic audio stats for debugging
         logger.debug(f"Audio array shape: {audio_array.shape}, min: {np.min(audio_array)}, "
@@ -187,20 +376,31 @@ def reduce_noise(base64_audio):
             logger.warning("Audio level too low, likely silence")
         
         # Apply noise reduction
-        logger.debug("Applying spectral subtraction")
-        denoised_array = apply_spectral_subtraction(audio_array, frame_rate)
+        if session_id is not None:
+            logger.debug("Applying streaming spectral subtraction")
+            if channels > 1:
+                audio_array = audio_array.reshape(-1, channels).mean(axis=1)
+                channels = 1
+            denoised_array = get_stream_reducer(session_id, frame_rate).process(audio_array)
+        else:
+            logger.debug("Applying spectral subtraction")
+            denoised_array = apply_spectral_subtraction(audio_array, frame_rate)
         
         if denoised_array is None:
             logger.warning("Noise reduction failed, returning original")
-            return base64_audio
+            return audio
         
-        # Convert back to base64
-        logger.debug("Converting denoised array back to base64")
-        result = audio_array_to_base64(denoised_array, channels, frame_rate)
+        # Convert back to the input representation
+        if binary_input:
+            logger.debug("Converting denoised array back to WAV bytes")
+            result = audio_array_to_wav_bytes(denoised_array, channels, frame_rate)
+        else:
+            logger.debug("Converting denoised array back to base64")
+            result = audio_array_to_base64(denoised_array, channels, frame_rate)
         
         if result is None:
-            logger.warning("Failed to convert denoised array to base64, returning original")
-            return base64_audio
+            logger.warning("Failed to convert denoised array, returning original")
+            return audio
             
         logger.debug("Noise reduction completed successfully")
         return result
@@ -208,4 +408,4 @@ def reduce_noise(base64_audio):
         logger.error(f"Error in noise reduction: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        return base64_audio  # Return original if error occurs
+        return audio  # Return original if error occurs
@@ -1,43 +1,201 @@
+import os
+import bisect
 import logging
+import threading
 import time
-from collections import defaultdict
+import numpy as np
+import shared_metrics as sm
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Dictionary to store performance metrics for each model
-metrics = {
-    'google': {
-        'processing_times': [],
-        'confidences': [],
-        'text_lengths': [],
-        'count': 0
-    },
-    'vosk': {
-        'processing_times': [],
-        'confidences': [],
-        'text_lengths': [],
-        'count': 0
-    },
-    'whisper': {
-        'processing_times': [],
-        'confidences': [],
-        'text_lengths': [],
-        'count': 0
-    }
-}
+# Number of recent data points kept per model and metric
+MAX_METRIC_DATA_POINTS = int(os.environ.get("METRICS_WINDOW", 1000))
+
+# Latency histogram bucket upper bounds in milliseconds (the last bucket is unbounded)
+LATENCY_BUCKETS_MS = (5, 10, 15, 25, 35, 50, 75, 100, 150, 250, 350, 500, 750, 1000,
+                      1500, 2500, 3500, 5000, 7500, 10000, 15000, 30000, 60000)
+
+# Latency percentiles reported for the recent window
+LATENCY_PERCENTILES = (50, 95, 99)
+
+class RingBuffer:
+    """Fixed-size, preallocated buffer of the most recent float values"""
+    
+    def __init__(self, capacity=MAX_METRIC_DATA_POINTS):
+        self.data = np.zeros(capacity, dtype=np.float64)
+        self.capacity = capacity
+        self.size = 0
+        self.position = 0
+    
+    def append(self, value):
+        self.data[self.position] = value
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    def values(self):
+        """Stored values in no particular order (a view, not a copy)"""
+        return self.data[:self.size]
+    
+    def mean(self):
+        return float(self.values().mean()) if self.size else 0.0
+    
+    def percentiles(self, percentiles):
+        if not self.size:
+            return [0.0] * len(percentiles)
+        return [float(value) for value in np.percentile(self.values(), percentiles)]
+    
+    def clear(self):
+        self.size = 0
+        self.position = 0
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram over the whole run
+    
+    Unlike the ring buffers it never forgets, so it shows the long-window
+    latency distribution in constant memory.
+    """
+    
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = np.array(bounds, dtype=np.float64)
+        self.bound_list = list(bounds)  # bisect is much cheaper than numpy for a single value
+        self.counts = np.zeros(len(bounds) + 1, dtype=np.int64)
+        self.total = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bound_list, value)] += 1
+        self.total += value
+    
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket"""
+        count = int(self.counts.sum())
+        if count == 0:
+            return 0.0
+        
+        cumulative = np.cumsum(self.counts)
+        bucket = int(np.searchsorted(cumulative, q * count))
+        if bucket >= len(self.bounds):
+            # Unbounded last bucket: all we know is the last bound
+            return float(self.bounds[-1])
+        
+        lower = self.bounds[bucket - 1] if bucket > 0 else 0.0
+        below = cumulative[bucket - 1] if bucket > 0 else 0
+        fraction = (q * count - below) / self.counts[bucket]
+        return float(lower + (self.bounds[bucket] - lower) * fraction)
+    
+    def to_dict(self):
+        return {
+            'buckets': [float(bound) for bound in self.bounds] + ['+Inf'],
+            'counts': [int(count) for count in self.counts],
+            'sum': float(self.total)
+        }
+    
+    def clear(self):
+        self.counts[:] = 0
+        self.total = 0.0
+
+class ModelMetrics:
+    """Recent-window ring buffers and a lifetime latency histogram for one model"""
+    
+    def __init__(self):
+        self.processing_times = RingBuffer()
+        self.confidences = RingBuffer()
+        self.text_lengths = RingBuffer()
+        self.latency_histogram = LatencyHistogram()
+        self.count = 0
+        self._summary = None
+    
+    def record(self, processing_time, confidence, text_length):
+        self.processing_times.append(processing_time)
+        self.confidences.append(confidence)
+        self.text_lengths.append(text_length)
+        self.latency_histogram.observe(processing_time)
+        self.count += 1
+        self._summary = None
+    
+    def summary(self):
+        """Summary statistics, recomputed only after new data points arrive"""
+        if self._summary is None:
+            self._summary = calculate_metrics_for_model(self)
+        return self._summary
 
-# Maximum number of data points to keep for each metric
-MAX_METRIC_DATA_POINTS = 100
+# Performance metrics of each registered model
+metrics = {}
+
+class StageMetrics:
+    """Recent-window durations and a lifetime latency histogram for one pipeline stage"""
+    
+    def __init__(self):
+        self.durations = RingBuffer()
+        self.latency_histogram = LatencyHistogram()
+        self.count = 0
+        self.total = 0.0
+    
+    def record(self, duration):
+        self.durations.append(duration)
+        self.latency_histogram.observe(duration)
+        self.count += 1
+        self.total += duration
+    
+    def summary(self):
+        p50, p95, p99 = self.durations.percentiles(LATENCY_PERCENTILES)
+        return {
+            'count': self.count,
+            'total_time': self.total,
+            'avg_time': self.durations.mean(),
+            'p50_time': p50,
+            'p95_time': p95,
+            'p99_time': p99
+        }
+
+# Duration of each pipeline stage (decode, vad, recognize, ...), recorded by tracing spans
+stage_metrics = {}
+# Spans also end on worker threads
+stage_metrics_lock = threading.Lock()
+
+def register_model(model):
+    """
+    Start collecting metrics for a model
+    
+    Called for each recognizer backend as it is registered (see
+    speech_recognition_service.register_backend). Metrics of other model
+    names are ignored, and the Prometheus metrics record them as 'other',
+    so clients can't add models to the metrics.
+    """
+    if model not in metrics:
+        logger.debug(f"Registering metrics for model: {model}")
+        metrics[model] = ModelMetrics()
+        sm.register_label_value(model)
+    return metrics[model]
+
+# Admission control counters and queue gauges for the processing pipeline
+PIPELINE_COUNTERS = ('accepted', 'coalesced', 'dropped_stale', 'dropped_overflow', 'rejected_busy')
+pipeline_metrics = {
+    **{counter: 0 for counter in PIPELINE_COUNTERS},
+    'queue_depth': 0,
+    'in_flight': 0,
+    'max_queue_depth': 0,
+    'audio_seconds': 0.0,
+    'silence_skipped_seconds': 0.0,
+    'silent_chunks': 0,
+    'input_bytes': 0,
+    'normalized_bytes': 0,
+    'pools': {}
+}
 
 def get_current_time():
-    """Get current time in milliseconds"""
+    """Get the wall-clock time in milliseconds (for timestamps, not durations)"""
     return time.time() * 1000
 
+def start_timer():
+    """Start measuring a duration (monotonic, nanosecond resolution)"""
+    return time.perf_counter_ns()
+
 def calculate_processing_time(start_time):
-    """Calculate processing time in milliseconds"""
-    return get_current_time() - start_time
+    """Calculate the milliseconds elapsed since start_timer() returned start_time"""
+    return (time.perf_counter_ns() - start_time) / 1e6
 
 def update_metrics(model, processing_time, confidence, text_length):
     """
@@ -49,30 +207,146 @@ def update_metrics(model, processing_time, confidence, text_length):
         confidence: Confidence score
         text_length: Length of the transcribed text
     """
-    if model not in metrics:
+    data = metrics.get(model)
+    if data is None:
         logger.warning(f"Unknown model: {model}")
         return
     
-    # Add new data points
-    metrics[model]['processing_times'].append(processing_time)
-    metrics[model]['confidences'].append(confidence)
-    metrics[model]['text_lengths'].append(text_length)
-    metrics[model]['count'] += 1
+    data.record(processing_time, confidence, text_length)
+    sm.inc('stt_requests_total', model=model)
+    sm.observe('stt_request_duration_seconds', processing_time / 1000, model=model)
+
+def record_stage_time(stage, duration):
+    """
+    Record the duration of a pipeline stage
+    
+    Args:
+        stage: Stage name
+        duration: Duration in milliseconds
+    """
+    with stage_metrics_lock:
+        data = stage_metrics.get(stage)
+        if data is None:
+            data = stage_metrics[stage] = StageMetrics()
+        data.record(duration)
+    sm.observe('stt_stage_duration_seconds', duration / 1000, stage=stage)
+
+def get_stage_metrics():
+    """Get duration statistics of each pipeline stage, in milliseconds"""
+    with stage_metrics_lock:
+        return {stage: data.summary() for stage, data in stage_metrics.items()}
+
+def record_pipeline_event(event, count=1):
+    """
+    Count an admission control event
+    
+    Args:
+        event: One of PIPELINE_COUNTERS
+        count: Number of chunks affected
+    """
+    if event not in PIPELINE_COUNTERS:
+        logger.warning(f"Unknown pipeline event: {event}")
+        return
+    pipeline_metrics[event] += count
+    sm.inc('stt_pipeline_events_total', count, event=event)
+
+# Transcription cache counters
+CACHE_COUNTERS = ('hit', 'miss', 'evicted', 'expired')
+cache_metrics = {
+    **{counter: 0 for counter in CACHE_COUNTERS},
+    'entries': 0
+}
+
+def record_cache_event(event):
+    """
+    Count a transcription cache event
+    
+    Args:
+        event: One of CACHE_COUNTERS
+    """
+    if event not in CACHE_COUNTERS:
+        logger.warning(f"Unknown cache event: {event}")
+        return
+    cache_metrics[event] += 1
+    sm.inc('stt_cache_events_total', event=event)
+
+def update_cache_size(entries):
+    """Update the number of in-memory cache entries"""
+    cache_metrics['entries'] = entries
+    sm.set_gauge('stt_cache_entries', entries)
+
+def get_cache_metrics():
+    """Get transcription cache counters and hit rate"""
+    lookups = cache_metrics['hit'] + cache_metrics['miss']
+    return {
+        **cache_metrics,
+        'hit_rate': cache_metrics['hit'] / lookups if lookups else 0
+    }
+
+def record_vad_result(duration, skipped):
+    """
+    Record how much audio voice activity detection skipped
     
-    # Limit the number of stored data points
-    metrics[model]['processing_times'] = metrics[model]['processing_times'][-MAX_METRIC_DATA_POINTS:]
-    metrics[model]['confidences'] = metrics[model]['confidences'][-MAX_METRIC_DATA_POINTS:]
-    metrics[model]['text_lengths'] = metrics[model]['text_lengths'][-MAX_METRIC_DATA_POINTS:]
+    Args:
+        duration: Chunk duration in seconds
+        skipped: Seconds of non-speech audio dropped or trimmed
+    """
+    pipeline_metrics['audio_seconds'] += duration
+    pipeline_metrics['silence_skipped_seconds'] += skipped
+    sm.inc('stt_silence_skipped_seconds_total', skipped)
+    if duration > 0 and skipped >= duration:
+        pipeline_metrics['silent_chunks'] += 1
 
-def calculate_average(values):
-    """Calculate average of a list of values"""
-    return sum(values) / len(values) if values else 0
+def record_normalization(input_bytes, output_bytes, duration=None):
+    """
+    Record the audio volume before and after format normalization
+    
+    Args:
+        input_bytes: Size of the audio as received
+        output_bytes: Size of the audio sent on to the recognizers
+        duration: Length of the audio in seconds, if it could be decoded
+    """
+    pipeline_metrics['input_bytes'] += input_bytes
+    pipeline_metrics['normalized_bytes'] += output_bytes
+    sm.inc('stt_audio_received_bytes_total', input_bytes)
+    sm.inc('stt_audio_normalized_bytes_total', output_bytes)
+    if duration:
+        sm.inc('stt_audio_received_seconds_total', duration)
+
+def update_pipeline_gauges(queue_depth, in_flight, pool_stats=None):
+    """
+    Update the pipeline queue gauges
+    
+    Args:
+        queue_depth: Chunks waiting to be processed across all sessions
+        in_flight: Chunks queued or being processed across all sessions
+        pool_stats: Optional worker pool statistics
+    """
+    pipeline_metrics['queue_depth'] = queue_depth
+    pipeline_metrics['in_flight'] = in_flight
+    pipeline_metrics['max_queue_depth'] = max(pipeline_metrics['max_queue_depth'], queue_depth)
+    sm.set_gauge('stt_queue_depth', queue_depth)
+    sm.set_gauge('stt_in_flight_chunks', in_flight)
+    if pool_stats is not None:
+        pipeline_metrics['pools'] = pool_stats
+
+def get_pipeline_metrics():
+    """Get admission control counters and queue gauges"""
+    return {**pipeline_metrics, 'pools': dict(pipeline_metrics['pools'])}
+
+def get_average_processing_time():
+    """Get the average recent processing time across all models, in milliseconds"""
+    total = sum(data.processing_times.values().sum() for data in metrics.values())
+    count = sum(data.processing_times.size for data in metrics.values())
+    return float(total / count) if count else 0
 
 def calculate_metrics_for_model(model_data):
     """Calculate summary metrics for a model"""
-    avg_processing_time = calculate_average(model_data['processing_times'])
-    avg_confidence = calculate_average(model_data['confidences'])
-    avg_text_length = calculate_average(model_data['text_lengths'])
+    avg_processing_time = model_data.processing_times.mean()
+    avg_confidence = model_data.confidences.mean()
+    avg_text_length = model_data.text_lengths.mean()
+    p50, p95, p99 = model_data.processing_times.percentiles(LATENCY_PERCENTILES)
+    histogram = model_data.latency_histogram
     
     # Calculate words per minute
     words_per_second = 0
@@ -84,9 +358,14 @@ def calculate_metrics_for_model(model_data):
         'avg_processing_time': avg_processing_time,
         'avg_confidence': avg_confidence,
         'words_per_minute': words_per_minute,
-        'count': model_data['count'],
-        'processing_times': model_data['processing_times'],
-        'confidences': model_data['confidences']
+        'count': model_data.count,
+        # Recent window
+        'p50_processing_time': p50,
+        'p95_processing_time': p95,
+        'p99_processing_time': p99,
+        # Whole run, estimated from the histogram
+        'lifetime_p95_processing_time': histogram.quantile(0.95),
+        'lifetime_p99_processing_time': histogram.quantile(0.99)
     }
 
 def get_metrics():
@@ -99,16 +378,24 @@ def get_metrics():
     result = {}
     
     for model, data in metrics.items():
-        if data['count'] > 0:
-            result[model] = calculate_metrics_for_model(data)
+        if data.count > 0:
+            result[model] = data.summary()
     
     # Determine the best model based on combined metrics
     best_model = determine_best_model()
     if best_model:
         result['best_model'] = best_model
     
+    result['pipeline'] = get_pipeline_metrics()
+    result['cache'] = get_cache_metrics()
+    result['stages'] = get_stage_metrics()
+    
     return result
 
+def get_latency_histograms():
+    """Get each model's lifetime latency histogram"""
+    return {model: data.latency_histogram.to_dict() for model, data in metrics.items() if data.count > 0}
+
 def determine_best_model():
     """
     Determine the best performing model based on combined metrics
@@ -120,12 +407,13 @@ def determine_best_model():
     best_score = -1
     
     for model, data in metrics.items():
-        if data['count'] < 5:  # Need at least 5 data points for reliable comparison
+        if data.count < 5:  # Need at least 5 data points for reliable comparison
             continue
         
         # Calculate score based on multiple factors
-        avg_processing_time = calculate_average(data['processing_times'])
-        avg_confidence = calculate_average(data['confidences'])
+        summary = data.summary()
+        avg_processing_time = summary['avg_processing_time']
+        avg_confidence = summary['avg_confidence']
         
         # Lower processing time is better, higher confidence is better
         # Normalize processing time to 0-1 range (lower is better)
@@ -143,10 +431,17 @@ def determine_best_model():
 def reset_metrics():
     """Reset all performance metrics"""
     for model in metrics:
-        metrics[model] = {
-            'processing_times': [],
-            'confidences': [],
-            'text_lengths': [],
-            'count': 0
-        }
+        metrics[model] = ModelMetrics()
+    for counter in PIPELINE_COUNTERS:
+        pipeline_metrics[counter] = 0
+    pipeline_metrics['audio_seconds'] = 0.0
+    pipeline_metrics['silence_skipped_seconds'] = 0.0
+    pipeline_metrics['silent_chunks'] = 0
+    pipeline_metrics['input_bytes'] = 0
+    pipeline_metrics['normalized_bytes'] = 0
+    pipeline_metrics['max_queue_depth'] = pipeline_metrics['queue_depth']
+    for counter in CACHE_COUNTERS:
+        cache_metrics[counter] = 0
+    with stage_metrics_lock:
+        stage_metrics.clear()
     logger.info("Performance metrics reset")
@@ -0,0 +1,219 @@
+import os
+import logging
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Execution settings (overridable through environment variables)
+# "pool" runs stages on the worker pools, "inline" runs them in the caller
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "pool")
+CPU_WORKERS = int(os.environ.get("PIPELINE_CPU_WORKERS", os.cpu_count() or 2))
+STREAM_WORKERS = int(os.environ.get("PIPELINE_STREAM_WORKERS", 8))
+IO_WORKERS = int(os.environ.get("PIPELINE_IO_WORKERS", 32))
+BATCH_WORKERS = int(os.environ.get("PIPELINE_BATCH_WORKERS", 8))
+# Maximum queued + running tasks per pool, as a multiple of its worker count
+QUEUE_FACTOR = int(os.environ.get("PIPELINE_QUEUE_FACTOR", 4))
+# Start method for CPU worker processes (fork is unsafe with an event loop running)
+PROCESS_START_METHOD = os.environ.get("PIPELINE_PROCESS_START_METHOD", "spawn")
+
+# How often a waiting green thread checks its future, in seconds
+POLL_INTERVAL = 0.005
+
+# Cooperative sleep of the server's async framework (set by configure)
+_sleep = time.sleep
+
+class QueueFullError(Exception):
+    """Raised when a worker pool has no free queue slots"""
+
+class WorkerPool:
+    """
+    Executor with a bounded number of queued and running tasks
+
+    Each worker class gets its own pool and queue bound, so a backlog of
+    slow network calls can't delay CPU work and vice versa.
+    """
+
+    def __init__(self, name, kind, max_workers, queue_size, initializer=None):
+        """
+        Args:
+            name: Pool name used in logs and stats
+            kind: "process" or "thread"
+            max_workers: Number of workers
+            queue_size: Maximum number of queued + running tasks
+            initializer: Function each worker process runs when it starts
+        """
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.initializer = initializer
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Create the executor on first use"""
+        if self._executor is None:
+            logger.info(f"Starting {self.name} pool: {self.max_workers} {self.kind} workers, "
+                        f"queue size {self.queue_size}")
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(PROCESS_START_METHOD),
+                    initializer=self.initializer
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"{self.name}-worker"
+                )
+        return self._executor
+
+    def _release(self, future):
+        """Free the queue slot of a finished task"""
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Submit a task to the pool
+
+        Returns:
+            concurrent.futures.Future for the task
+
+        Raises:
+            QueueFullError: If the pool's queue is full
+        """
+        with self._lock:
+            if self.pending >= self.queue_size:
+                self.rejected += 1
+                raise QueueFullError(f"{self.name} pool queue is full ({self.queue_size} tasks)")
+            self.pending += 1
+
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Run a task on the pool and wait for its result"""
+        if PIPELINE_MODE == "inline":
+            return fn(*args, **kwargs)
+        return wait_for(self.submit(fn, *args, **kwargs))
+
+    def start(self):
+        """
+        Start all workers now instead of on the first tasks
+
+        Process workers are started one per task while none is idle, so
+        this submits a task for each; they run the initializer in the
+        background and the call doesn't wait for them.
+        """
+        executor = self._get_executor()
+        if self.kind == "process":
+            for _ in range(self.max_workers):
+                executor.submit(_noop)
+
+    def get_stats(self):
+        """Get queue statistics for the pool"""
+        return {
+            'kind': self.kind,
+            'workers': self.max_workers,
+            'queue_size': self.queue_size,
+            'pending': self.pending,
+            'rejected': self.rejected
+        }
+
+    def shutdown(self):
+        """Shut down the executor, if started"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+def _noop():
+    pass
+
+def warm_up_cpu_worker():
+    """
+    Load what the CPU pool's tasks need when a worker process starts
+
+    The workers are spawned, so nothing the parent process warmed up carries
+    over; without this each worker would import TextBlob on its first task.
+    """
+    try:
+        import sentiment_analysis as sa
+        sa.warmup()
+    except Exception as e:
+        logger.error(f"Error warming up CPU worker: {str(e)}")
+
+# CPU-bound, stateless stages (e.g. sentiment analysis)
+cpu_pool = WorkerPool("cpu", "process", CPU_WORKERS, CPU_WORKERS * QUEUE_FACTOR,
+                      initializer=warm_up_cpu_worker)
+
+# Stages that keep per-session state in this process (streaming noise
+# reduction, incremental Vosk decoding). Their state can't move between
+# processes, so they run on threads; NumPy's FFT and Vosk release the GIL.
+stream_pool = WorkerPool("stream", "thread", STREAM_WORKERS, STREAM_WORKERS * QUEUE_FACTOR)
+
+# Network-bound stages (Google and Whisper API calls)
+io_pool = WorkerPool("io", "thread", IO_WORKERS, IO_WORKERS * QUEUE_FACTOR)
+
+# Segments of long uploaded recordings, kept apart so a batch job can't
+# starve live sessions of workers
+batch_pool = WorkerPool("batch", "thread", BATCH_WORKERS, BATCH_WORKERS * QUEUE_FACTOR)
+
+pools = {pool.name: pool for pool in (cpu_pool, stream_pool, io_pool, batch_pool)}
+
+def configure(sleep):
+    """
+    Set the cooperative sleep function used while waiting for results
+
+    Args:
+        sleep: Sleep function of the server's async framework (socketio.sleep),
+            so waiting yields to other clients instead of blocking the loop
+    """
+    global _sleep
+    _sleep = sleep
+
+def wait_for(future):
+    """Wait for a future without blocking the server's event loop"""
+    while not future.done():
+        _sleep(POLL_INTERVAL)
+    return future.result()
+
+def as_completed(futures):
+    """
+    Yield futures as they finish, without blocking the server's event loop
+
+    Args:
+        futures: Iterable of futures
+    """
+    pending = list(futures)
+    while pending:
+        done = [future for future in pending if future.done()]
+        if not done:
+            _sleep(POLL_INTERVAL)
+            continue
+        for future in done:
+            pending.remove(future)
+            yield future
+
+def get_pool_stats():
+    """Get queue statistics for all worker pools"""
+    return {name: pool.get_stats() for name, pool in pools.items()}
+
+def shutdown():
+    """Shut down all worker pools"""
+    for pool in pools.values():
+        pool.shutdown()
@@ -1,49 +1,175 @@
+import os
 import logging
 import re
-from textblob import TextBlob
-import nltk
-from nltk.tokenize import word_tokenize, sent_tokenize
+from collections import OrderedDict
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Ensure necessary NLTK data is downloaded
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+# NLTK data used by the tokenizers. It is never downloaded at import time;
+# run `python warmup.py --download-nltk` when building the image instead.
+NLTK_DATA_PACKAGES = {'punkt': 'tokenizers/punkt', 'stopwords': 'corpora/stopwords'}
 
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+# TextBlob's pattern sentiment scorer, imported on first use (TextBlob pulls
+# in NLTK, which takes a good part of the app's import time)
+_pattern_sentiment = None
+
+# Memoized sentiment results (repeated phrases, cached transcriptions)
+SENTIMENT_CACHE_SIZE = int(os.environ.get("SENTIMENT_CACHE_SIZE", 4096))
+
+# Emotions with their trigger words and emojis, in priority order: when a
+# text mentions several emotions the first one listed wins
+EMOTIONS = [
+    ('excited', ['excited', 'amazing', 'wow', 'awesome', 'fantastic'], '🤩'),
+    ('happy', ['happy', 'glad', 'joy', 'pleased', 'delighted'], '😄'),
+    ('love', ['love', 'adore', 'heart'], '❤️'),
+    ('surprised', ['surprised', 'shock', 'unexpected'], '😲'),
+    ('sad', ['sad', 'unhappy', 'disappointed', 'upset'], '😢'),
+    ('angry', ['angry', 'mad', 'furious', 'outraged'], '😠'),
+    ('confused', ['confused', 'puzzled', 'uncertain'], '🤔'),
+    ('scared', ['scared', 'afraid', 'terrified', 'fear'], '😨')
+]
+
+# Inflections a trigger word may carry ("loved", "fears", "shocking")
+EMOTION_SUFFIXES = ['s', 'es', 'd', 'ed', 'ing']
+
+NEUTRAL_SENTIMENT = {'score': 0, 'magnitude': 0, 'label': 'neutral', 'emoji': '😐'}
 
 def initialize():
     """Initialize sentiment analysis components"""
     logger.info("Initializing sentiment analysis components")
 
-def analyze_sentiment(text):
+def get_pattern_sentiment():
+    """Get TextBlob's pattern sentiment scorer, importing it on first use"""
+    global _pattern_sentiment
+    if _pattern_sentiment is None:
+        from textblob.en import sentiment
+        _pattern_sentiment = sentiment
+    return _pattern_sentiment
+
+def ensure_nltk_data(download=False):
     """
-    Analyze sentiment of the given text
+    Check for the NLTK data packages, optionally downloading missing ones
     
     Args:
-        text: Text to analyze
+        download: Download missing packages (needs network access)
         
     Returns:
-        Dictionary with sentiment information
+        Dictionary of package name to whether it is available
     """
+    import nltk
+    
+    available = {}
+    for package, path in NLTK_DATA_PACKAGES.items():
+        try:
+            nltk.data.find(path)
+            available[package] = True
+        except LookupError:
+            available[package] = bool(download) and nltk.download(package, quiet=True)
+            if not available[package]:
+                logger.warning(f"NLTK data package '{package}' is not installed")
+    return available
+
+def split_sentences(text):
+    """Split text into sentences with NLTK's tokenizer, or at end punctuation if its data is missing"""
     try:
+        from nltk.tokenize import sent_tokenize
+        return sent_tokenize(text)
+    except LookupError:
+        return [sentence for sentence in re.split(r'(?<=[.!?])\s+', text) if sentence]
+
+def warmup():
+    """Import TextBlob and load its sentiment lexicon ahead of the first request"""
+    get_pattern_sentiment()('warm up')
+    return True
+
+class SentimentAnalyzer:
+    """
+    Sentiment and emotion analyzer with precompiled patterns and a result cache
+
+    All emotion trigger words are compiled into one regular expression that
+    only matches whole words, so a text is scanned once however many words
+    the lexicon has. Results are kept in an LRU cache keyed by the text.
+    """
+    
+    def __init__(self, emotions=EMOTIONS, cache_size=SENTIMENT_CACHE_SIZE):
+        """
+        Args:
+            emotions: List of (emotion, trigger words, emoji) in priority order
+            cache_size: Number of results to keep (0 disables the cache)
+        """
+        self.emotions = emotions
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+        
+        # Trigger word -> (priority, emotion, emoji)
+        self.triggers = {}
+        for priority, (emotion, patterns, emoji) in enumerate(emotions):
+            for pattern in patterns:
+                self.triggers.setdefault(pattern, (priority, emotion, emoji))
+        
+        # Longest words first so the alternation never stops at a shorter prefix
+        words = sorted(self.triggers, key=len, reverse=True)
+        suffixes = '|'.join(EMOTION_SUFFIXES)
+        self.pattern = re.compile(r"\b(" + '|'.join(map(re.escape, words)) + r")(?:" + suffixes + r")?\b")
+    
+    def detect_emotion(self, text):
+        """
+        Find the highest-priority emotion mentioned in a text
+        
+        Returns:
+            Tuple of (emotion, emoji), or None if no trigger word occurs
+        """
+        best = None
+        for match in self.pattern.finditer(text.lower()):
+            trigger = self.triggers[match.group(1)]
+            if best is None or trigger[0] < best[0]:
+                best = trigger
+                if best[0] == 0:
+                    break
+        return (best[1], best[2]) if best else None
+    
+    def get_cached(self, text):
+        """Cached result for a text, or None"""
+        result = self.cache.get(text)
+        if result is None:
+            return None
+        self.cache.move_to_end(text)
+        self.stats['hits'] += 1
+        return dict(result)
+    
+    def remember(self, text, result):
+        """Cache the result for a text"""
+        if self.cache_size <= 0 or result.get('label') == 'error':
+            return
+        self.cache[text] = dict(result)
+        self.cache.move_to_end(text)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+    
+    def analyze(self, text):
+        """
+        Analyze sentiment of the given text
+        
+        Args:
+            text: Text to analyze
+            
+        Returns:
+            Dictionary with sentiment information
+        """
         if not text:
-            return {'score': 0, 'magnitude': 0, 'label': 'neutral', 'emoji': '😐'}
+            return dict(NEUTRAL_SENTIMENT)
         
-        # Basic sentiment analysis using TextBlob
-        analysis = TextBlob(text)
+        cached = self.get_cached(text)
+        if cached is not None:
+            return cached
+        self.stats['misses'] += 1
         
-        # Get polarity score (-1 to 1)
-        polarity = analysis.sentiment.polarity
-        # Get subjectivity score (0 to 1)
-        subjectivity = analysis.sentiment.subjectivity
+        # Polarity (-1 to 1) and subjectivity (0 to 1) from TextBlob's
+        # pattern lexicon, without building a TextBlob for each text
+        polarity, subjectivity = get_pattern_sentiment()(text)
         
         # Determine sentiment label
         if polarity > 0.3:
@@ -56,19 +182,71 @@ def analyze_sentiment(text):
             label = 'neutral'
             emoji = '😐'
         
-        # Enhanced context analysis for specific emotions
-        enhanced_sentiment = enhance_sentiment_analysis(text, polarity, label, emoji)
+        # Specific emotions take precedence over the polarity label
+        emotion = self.detect_emotion(text)
+        if emotion:
+            label, emoji = emotion
         
-        return {
-            'score': polarity,
-            'magnitude': subjectivity,
-            'label': enhanced_sentiment['label'],
-            'emoji': enhanced_sentiment['emoji']
-        }
+        result = {'score': polarity, 'magnitude': subjectivity, 'label': label, 'emoji': emoji}
+        self.remember(text, result)
+        return dict(result)
+    
+    def analyze_batch(self, texts):
+        """
+        Analyze the sentiment of many texts, analyzing each distinct text once
+        
+        Args:
+            texts: Iterable of texts
+            
+        Returns:
+            List of sentiment dictionaries in the order of the texts
+        """
+        results = {}
+        for text in texts:
+            if text not in results:
+                results[text] = analyze_sentiment(text, self)
+        return [dict(results[text]) for text in texts]
+
+# Shared analyzer (one per process)
+analyzer = SentimentAnalyzer()
+
+def analyze_sentiment(text, sentiment_analyzer=None):
+    """
+    Analyze sentiment of the given text
+    
+    Args:
+        text: Text to analyze
+        sentiment_analyzer: Analyzer to use (default: the shared one)
+        
+    Returns:
+        Dictionary with sentiment information
+    """
+    try:
+        return (sentiment_analyzer or analyzer).analyze(text)
     except Exception as e:
         logger.error(f"Error in sentiment analysis: {str(e)}")
         return {'score': 0, 'magnitude': 0, 'label': 'error', 'emoji': '❓'}
 
+def analyze_batch(texts):
+    """
+    Analyze sentiment of many texts (e.g. the segments of a long recording)
+    
+    Args:
+        texts: List of texts
+        
+    Returns:
+        List of sentiment dictionaries in the order of the texts
+    """
+    return analyzer.analyze_batch(texts)
+
+def get_cached_sentiment(text):
+    """Cached sentiment of a text in this process, or None"""
+    return analyzer.get_cached(text)
+
+def cache_sentiment(text, result):
+    """Cache a sentiment computed elsewhere (e.g. in a worker process)"""
+    analyzer.remember(text, result)
+
 def enhance_sentiment_analysis(text, base_polarity, base_label, base_emoji):
     """
     Enhance sentiment analysis with more specific emotion detection
@@ -82,25 +260,9 @@ def enhance_sentiment_analysis(text, base_polarity, base_label, base_emoji):
     Returns:
         Enhanced sentiment information
     """
-    text_lower = text.lower()
-    
-    # Dictionary of emotions and their corresponding patterns and emojis
-    emotions = {
-        'excited': {'patterns': ['excited', 'amazing', 'wow', 'awesome', 'fantastic'], 'emoji': '🤩'},
-        'happy': {'patterns': ['happy', 'glad', 'joy', 'pleased', 'delighted'], 'emoji': '😄'},
-        'love': {'patterns': ['love', 'adore', 'heart'], 'emoji': '❤️'},
-        'surprised': {'patterns': ['surprised', 'shock', 'unexpected'], 'emoji': '😲'},
-        'sad': {'patterns': ['sad', 'unhappy', 'disappointed', 'upset'], 'emoji': '😢'},
-        'angry': {'patterns': ['angry', 'mad', 'furious', 'outraged'], 'emoji': '😠'},
-        'confused': {'patterns': ['confused', 'puzzled', 'uncertain'], 'emoji': '🤔'},
-        'scared': {'patterns': ['scared', 'afraid', 'terrified', 'fear'], 'emoji': '😨'}
-    }
-    
-    # Check for specific emotion patterns
-    for emotion, data in emotions.items():
-        for pattern in data['patterns']:
-            if pattern in text_lower or f" {pattern} " in text_lower:
-                return {'label': emotion, 'emoji': data['emoji']}
+    emotion = analyzer.detect_emotion(text)
+    if emotion:
+        return {'label': emotion[0], 'emoji': emotion[1]}
     
     # If no specific emotion is detected, return the base sentiment
     return {'label': base_label, 'emoji': base_emoji}
@@ -120,7 +282,7 @@ def add_punctuation(text):
         # A more sophisticated approach would use a proper NLP model
         
         # Capitalize first letter of sentences
-        sentences = sent_tokenize(text)
+        sentences = split_sentences(text)
         capitalized_sentences = [s.capitalize() for s in sentences]
         
         # Join sentences with appropriate punctuation
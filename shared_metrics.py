@@ -0,0 +1,328 @@
+import os
+import json
+import atexit
+import shutil
+import math
+import mmap
+import bisect
+import struct
+import logging
+import tempfile
+import threading
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Directory shared by all worker processes of one server. Each process
+# writes its values to its own memory-mapped <pid>.db file there and the
+# /metrics endpoint sums the files. Set it (to an empty directory) before the
+# workers start; gunicorn.conf.py does this for gunicorn. Without it a fresh
+# directory is created and exported to child processes through the environment.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+if not METRICS_DIR:
+    METRICS_DIR = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="speech-to-text-metrics-")
+    atexit.register(shutil.rmtree, METRICS_DIR, ignore_errors=True)
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+INITIAL_FILE_SIZE = 64 * 1024  # Bytes, doubled when full
+
+# File layout: an 8-byte header with the number of bytes in use, then entries
+# of a 4-byte key length, the UTF-8 key padded to 8 bytes and a float64 value
+_HEADER = struct.Struct('<Q')
+_KEY_LENGTH = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+
+# Histogram bucket upper bounds in seconds (the millisecond bounds of performance_metrics)
+LATENCY_BUCKETS = (0.005, 0.01, 0.015, 0.025, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.35, 0.5, 0.75,
+                   1.0, 1.5, 2.5, 3.5, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+
+class Metric:
+    """Definition of an exported metric family"""
+
+    def __init__(self, name, kind, help_text, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.buckets = buckets
+        if buckets is not None:
+            self.bucket_labels = [format_value(bound) for bound in buckets] + ['+Inf']
+
+def format_value(value):
+    """Format a number the way the text exposition format expects"""
+    if value == math.inf:
+        return '+Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return f"{int(value)}.0" if isinstance(value, float) else str(int(value))
+    return repr(float(value))
+
+# Exported metrics; values can only be recorded for these
+METRICS = {metric.name: metric for metric in [
+    Metric('stt_requests_total', 'counter', 'Transcription results produced, by model'),
+    Metric('stt_request_duration_seconds', 'histogram', 'Transcription processing time, by model', LATENCY_BUCKETS),
+    Metric('stt_stage_duration_seconds', 'histogram', 'Duration of each pipeline stage', LATENCY_BUCKETS),
+    Metric('stt_audio_received_seconds_total', 'counter', 'Seconds of audio received for recognition'),
+    Metric('stt_audio_received_bytes_total', 'counter', 'Bytes of audio received, before normalization'),
+    Metric('stt_audio_normalized_bytes_total', 'counter', 'Bytes of audio after normalization'),
+    Metric('stt_silence_skipped_seconds_total', 'counter', 'Seconds of audio skipped by voice activity detection'),
+    Metric('stt_pipeline_events_total', 'counter', 'Audio chunk admission control events'),
+    Metric('stt_queue_depth', 'gauge', 'Audio chunks waiting to be processed'),
+    Metric('stt_in_flight_chunks', 'gauge', 'Audio chunks queued or being processed'),
+    Metric('stt_cache_events_total', 'counter', 'Transcription cache hits, misses, evictions and expirations'),
+    Metric('stt_cache_entries', 'gauge', 'Entries in the in-memory transcription caches'),
+    Metric('stt_backend_requests_total', 'counter', 'Requests sent to cloud recognition backends'),
+    Metric('stt_backend_retries_total', 'counter', 'Retried cloud backend requests'),
+    Metric('stt_backend_errors_total', 'counter', 'Failed recognitions, by backend and reason'),
+    Metric('stt_router_decisions_total', 'counter', 'Backends picked in auto mode, by model and reason'),
+]}
+
+class MmapValues:
+    """
+    Float values keyed by string in a memory-mapped file
+
+    Only the owning process writes to the file. New keys are appended and
+    the header is updated last, so readers in other processes never see a
+    partly written entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(INITIAL_FILE_SIZE)
+            size = INITIAL_FILE_SIZE
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self.used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        self.positions = {key: position for key, position, _ in parse_entries(self._map, self.used)}
+
+    def _add(self, key):
+        """Append an entry for a new key and return the position of its value"""
+        encoded = key.encode('utf-8')
+        padded = _KEY_LENGTH.size + len(encoded)
+        padded += -padded % 8
+        end = self.used + padded + _VALUE.size
+
+        if end > len(self._map):
+            size = len(self._map)
+            while size < end:
+                size *= 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+
+        _KEY_LENGTH.pack_into(self._map, self.used, len(encoded))
+        self._map[self.used + _KEY_LENGTH.size:self.used + _KEY_LENGTH.size + len(encoded)] = encoded
+        position = self.used + padded
+        _VALUE.pack_into(self._map, position, 0.0)
+        self.used = end
+        _HEADER.pack_into(self._map, 0, self.used)
+        self.positions[key] = position
+        return position
+
+    def inc(self, key, amount):
+        position = self.positions.get(key)
+        if position is None:
+            position = self._add(key)
+        _VALUE.pack_into(self._map, position, _VALUE.unpack_from(self._map, position)[0] + amount)
+
+    def set(self, key, value):
+        position = self.positions.get(key)
+        if position is None:
+            position = self._add(key)
+        _VALUE.pack_into(self._map, position, value)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+def parse_entries(buffer, used):
+    """Yield (key, value_position, value) for each entry of a values file"""
+    position = _HEADER.size
+    while position + _KEY_LENGTH.size <= used:
+        length = _KEY_LENGTH.unpack_from(buffer, position)[0]
+        key = bytes(buffer[position + _KEY_LENGTH.size:position + _KEY_LENGTH.size + length]).decode('utf-8')
+        position += _KEY_LENGTH.size + length
+        position += -position % 8
+        yield key, position, _VALUE.unpack_from(buffer, position)[0]
+        position += _VALUE.size
+
+def read_values(path):
+    """Read the values of one process's file as a dict"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        return {}
+    used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+    return {key: value for key, _, value in parse_entries(data, used)}
+
+# This process's values file, opened on first use
+# Labels whose values can come from requests. Only registered values (the
+# backend ids, see performance_metrics.register_model) are recorded; any
+# other value is recorded as OTHER_LABEL_VALUE, so made-up model names can't
+# create new series or grow the values files.
+BOUNDED_LABELS = ('model', 'backend')
+OTHER_LABEL_VALUE = 'other'
+_label_values = set()
+
+_store = None
+_lock = threading.Lock()
+# Encoded file keys of (sample name, labels) pairs
+_keys = {}
+
+def _get_store():
+    global _store
+    if _store is None:
+        _store = MmapValues(os.path.join(METRICS_DIR, f"{os.getpid()}.db"))
+    return _store
+
+def _after_fork():
+    """A forked worker records into a file of its own, not its parent's"""
+    global _store, _lock
+    _store = None
+    _lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def register_label_value(value):
+    """Allow a model or backend id as the value of the BOUNDED_LABELS"""
+    _label_values.add(value)
+
+def _labels(labels):
+    for name in BOUNDED_LABELS:
+        if name in labels and labels[name] not in _label_values:
+            labels[name] = OTHER_LABEL_VALUE
+    return tuple(sorted(labels.items())) if len(labels) > 1 else tuple(labels.items())
+
+def _key(name, labels):
+    """File key of a sample; labels is a tuple of (name, value) pairs"""
+    key = _keys.get((name, labels))
+    if key is None:
+        key = _keys[(name, labels)] = json.dumps([name, labels])
+    return key
+
+def inc(name, amount=1, **labels):
+    """
+    Increase a counter
+
+    Args:
+        name: Counter name (one of METRICS)
+        amount: Amount to add
+        **labels: Label values
+    """
+    key = _key(name, _labels(labels))
+    with _lock:
+        _get_store().inc(key, amount)
+
+def set_gauge(name, value, **labels):
+    """Set a gauge of this process (the export sums live processes)"""
+    key = _key(name, _labels(labels))
+    with _lock:
+        _get_store().set(key, value)
+
+def observe(name, value, **labels):
+    """
+    Record a value in a histogram
+
+    Args:
+        name: Histogram name (one of METRICS)
+        value: Observed value, in seconds for the latency histograms
+        **labels: Label values
+    """
+    metric = METRICS[name]
+    label_items = _labels(labels)
+    le = metric.bucket_labels[bisect.bisect_left(metric.buckets, value)]
+    bucket_key = _key(name + '_bucket', label_items + (('le', le),))
+    sum_key = _key(name + '_sum', label_items)
+    count_key = _key(name + '_count', label_items)
+    with _lock:
+        store = _get_store()
+        # Buckets are stored non-cumulatively and summed up on export
+        store.inc(bucket_key, 1)
+        store.inc(sum_key, value)
+        store.inc(count_key, 1)
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def collect():
+    """
+    Sum the values of all processes
+
+    Counters and histograms of exited processes are kept, so totals don't
+    drop when a worker restarts; gauges only count live processes.
+
+    Returns:
+        Dict of (sample name, labels tuple) to value
+    """
+    totals = {}
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith('.db'):
+            continue
+        try:
+            pid = int(filename[:-3])
+            values = read_values(os.path.join(METRICS_DIR, filename))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Skipping metrics file {filename}: {str(e)}")
+            continue
+
+        alive = None
+        for key, value in values.items():
+            name, labels = json.loads(key)
+            metric = METRICS.get(name)
+            if metric is not None and metric.kind == 'gauge':
+                if alive is None:
+                    alive = is_process_alive(pid)
+                if not alive:
+                    continue
+            series = (name, tuple(tuple(label) for label in labels))
+            totals[series] = totals.get(series, 0.0) + value
+    return totals
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_sample(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{label}="{escape_label(label_value)}"' for label, label_value in labels)
+        return f"{name}{{{label_text}}} {format_value(value)}"
+    return f"{name} {format_value(value)}"
+
+def render():
+    """
+    Render all metrics, summed across processes, in the Prometheus text
+    exposition format
+    """
+    totals = collect()
+    lines = []
+    for name, metric in METRICS.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+
+        if metric.kind != 'histogram':
+            for (sample, labels), value in sorted(totals.items()):
+                if sample == name:
+                    lines.append(format_sample(name, labels, value))
+            continue
+
+        # Regroup the stored bucket counts by label set and make them cumulative
+        buckets = {}
+        for (sample, labels), value in totals.items():
+            if sample == name + '_bucket':
+                base = tuple(label for label in labels if label[0] != 'le')
+                buckets.setdefault(base, {})[dict(labels)['le']] = value
+        for labels in sorted(buckets):
+            cumulative = 0.0
+            for le in metric.bucket_labels:
+                cumulative += buckets[labels].get(le, 0.0)
+                lines.append(format_sample(name + '_bucket', labels + (('le', le),), cumulative))
+            lines.append(format_sample(name + '_sum', labels, totals.get((name + '_sum', labels), 0.0)))
+            lines.append(format_sample(name + '_count', labels, totals.get((name + '_count', labels), 0.0)))
+
+    return '\n'.join(lines) + '\n'
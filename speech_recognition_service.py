@@ -1,207 +1,575 @@
 import os
 import logging
 import base64
-import numpy as np
 import io
-import speech_recognition as sr
-from vosk import Model, KaldiRecognizer
+import importlib.util
 import json
-from tempfile import NamedTemporaryFile
-import wave
-from openai import OpenAI
+import threading
+import time
+import audio_codec as ac
+import audio_normalization as an
+import cloud_http as ch
+import performance_metrics as pm
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Initialize models
 # You'll need to download Vosk model from https://alphacephei.com/vosk/models
 VOSK_MODEL_PATH = os.path.join(os.path.dirname(__file__), "vosk-model-small-en-us-0.15")
-try:
-    vosk_model = Model(VOSK_MODEL_PATH)
-    logger.info("Vosk model loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading Vosk model: {str(e)}")
-    vosk_model = None
-
-# Initialize OpenAI client for Whisper API
-try:
-    # Check if OpenAI API key is available
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if not openai_api_key:
-        logger.warning("OpenAI API key not found in environment variables. Whisper model will be disabled.")
-        client = None
-        whisper_model = None
-    else:
-        # Initialize the OpenAI client
-        client = OpenAI(api_key=openai_api_key)
+
+# Incremental Vosk recognizers for live sessions
+VOSK_IDLE_TIMEOUT = 60  # Seconds before an unused session recognizer is released
+VOSK_FEED_BYTES = 8000  # Bytes fed per AcceptWaveform call (250ms of 16kHz 16-bit audio)
+
+# Whisper model used through the OpenAI API
+WHISPER_MODEL = "whisper-1"
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# Google Web Speech API (the endpoint used by speech_recognition's recognize_google)
+GOOGLE_SPEECH_ENDPOINT = os.environ.get("GOOGLE_SPEECH_ENDPOINT", "http://www.google.com/speech-api/v2/recognize")
+
+class RecognizerBackend:
+    """
+    Base class for speech recognition backends
+
+    Backends are registered by id and loaded lazily: nothing heavy happens
+    at import time, and a model or client is only created the first time it
+    is used or when warmup() is called. Warming up before gunicorn forks its
+    workers (see gunicorn.conf.py) lets the workers share the loaded model
+    memory copy-on-write.
+    """
+
+    id = None
+    name = None
+    version = "unknown"
+    supports_streaming = False
+    # Local backends decode on this machine (CPU-bound); others call a network API
+    local = False
+    # Sample rate audio is normalized to before it reaches the backend
+    sample_rate = an.TARGET_RATE
+
+    def __init__(self):
+        self.loaded = False
+        self.load_error = None
+        self.load_time = None
+        self._load_lock = threading.Lock()
+        # Outbound HTTP client of cloud backends (see cloud_http.CloudClient)
+        self.http = None if self.local else ch.CloudClient(self.id, self.name)
+
+    def is_configured(self):
+        """Whether the backend can be used at all (cheap check, doesn't load anything)"""
+        return True
+
+    def is_available(self):
+        """Whether the backend is configured, hasn't failed to load and its circuit isn't open"""
+        return (self.is_configured() and self.load_error is None
+                and (self.http is None or self.http.is_available()))
+
+    def _load(self):
+        """Load the model or client (implemented by subclasses)"""
+
+    def load(self):
+        """
+        Load the backend if it isn't loaded yet
+
+        Returns:
+            True if the backend is ready to use
+        """
+        if self.loaded:
+            return True
+        if not self.is_configured() or self.load_error is not None:
+            return False
+
+        with self._load_lock:
+            if not self.loaded and self.load_error is None:
+                start = time.perf_counter()
+                try:
+                    self._load()
+                    self.loaded = True
+                    self.load_time = time.perf_counter() - start
+                    logger.info(f"{self.name} loaded in {self.load_time:.2f}s")
+                except Exception as e:
+                    self.load_error = str(e)
+                    logger.error(f"Error loading {self.name}: {str(e)}")
+        return self.loaded
+
+    def warmup(self):
+        """Load the backend ahead of the first request"""
+        return self.load()
+
+    def health(self):
+        """Get the backend's status"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'version': self.version,
+            'available': self.is_available(),
+            'loaded': self.loaded,
+            'load_time': self.load_time,
+            'error': self.load_error,
+            'streaming': self.supports_streaming,
+            'local': self.local,
+            'http': self.http.get_stats() if self.http else None
+        }
+
+    def recognize(self, audio_bytes):
+        """
+        Recognize a complete clip
+
+        Returns:
+            Tuple of (transcribed_text, confidence_score); empty text if the
+            clip has no recognizable speech
+
+        Raises:
+            cloud_http.UpstreamError: A cloud backend failed to answer or
+                answered with an error
+        """
+        raise NotImplementedError
+
+    def stream(self, audio_bytes, session_id):
+        """
+        Recognize the next chunk of a live stream
+
+        Returns:
+            Tuple of (final_results, partial_text) where final_results is a
+            list of (text, confidence) tuples for utterances completed in this chunk
+        """
+        text, confidence = self.recognize(audio_bytes)
+        return ([(text, confidence)] if text else []), ""
+
+    def finish_stream(self, session_id):
+        """Finalize the pending utterance of a live stream"""
+        return []
+
+    def release_session(self, session_id):
+        """Release any state kept for a live session"""
+
+class GoogleBackend(RecognizerBackend):
+    """Google Speech Recognition through the speech_recognition package"""
+
+    id = "google"
+    name = "Google Speech Recognition"
+    version = "google-web-speech-v2"
+
+    def _load(self):
+        import speech_recognition as sr
+        from speech_recognition.recognizers.google import create_request_builder, OutputParser
+        self.sr = sr
+        self.request_builder = create_request_builder(
+            endpoint=GOOGLE_SPEECH_ENDPOINT, key=os.environ.get("GOOGLE_SPEECH_API_KEY")
+        )
+        self.output_parser = OutputParser(show_all=False, with_confidence=True)
+
+    def recognize(self, audio_bytes):
+        """Recognize speech using Google Speech Recognition"""
+        if not self.load():
+            return "", 0.0
+
+        sr = self.sr
+        try:
+            pcm, frame_rate = extract_pcm(audio_bytes)
+
+            # Build the request straight from the PCM frames and send it on
+            # the pooled client rather than a new urllib connection per call
+            audio_data = sr.AudioData(bytes(pcm), frame_rate, 2)
+            response = self.http.request(
+                "POST", self.request_builder.build_url(),
+                data=self.request_builder.build_data(audio_data),
+                headers=self.request_builder.build_headers(audio_data)
+            )
+            if response.status_code != 200:
+                # An error response is a failure of the backend, not silence
+                raise ch.UpstreamError(f"{self.name} request failed: HTTP {response.status_code}")
+            return self.output_parser.parse(response.text)
+        except ch.UpstreamError:
+            raise
+        except sr.UnknownValueError:
+            logger.warning("Google Speech Recognition could not understand audio")
+            return "", 0.0
+        except sr.RequestError as e:
+            logger.error(f"Google Speech Recognition service error: {str(e)}")
+            return "", 0.0
+        except Exception as e:
+            logger.error(f"Error in Google Speech Recognition: {str(e)}")
+            return "", 0.0
+
+class VoskBackend(RecognizerBackend):
+    """Offline Vosk recognition, with incremental recognizers for live sessions"""
+
+    id = "vosk"
+    name = "Vosk"
+    version = os.path.basename(VOSK_MODEL_PATH)
+    supports_streaming = True
+    local = True
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        super().__init__()
+        self.model_path = model_path
+        self.model = None
+        # Session recognizers, keyed by session id. Sessions are streamed
+        # from several stream_pool threads at once, so the dict is locked.
+        self.sessions = {}
+        self._sessions_lock = threading.Lock()
+
+    def is_configured(self):
+        return (importlib.util.find_spec("vosk") is not None
+                and os.path.isdir(os.path.join(self.model_path, "am")))
+
+    def _load(self):
+        from vosk import Model, KaldiRecognizer
+        self.KaldiRecognizer = KaldiRecognizer
+        self.model = Model(self.model_path)
+
+    def warmup(self):
+        """Load the model and decode a short silence to initialize the decoder"""
+        if not self.load():
+            return False
+        rec = self.KaldiRecognizer(self.model, self.sample_rate)
+        rec.AcceptWaveform(bytes(self.sample_rate // 5))
+        rec.FinalResult()
+        return True
+
+    def health(self):
+        status = super().health()
+        status['sessions'] = len(self.sessions)
+        return status
+
+    def recognize(self, audio_bytes):
+        """Recognize speech using Vosk"""
+        if not self.load():
+            return "Vosk model not loaded", 0.0
+
+        try:
+            pcm, frame_rate = extract_pcm(audio_bytes)
+
+            # Create Kaldi recognizer with the model
+            rec = self.KaldiRecognizer(self.model, frame_rate)
+
+            # Process audio
+            rec.AcceptWaveform(bytes(pcm))
+            result = json.loads(rec.Result())
+
+            # Extract text and confidence
+            text = result.get("text", "")
+            confidence = result.get("confidence", 0.0)
+
+            return text, confidence
+        except Exception as e:
+            logger.error(f"Error in Vosk Speech Recognition: {str(e)}")
+            return "", 0.0
+
+    def release_idle_sessions(self, timeout=VOSK_IDLE_TIMEOUT):
+        """Release session recognizers that haven't been used within the timeout"""
+        now = time.monotonic()
+        with self._sessions_lock:
+            for session_id in [sid for sid, session in self.sessions.items()
+                               if now - session['last_used'] > timeout]:
+                logger.debug(f"Releasing idle Vosk recognizer for session {session_id}")
+                del self.sessions[session_id]
+
+    def release_session(self, session_id):
+        """Release the Vosk recognizer for a session"""
+        with self._sessions_lock:
+            self.sessions.pop(session_id, None)
+
+    def get_session_recognizer(self, session_id, frame_rate=16000):
+        """Get the incremental Vosk recognizer for a session, creating it if needed"""
+        self.release_idle_sessions()
+
+        with self._sessions_lock:
+            session = self.sessions.get(session_id)
+            if session is None or session['frame_rate'] != frame_rate:
+                logger.debug(f"Creating Vosk recognizer for session {session_id} at {frame_rate} Hz")
+                rec = self.KaldiRecognizer(self.model, frame_rate)
+                rec.SetWords(True)
+                session = {'recognizer': rec, 'frame_rate': frame_rate}
+                self.sessions[session_id] = session
+
+            session['last_used'] = time.monotonic()
+        return session['recognizer']
+
+    def stream(self, audio_bytes, session_id):
+        """
+        Feed a chunk of a live stream into the session's Vosk recognizer
+
+        Decoder state is kept between chunks, so words spanning chunk
+        boundaries are recognized. Audio is fed incrementally and a final
+        result is produced whenever Vosk detects an endpoint.
+
+        Args:
+            audio_bytes: WAV bytes or 16kHz mono 16-bit PCM
+            session_id: Live session id
+        """
+        if not self.load():
+            return [], ""
+
+        try:
+            pcm, frame_rate = extract_pcm(audio_bytes)
+            pcm = memoryview(pcm)
+            rec = self.get_session_recognizer(session_id, frame_rate)
+
+            finals = []
+            for offset in range(0, len(pcm), VOSK_FEED_BYTES):
+                if rec.AcceptWaveform(bytes(pcm[offset:offset + VOSK_FEED_BYTES])):
+                    result = json.loads(rec.Result())
+                    if result.get("text"):
+                        finals.append((result["text"], vosk_result_confidence(result)))
+
+            partial = json.loads(rec.PartialResult()).get("partial", "")
+            return finals, partial
+        except Exception as e:
+            logger.error(f"Error in Vosk streaming recognition: {str(e)}")
+            return [], ""
+
+    def finish_stream(self, session_id):
+        """
+        Force an endpoint on the session's Vosk recognizer
+
+        Used when the stream goes silent and the silent audio isn't sent to the
+        decoder, so the pending utterance is finalized without waiting for it.
+        """
+        with self._sessions_lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return []
+            session['last_used'] = time.monotonic()
+
+        try:
+            result = json.loads(session['recognizer'].FinalResult())
+            if result.get("text"):
+                return [(result["text"], vosk_result_confidence(result))]
+            return []
+        except Exception as e:
+            logger.error(f"Error finishing Vosk stream: {str(e)}")
+            return []
+
+class WhisperBackend(RecognizerBackend):
+    """OpenAI Whisper through the OpenAI API"""
+
+    id = "whisper"
+    name = "OpenAI Whisper"
+    version = WHISPER_MODEL
+
+    def is_configured(self):
+        # Check if OpenAI API key is available
+        return bool(os.environ.get("OPENAI_API_KEY"))
+
+    def _load(self):
         # We'll use the API directly rather than loading the model locally
-        whisper_model = True
-        logger.info("OpenAI Whisper API configuration loaded successfully")
-except Exception as e:
-    logger.error(f"Error configuring OpenAI Whisper API: {str(e)}")
-    client = None
-    whisper_model = None
+        self.url = f"{OPENAI_BASE_URL.rstrip('/')}/audio/transcriptions"
+        self.headers = {"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}"}
 
-# Initialize speech recognizer for Google
-recognizer = sr.Recognizer()
+    def recognize(self, audio_bytes):
+        """Recognize speech using OpenAI Whisper API"""
+        if not self.load():
+            return "Whisper API not configured", 0.0
+
+        try:
+            # Multipart upload to the transcription endpoint on the pooled client
+            audio_file = wav_file(audio_bytes)
+            response = self.http.request(
+                "POST", self.url, headers=self.headers,
+                data={"model": WHISPER_MODEL},
+                files={"file": (audio_file.name, audio_file, "audio/wav")}
+            )
+            if response.status_code != 200:
+                # An error response is a failure of the backend, not silence
+                raise ch.UpstreamError(f"{self.name} request failed: HTTP {response.status_code} {response.text[:200]}")
+            try:
+                text = response.json().get("text", "")
+            except ValueError as e:
+                raise ch.UpstreamError(f"{self.name} returned an invalid response: {str(e)}") from e
+            # OpenAI Whisper API doesn't provide confidence scores directly
+            confidence = 0.9  # Placeholder value for API-based transcription
+
+            return text, confidence
+        except ch.UpstreamError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in Whisper Speech Recognition API: {str(e)}")
+            return "", 0.0
+
+# Registered backends, keyed by model id
+backends = {}
+
+def register_backend(backend):
+    """Register a recognizer backend under its id"""
+    backends[backend.id] = backend
+    pm.register_model(backend.id)
+    return backend
+
+def get_backend(model):
+    """Get the backend for a model id, or None"""
+    return backends.get(model)
+
+register_backend(GoogleBackend())
+register_backend(VoskBackend())
+register_backend(WhisperBackend())
 
 def get_available_models():
     """Get list of available speech recognition models"""
-    models = []
-    
-    models.append({
-        "id": "google", 
-        "name": "Google Speech Recognition", 
-        "available": True
-    })
-    
-    models.append({
-        "id": "vosk", 
-        "name": "Vosk", 
-        "available": vosk_model is not None
-    })
-    
-    models.append({
-        "id": "whisper", 
-        "name": "OpenAI Whisper", 
-        "available": whisper_model is not None
-    })
-    
-    return models
+    return [
+        {"id": backend.id, "name": backend.name, "available": backend.is_available()}
+        for backend in backends.values()
+    ]
+
+def get_model_version(model):
+    """Get the version identifier of a model's backend (used in cache keys)"""
+    backend = get_backend(model)
+    return backend.version if backend else "unknown"
+
+def supports_streaming(model):
+    """Whether a model decodes live streams incrementally"""
+    backend = get_backend(model)
+    return backend is not None and backend.supports_streaming and backend.is_available()
+
+def get_sample_rate(model):
+    """Get the sample rate a model wants its audio in"""
+    backend = get_backend(model)
+    return backend.sample_rate if backend else an.TARGET_RATE
+
+def is_local_model(model):
+    """Whether a model decodes locally rather than calling a network API"""
+    backend = get_backend(model)
+    return backend is not None and backend.local
+
+def warmup(models=None):
+    """
+    Load (and warm up) backends ahead of the first request
+
+    Args:
+        models: Model ids to warm up; defaults to all available backends
+
+    Returns:
+        Dictionary of model id to whether it is ready
+    """
+    ready = {}
+    for model in models or [backend.id for backend in backends.values() if backend.is_available()]:
+        backend = get_backend(model)
+        if backend is None:
+            logger.warning(f"Unknown model for warmup: {model}")
+            continue
+        try:
+            ready[model] = backend.warmup()
+        except Exception as e:
+            logger.error(f"Error warming up {model}: {str(e)}")
+            ready[model] = False
+    return ready
+
+def get_backend_health():
+    """Get the status of every registered backend"""
+    return {model: backend.health() for model, backend in backends.items()}
+
+def release_session(session_id):
+    """Release the live-session state every backend keeps for a session"""
+    for backend in backends.values():
+        backend.release_session(session_id)
 
 def base64_to_audio(base64_audio):
     """Convert base64 audio data to audio format for processing"""
     try:
+        # Binary frames are already raw audio bytes
+        if isinstance(base64_audio, (bytes, bytearray, memoryview)):
+            return base64_audio
+
         # Extract the actual base64 data after the prefix
         if ',' in base64_audio:
             header, encoded = base64_audio.split(",", 1)
             logger.debug(f"Audio header format: {header}")
         else:
             encoded = base64_audio
-        
+
         # Decode the base64 data to binary
         audio_bytes = base64.b64decode(encoded)
         logger.debug(f"Decoded audio bytes length: {len(audio_bytes)}")
-        
+
         return audio_bytes
     except Exception as e:
         logger.error(f"Error converting base64 to audio: {str(e)}")
         return None
 
-def recognize_with_google(audio_bytes):
-    """Recognize speech using Google Speech Recognition"""
-    try:
-        # Save the audio bytes to a temporary WAV file
-        with NamedTemporaryFile(suffix=".wav", delete=True) as temp_audio:
-            with wave.open(temp_audio.name, 'wb') as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(2)  # 16-bit audio
-                wf.setframerate(16000)
-                wf.writeframes(audio_bytes)
-            
-            # Use the temporary file for recognition
-            with sr.AudioFile(temp_audio.name) as source:
-                audio_data = recognizer.record(source)
-                text = recognizer.recognize_google(audio_data)
-                # Google doesn't provide confidence scores directly
-                confidence = 0.9  # Placeholder value
-                return text, confidence
-    except sr.UnknownValueError:
-        logger.warning("Google Speech Recognition could not understand audio")
-        return "", 0.0
-    except sr.RequestError as e:
-        logger.error(f"Google Speech Recognition service error: {str(e)}")
-        return "", 0.0
-    except Exception as e:
-        logger.error(f"Error in Google Speech Recognition: {str(e)}")
-        return "", 0.0
-
-def recognize_with_vosk(audio_bytes):
-    """Recognize speech using Vosk"""
-    if vosk_model is None:
-        return "Vosk model not loaded", 0.0
+def extract_pcm(audio_bytes):
+    """
+    Get 16-bit mono PCM frames and the sample rate from WAV bytes
     
-    try:
-        # Create Kaldi recognizer with the model
-        rec = KaldiRecognizer(vosk_model, 16000)
-        
-        # Process audio
-        rec.AcceptWaveform(audio_bytes)
-        result = json.loads(rec.Result())
-        
-        # Extract text and confidence
-        text = result.get("text", "")
-        confidence = result.get("confidence", 0.0)
-        
-        return text, confidence
-    except Exception as e:
-        logger.error(f"Error in Vosk Speech Recognition: {str(e)}")
-        return "", 0.0
+    16-bit mono WAV data is returned as a view into the input without
+    copying. Headerless input is assumed to be 16kHz mono 16-bit PCM.
+    
+    Returns:
+        Tuple of (pcm, frame_rate)
+    """
+    return ac.to_pcm16_mono(audio_bytes)
 
-def recognize_with_whisper(audio_bytes):
-    """Recognize speech using OpenAI Whisper API"""
-    if whisper_model is None:
-        return "Whisper API not configured", 0.0
+def wav_file(audio_bytes, name="audio.wav"):
+    """
+    Get a named in-memory WAV file for upload APIs
     
-    try:
-        # Save the audio bytes to a temporary WAV file
-        with NamedTemporaryFile(suffix=".wav", delete=True) as temp_audio:
-            with wave.open(temp_audio.name, 'wb') as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(2)  # 16-bit audio
-                wf.setframerate(16000)
-                wf.writeframes(audio_bytes)
-            
-            # Use the OpenAI API to transcribe the audio
-            with open(temp_audio.name, "rb") as audio_file:
-                # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-                # do not change this unless explicitly requested by the user
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file
-                )
-            
-            text = transcript.text
-            # OpenAI Whisper API doesn't provide confidence scores directly
-            confidence = 0.9  # Placeholder value for API-based transcription
-            
-            return text, confidence
-    except Exception as e:
-        logger.error(f"Error in Whisper Speech Recognition API: {str(e)}")
-        return "", 0.0
+    16-bit mono WAV input is passed through as is; anything else is
+    converted and given a WAV header.
+    
+    Returns:
+        io.BytesIO with a name attribute (used for the upload's filename)
+    """
+    pcm, frame_rate = extract_pcm(audio_bytes)
+    if ac.is_wav(audio_bytes) and ac.parse_wav(audio_bytes)[0] == ac.PCM16_MONO_16K._replace(frame_rate=frame_rate):
+        buffer = io.BytesIO(audio_bytes)
+    else:
+        buffer = io.BytesIO(ac.wav_header(len(pcm), frame_rate) + bytes(pcm))
+    buffer.name = name
+    return buffer
+
+def vosk_result_confidence(result):
+    """Average word confidence of a Vosk result"""
+    words = result.get("result", [])
+    if not words:
+        return 0.0
+    return sum(word.get("conf", 0.0) for word in words) / len(words)
+
+def recognize_stream(audio_bytes, session_id, model="vosk"):
+    """Feed a chunk of a live stream to a streaming backend (see RecognizerBackend.stream)"""
+    return get_backend(model).stream(audio_bytes, session_id)
+
+def finish_stream(session_id, model="vosk"):
+    """Finalize the pending utterance of a live stream"""
+    return get_backend(model).finish_stream(session_id)
 
 def recognize_speech(audio_base64, model="google"):
     """
-    Recognize speech from base64-encoded audio using the specified model
-    
+    Recognize speech from audio using the specified model
+
     Args:
-        audio_base64: Base64 encoded audio data
+        audio_base64: Audio bytes/memoryview from a binary frame, or base64
+            encoded audio data
         model: Speech recognition model to use (google, vosk, or whisper)
-        
+
     Returns:
         Tuple of (transcribed_text, confidence_score)
+
+    Raises:
+        cloud_http.UpstreamError: A cloud backend timed out, kept failing,
+            answered with an error or has its circuit open
     """
     logger.debug(f"Recognizing speech with model: {model}")
-    
+
     try:
-        # Convert base64 to audio bytes
+        # Convert base64 to audio bytes (binary frames pass straight through)
         audio_bytes = base64_to_audio(audio_base64)
-        
-        if not audio_bytes:
+
+        if audio_bytes is None or len(audio_bytes) == 0:
             logger.error("Failed to convert base64 to audio data")
             return "", 0.0
-        
+
         # Process with the selected model
-        if model == "google":
-            return recognize_with_google(audio_bytes)
-        elif model == "vosk":
-            return recognize_with_vosk(audio_bytes)
-        elif model == "whisper":
-            return recognize_with_whisper(audio_bytes)
-        else:
+        backend = get_backend(model)
+        if backend is None:
             logger.error(f"Unknown model type: {model}")
             return "", 0.0
+
+        return backend.recognize(audio_bytes)
+    except ch.UpstreamError:
+        # Let the caller tell the client the backend is unavailable
+        raise
     except Exception as e:
         logger.error(f"Error in speech recognition: {str(e)}")
         return "", 0.0
@@ -1,5 +1,12 @@
 // Audio Recorder Component
 
+// Live capture sends 16kHz mono 16-bit PCM frames from an AudioWorklet when
+// the browser supports it, and falls back to MediaRecorder blobs otherwise
+const PCM_TARGET_RATE = 16000;
+const PCM_FRAME_MS = 160;
+const PCM_FORMAT = `audio/pcm;rate=${PCM_TARGET_RATE};channels=1`;
+const PCM_WORKLET_URL = '/static/js/pcm-capture-worklet.js';
+
 const AudioRecorder = React.forwardRef((props, ref) => {
   const { onAudioData, onAudioLevel, model, demoMode } = props;
   
@@ -13,6 +20,11 @@ const AudioRecorder = React.forwardRef((props, ref) => {
   const processingIntervalRef = React.useRef(null);
   const demoModeIntervalRef = React.useRef(null);
   const isRecordingRef = React.useRef(false);
+  const workletNodeRef = React.useRef(null);
+  const modelRef = React.useRef(model);
+  const demoModeRef = React.useRef(demoMode);
+  modelRef.current = model;
+  demoModeRef.current = demoMode;
   
   // Use a single function to update audio levels for visualizer
   const updateAudioLevels = () => {
@@ -102,7 +114,28 @@ const AudioRecorder = React.forwardRef((props, ref) => {
       const audioBlob = new Blob(audioChunksRef.current, { type: 'audio/webm' });
       console.log('Created audio blob, size:', audioBlob.size);
       
-      // Convert to base64
+      // Prefer sending raw bytes as a Socket.IO binary attachment
+      if (typeof audioBlob.arrayBuffer === 'function') {
+        audioBlob.arrayBuffer().then((buffer) => {
+          console.log('Sending binary audio, bytes:', buffer.byteLength);
+
+          if (onAudioData) {
+            onAudioData({
+              audio: buffer,
+              format: audioBlob.type,
+              force_demo_mode: demoMode,
+              model: model || 'google'
+            });
+          }
+        }).catch((error) => {
+          console.error('Error reading audio blob:', error);
+        });
+
+        audioChunksRef.current = [];
+        return;
+      }
+
+      // Fall back to base64 data URLs on older browsers
       const reader = new FileReader();
       reader.onloadend = () => {
         const base64Audio = reader.result;
@@ -129,6 +162,75 @@ const AudioRecorder = React.forwardRef((props, ref) => {
     }
   };
   
+  // Create the audio context, at 16kHz if the browser can resample the microphone to it
+  const createAudioContext = (stream) => {
+    const AudioContextClass = window.AudioContext || window.webkitAudioContext;
+    if (window.AudioWorkletNode) {
+      let audioContext = null;
+      try {
+        audioContext = new AudioContextClass({ sampleRate: PCM_TARGET_RATE });
+        return { audioContext, source: audioContext.createMediaStreamSource(stream) };
+      } catch (e) {
+        // Some browsers can't connect a microphone to a context at another rate;
+        // the worklet downsamples instead
+        console.warn('16kHz AudioContext not supported, capturing at the device rate');
+        if (audioContext) audioContext.close().catch(() => {});
+      }
+    }
+    const audioContext = new AudioContextClass();
+    return { audioContext, source: audioContext.createMediaStreamSource(stream) };
+  };
+  
+  // Send each PCM frame from the capture worklet to the server
+  const handlePcmFrame = (event) => {
+    const { pcm, final } = event.data;
+    if (onAudioData && (pcm.byteLength > 0 || final)) {
+      onAudioData({
+        audio: pcm,
+        format: PCM_FORMAT,
+        final,
+        force_demo_mode: demoModeRef.current,
+        model: modelRef.current || 'google'
+      });
+    }
+  };
+  
+  // Capture 16kHz PCM frames with an AudioWorklet
+  const startPcmCapture = async (audioContext, source) => {
+    if (!window.AudioWorkletNode || !audioContext.audioWorklet) {
+      return false;
+    }
+    
+    try {
+      await audioContext.audioWorklet.addModule(PCM_WORKLET_URL);
+      const node = new AudioWorkletNode(audioContext, 'pcm-capture-processor', {
+        numberOfInputs: 1,
+        numberOfOutputs: 0,
+        processorOptions: { targetRate: PCM_TARGET_RATE, frameMs: PCM_FRAME_MS }
+      });
+      node.port.onmessage = handlePcmFrame;
+      source.connect(node);
+      workletNodeRef.current = node;
+      console.log(`PCM capture started: ${audioContext.sampleRate} Hz input, ${PCM_FRAME_MS} ms frames`);
+      return true;
+    } catch (e) {
+      console.warn('AudioWorklet capture unavailable, falling back to MediaRecorder:', e);
+      return false;
+    }
+  };
+  
+  // Close the audio context
+  const closeAudioContext = () => {
+    if (audioContextRef.current) {
+      try {
+        audioContextRef.current.close().catch(err => console.error('Error closing audio context:', err));
+      } catch (e) {
+        console.error('Error closing audio context:', e);
+      }
+      audioContextRef.current = null;
+    }
+  };
+  
   // Start recording function
   const startRecording = async () => {
     console.log('Starting recording...');
@@ -205,8 +307,9 @@ const AudioRecorder = React.forwardRef((props, ref) => {
       
       // Create audio context and analyzer for visualizer
       let audioContext;
+      let source;
       try {
-        audioContext = new (window.AudioContext || window.webkitAudioContext)();
+        ({ audioContext, source } = createAudioContext(stream));
         audioContextRef.current = audioContext;
       } catch (e) {
         console.error('Error creating AudioContext:', e);
@@ -221,13 +324,19 @@ const AudioRecorder = React.forwardRef((props, ref) => {
         analyserRef.current = analyser;
         
         // Connect microphone to analyzer
-        const source = audioContext.createMediaStreamSource(stream);
         source.connect(analyser);
       } catch (e) {
         console.error('Error setting up audio analyzer:', e);
         // We can continue without the analyzer, but visualization won't be as good
       }
       
+      // Prefer streaming PCM frames; no container for the server to parse
+      if (await startPcmCapture(audioContext, source)) {
+        window.forcedDemoMode = false;
+        window.isBackupDemoMode = false;
+        return;
+      }
+      
       // Set up media recorder
       audioChunksRef.current = [];
       let options = {};
@@ -337,14 +446,28 @@ const AudioRecorder = React.forwardRef((props, ref) => {
       processAudioChunks();
     }
     
-    // Close audio context
-    if (audioContextRef.current) {
-      try {
-        audioContextRef.current.close().catch(err => console.error('Error closing audio context:', err));
-      } catch (e) {
-        console.error('Error closing audio context:', e);
-      }
+    // Send the last partial PCM frame, then close its context once it arrives
+    if (workletNodeRef.current) {
+      const node = workletNodeRef.current;
+      const audioContext = audioContextRef.current;
+      workletNodeRef.current = null;
       audioContextRef.current = null;
+      
+      let closed = false;
+      const closeCaptureContext = () => {
+        if (closed) return;
+        closed = true;
+        node.port.onmessage = null;
+        audioContext.close().catch(err => console.error('Error closing audio context:', err));
+      };
+      node.port.onmessage = (event) => {
+        handlePcmFrame(event);
+        if (event.data.final) closeCaptureContext();
+      };
+      node.port.postMessage('flush');
+      setTimeout(closeCaptureContext, 500);
+    } else {
+      closeAudioContext();
     }
     
     // Stop all tracks in the stream
@@ -26,6 +26,22 @@ const ModelSelector = ({ currentModel, onModelChange, bestModel }) => {
       description: 'OpenAI\'s speech recognition model. Excellent for various accents.',
       color: 'bg-green-500',
       textColor: 'text-green-800'
+    },
+    {
+      id: 'auto',
+      name: 'Auto',
+      icon: 'fas fa-route',
+      description: 'Picks the fastest healthy model for each chunk, falling back to Vosk when cloud services are slow or down.',
+      color: 'bg-yellow-500',
+      textColor: 'text-yellow-800'
+    },
+    {
+      id: 'compare',
+      name: 'Compare All',
+      icon: 'fas fa-balance-scale',
+      description: 'Runs every available model on the same audio and shows their results side by side.',
+      color: 'bg-purple-500',
+      textColor: 'text-purple-800'
     }
   ];
   
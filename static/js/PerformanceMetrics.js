@@ -1,5 +1,9 @@
 // Performance Metrics Component
 
+// Keys in the metrics payload that are not per-model metrics
+const NON_MODEL_METRIC_KEYS = ['best_model', 'pipeline', 'cache', 'stages'];
+const isModelMetricKey = (key) => !NON_MODEL_METRIC_KEYS.includes(key);
+
 const PerformanceMetrics = ({ metrics, onResetMetrics }) => {
   const chartRefs = React.useRef({
     processingTime: null,
@@ -116,7 +120,7 @@ const PerformanceMetrics = ({ metrics, onResetMetrics }) => {
   const updateCharts = () => {
     if (!metrics || Object.keys(metrics).length === 0) return;
     
-    const modelKeys = Object.keys(metrics).filter(key => key !== 'best_model');
+    const modelKeys = Object.keys(metrics).filter(isModelMetricKey);
     if (modelKeys.length === 0) return;
     
     // Update Processing Time Chart
@@ -192,7 +196,7 @@ const PerformanceMetrics = ({ metrics, onResetMetrics }) => {
       return [];
     }
     
-    const modelKeys = Object.keys(metrics).filter(key => key !== 'best_model');
+    const modelKeys = Object.keys(metrics).filter(isModelMetricKey);
     if (modelKeys.length === 0) return [];
     
     return modelKeys.map(key => {
@@ -204,10 +208,16 @@ const PerformanceMetrics = ({ metrics, onResetMetrics }) => {
       const confidence = modelData.avg_confidence || 0;
       const wordsPerMinute = modelData.words_per_minute || 0;
       const count = modelData.count || 0;
+      const p50 = modelData.p50_processing_time || 0;
+      const p95 = modelData.p95_processing_time || 0;
+      const p99 = modelData.p99_processing_time || 0;
       
       return {
         name: getModelDisplayName(key),
         processingTime: processingTime,
+        p50: p50,
+        p95: p95,
+        p99: p99,
         confidence: confidence,
         wordsPerMinute: wordsPerMinute,
         count: count,
@@ -255,6 +265,12 @@ const PerformanceMetrics = ({ metrics, onResetMetrics }) => {
                       <p className="text-gray-500">Samples:</p>
                       <p className="font-medium">{stat.count || 0}</p>
                     </div>
+                    <div className="col-span-2">
+                      <p className="text-gray-500">Latency p50 / p95 / p99:</p>
+                      <p className="font-medium">
+                        {stat.p50.toFixed(0)} / {stat.p95.toFixed(0)} / {stat.p99.toFixed(0)} ms
+                      </p>
+                    </div>
                   </div>
                 </div>
               ))}
@@ -1,6 +1,6 @@
 // Transcription Display Component
 
-const TranscriptionDisplay = ({ results, sentimentAnalysisEnabled }) => {
+const TranscriptionDisplay = ({ results, partial, sentimentAnalysisEnabled }) => {
   const containerRef = React.useRef(null);
   
   // Auto-scroll to the bottom when new results come in
@@ -8,7 +8,7 @@ const TranscriptionDisplay = ({ results, sentimentAnalysisEnabled }) => {
     if (containerRef.current) {
       containerRef.current.scrollTop = containerRef.current.scrollHeight;
     }
-  }, [results]);
+  }, [results, partial]);
   
   // Get display time in readable format
   const getDisplayTime = () => {
@@ -79,7 +79,7 @@ const TranscriptionDisplay = ({ results, sentimentAnalysisEnabled }) => {
       ref={containerRef}
       className="transcription-container bg-gray-50 dark:bg-gray-800/50 border border-gray-200 dark:border-gray-700 rounded-lg p-4 h-64 overflow-y-auto transition-colors duration-300"
     >
-      {results.length === 0 ? (
+      {results.length === 0 && !(partial && partial.text) ? (
         <div className="text-center text-gray-500 dark:text-gray-400 h-full flex items-center justify-center">
           <p>Start recording to see transcription results</p>
         </div>
@@ -122,6 +122,11 @@ const TranscriptionDisplay = ({ results, sentimentAnalysisEnabled }) => {
               </div>
             </div>
           ))}
+          {partial && partial.text && (
+            <div className={`p-3 rounded-lg ${getModelBackgroundColor(partial.model)} opacity-70`}>
+              <div className="text-gray-600 dark:text-gray-300 italic">{partial.text}</div>
+            </div>
+          )}
         </div>
       )}
     </div>
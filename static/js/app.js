@@ -3,10 +3,52 @@
 // Global socket.io connection
 const socket = io();
 
+// Apply a performance_metrics_delta to a metrics object: nested objects are
+// merged key by key and null removes a key
+const applyMetricsDelta = (metrics, changes) => {
+  const merged = { ...metrics };
+  Object.entries(changes).forEach(([key, value]) => {
+    if (value === null) {
+      delete merged[key];
+    } else if (typeof value === 'object' && !Array.isArray(value) &&
+               typeof merged[key] === 'object' && merged[key] !== null && !Array.isArray(merged[key])) {
+      merged[key] = applyMetricsDelta(merged[key], value);
+    } else {
+      merged[key] = value;
+    }
+  });
+  return merged;
+};
+
+// Most live PCM audio held back while the server is busy (10s of 16kHz 16-bit mono)
+const MAX_HELD_PCM_BYTES = 320000;
+
+// Whether recorder data is a live PCM frame from the capture worklet
+const isPcmFrame = (audioData) =>
+  typeof audioData.format === 'string' && audioData.format.startsWith('audio/pcm');
+
+// Join PCM frames (ArrayBuffers) into one
+const joinPcmFrames = (frames) => {
+  const joined = new Uint8Array(frames.reduce((total, frame) => total + frame.byteLength, 0));
+  let offset = 0;
+  frames.forEach((frame) => {
+    joined.set(new Uint8Array(frame), offset);
+    offset += frame.byteLength;
+  });
+  return joined.buffer;
+};
+
 // Main App component
 const App = () => {
   const [isRecording, setIsRecording] = React.useState(false);
   const [transcriptionResults, setTranscriptionResults] = React.useState([]);
+  const [partialTranscription, setPartialTranscription] = React.useState(null);
+  // Time until which the server asked us to hold back audio
+  const busyUntilRef = React.useRef(0);
+  // Live PCM frames held back while the server is busy
+  const heldPcmRef = React.useRef(null);
+  // Version of the server metrics snapshot our copy is based on
+  const metricsVersionRef = React.useRef(0);
   const [currentModel, setCurrentModel] = React.useState('google');
   const [noiseReduction, setNoiseReduction] = React.useState(true);
   const [sentimentAnalysis, setSentimentAnalysis] = React.useState(true);
@@ -174,11 +216,11 @@ const App = () => {
       modelMetrics.words_per_minute = (modelMetrics.total_words / (modelMetrics.total_time / 1000)) * 60;
       
       // Determine best model based on a combination of factors
-      if (Object.keys(newMetrics).filter(key => key !== 'best_model').length > 0) {
+      if (Object.keys(newMetrics).filter(isModelMetricKey).length > 0) {
         let bestModel = null;
         let bestScore = -1;
         
-        Object.keys(newMetrics).filter(key => key !== 'best_model').forEach(mdl => {
+        Object.keys(newMetrics).filter(isModelMetricKey).forEach(mdl => {
           const m = newMetrics[mdl];
           if (m.count > 0) {
             // Score is weighted: 60% confidence, 40% speed (inverse of processing time)
@@ -283,8 +325,13 @@ const App = () => {
       setSentimentAnalysis(settings.sentimentAnalysis);
     });
     
+    socket.on('transcription_partial', (partial) => {
+      setPartialTranscription(partial);
+    });
+    
     socket.on('transcription_result', (result) => {
       console.log('Received transcription result:', result);
+      setPartialTranscription(null);
       
       // Add new result to transcription results
       setTranscriptionResults(prevResults => {
@@ -300,11 +347,31 @@ const App = () => {
       updateMetricsWithResult(result);
     });
     
-    socket.on('performance_metrics', (metrics) => {
-      console.log('Received performance metrics:', metrics);
-      if (metrics && Object.keys(metrics).length > 0) {
-        setPerformanceMetrics(metrics);
+    socket.on('performance_metrics', (snapshot) => {
+      console.log('Received performance metrics:', snapshot);
+      metricsVersionRef.current = snapshot.version;
+      if (snapshot.metrics && Object.keys(snapshot.metrics).length > 0) {
+        setPerformanceMetrics(snapshot.metrics);
+      }
+    });
+    
+    socket.on('performance_metrics_delta', (delta) => {
+      // A missed update means our copy is out of date: ask for a full snapshot
+      if (delta.base !== metricsVersionRef.current) {
+        socket.emit('get_performance_metrics');
+        return;
       }
+      metricsVersionRef.current = delta.version;
+      setPerformanceMetrics(prevMetrics => applyMetricsDelta(prevMetrics, delta.changes));
+    });
+    
+    socket.on('comparison_complete', (comparison) => {
+      console.log('Model comparison complete:', comparison);
+    });
+    
+    socket.on('busy', (busy) => {
+      console.warn(`Server busy, pausing audio for ${busy.retry_after}ms`);
+      busyUntilRef.current = Date.now() + (busy.retry_after || 1000);
     });
     
     socket.on('error', (error) => {
@@ -320,8 +387,12 @@ const App = () => {
       socket.off('connect');
       socket.off('disconnect');
       socket.off('settings');
+      socket.off('transcription_partial');
       socket.off('transcription_result');
       socket.off('performance_metrics');
+      socket.off('performance_metrics_delta');
+      socket.off('comparison_complete');
+      socket.off('busy');
       socket.off('error');
     };
   }, []);
@@ -414,11 +485,54 @@ const App = () => {
   
   // Handle audio data from recorder
   const handleAudioData = (audioData) => {
+    if (isPcmFrame(audioData)) {
+      sendPcmFrame(audioData);
+      return;
+    }
+    
+    if (audioData.audio && Date.now() < busyUntilRef.current) {
+      console.warn('Server busy, skipping audio chunk');
+      return;
+    }
+    
+    emitAudio(audioData);
+  };
+  
+  const emitAudio = (audioData) => {
     if (isConnected) {
       socket.emit('audio_data', audioData);
     }
   };
   
+  // Live PCM frames are one continuous stream: while the server is busy they
+  // are held back and sent joined afterwards rather than skipped, so the
+  // stream has no gap, and the final frame is always sent
+  const sendPcmFrame = (audioData) => {
+    let held = heldPcmRef.current;
+    if (held && (held.data.format !== audioData.format || held.data.model !== audioData.model)) {
+      // A new stream: the held frames of the previous one go out on their own
+      emitAudio({ ...held.data, audio: joinPcmFrames(held.frames) });
+      held = heldPcmRef.current = null;
+    }
+    
+    if (Date.now() < busyUntilRef.current && !audioData.final) {
+      if (!held) {
+        held = heldPcmRef.current = { frames: [], bytes: 0 };
+      }
+      held.data = audioData;
+      held.frames.push(audioData.audio);
+      held.bytes += audioData.audio.byteLength;
+      while (held.bytes > MAX_HELD_PCM_BYTES && held.frames.length > 1) {
+        console.warn('Server busy for too long, dropping held audio');
+        held.bytes -= held.frames.shift().byteLength;
+      }
+      return;
+    }
+    
+    heldPcmRef.current = null;
+    emitAudio(held ? { ...audioData, audio: joinPcmFrames([...held.frames, audioData.audio]) } : audioData);
+  };
+  
   // Update audio levels for visualizer
   const handleAudioLevel = (level) => {
     setCurrentAudioLevel(level);
@@ -552,6 +666,7 @@ const App = () => {
             
             <TranscriptionDisplay 
               results={transcriptionResults}
+              partial={partialTranscription}
               showSentiment={sentimentAnalysis}
             />
           </div>
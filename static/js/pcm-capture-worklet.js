@@ -0,0 +1,89 @@
+// PCM Capture AudioWorklet Processor
+//
+// Runs on the audio rendering thread. Downmixes the microphone input to mono,
+// downsamples it to the target rate and posts fixed-size frames of 16-bit
+// little-endian PCM to the main thread, which sends them to the server as
+// 'audio/pcm;rate=<targetRate>;channels=1'.
+
+class PcmCaptureProcessor extends AudioWorkletProcessor {
+  constructor(options) {
+    super();
+    const { targetRate = 16000, frameMs = 160 } = (options && options.processorOptions) || {};
+
+    this.targetRate = Math.min(targetRate, sampleRate);
+    this.step = sampleRate / this.targetRate; // Input samples per output sample
+    this.frameSize = Math.round(this.targetRate * frameMs / 1000);
+    this.frame = new Int16Array(this.frameSize);
+    this.frameLength = 0;
+
+    // Downsampling state: each output sample is the average of the input
+    // samples in its interval. This box filter is a cheap, weak low-pass: it
+    // reduces aliasing but doesn't prevent it (its sidelobes let some energy
+    // above the target Nyquist frequency through). The browser usually
+    // records at the target rate directly (see createAudioContext), so this
+    // path is the fallback.
+    this.position = 0; // Input position of the next output boundary, relative to the current block
+    this.sum = 0;
+    this.count = 0;
+    this.nextBoundary = this.step;
+
+    this.port.onmessage = (event) => {
+      if (event.data === 'flush') {
+        this.postFrame(true);
+      }
+    };
+  }
+
+  pushSample(value) {
+    const clamped = Math.max(-1, Math.min(1, value));
+    this.frame[this.frameLength++] = clamped < 0 ? clamped * 0x8000 : clamped * 0x7fff;
+    if (this.frameLength === this.frameSize) {
+      this.postFrame(false);
+    }
+  }
+
+  postFrame(final) {
+    const frame = this.frame.slice(0, this.frameLength);
+    this.frameLength = 0;
+    this.port.postMessage({ pcm: frame.buffer, final }, [frame.buffer]);
+  }
+
+  process(inputs) {
+    const input = inputs[0];
+    if (!input || input.length === 0) {
+      return true;
+    }
+
+    const channels = input.length;
+    const length = input[0].length;
+    for (let i = 0; i < length; i++) {
+      let value = input[0][i];
+      for (let channel = 1; channel < channels; channel++) {
+        value += input[channel][i];
+      }
+      value /= channels;
+
+      if (this.step === 1) {
+        this.pushSample(value);
+        continue;
+      }
+
+      this.sum += value;
+      this.count++;
+      this.position++;
+      if (this.position >= this.nextBoundary) {
+        this.pushSample(this.sum / this.count);
+        this.sum = 0;
+        this.count = 0;
+        this.nextBoundary += this.step;
+      }
+    }
+
+    // Keep the positions small so they don't lose precision over long recordings
+    this.position -= length;
+    this.nextBoundary -= length;
+    return true;
+  }
+}
+
+registerProcessor('pcm-capture-processor', PcmCaptureProcessor);
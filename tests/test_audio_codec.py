@@ -0,0 +1,15 @@
+import pytest
+
+import audio_codec as ac
+
+@pytest.mark.parametrize('channels, frame_rate, sample_width', [(0, 16000, 2), (1, 0, 2), (1, 16000, 0)])
+def test_parse_wav_rejects_degenerate_formats(channels, frame_rate, sample_width):
+    wav = ac.wav_header(4, frame_rate, channels, sample_width) + bytes(4)
+    with pytest.raises(ac.AudioFormatError):
+        ac.parse_wav(wav)
+
+def test_parse_wav_returns_a_view_of_the_samples():
+    wav = ac.wav_header(6, 16000) + bytes(range(6))
+    audio_format, data = ac.parse_wav(wav)
+    assert audio_format == ac.PCM16_MONO_16K
+    assert bytes(data) == bytes(range(6))
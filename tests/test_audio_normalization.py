@@ -0,0 +1,38 @@
+import numpy as np
+
+import audio_codec as ac
+import audio_normalization as an
+import noise_reduction as nr
+import voice_activity_detection as vad
+
+PCM_FORMAT = 'audio/pcm;rate=16000;channels=1'
+
+def pcm_frame(samples):
+    return (np.asarray(samples) * 32767).astype('<i2').tobytes()
+
+def test_declared_pcm_in_target_format_gets_wav_header():
+    frame = pcm_frame(np.zeros(2560))
+    audio, stats = an.normalize_audio(frame, declared_format=PCM_FORMAT)
+
+    assert ac.is_wav(audio)
+    assert ac.parse_wav(audio)[0] == ac.PCM16_MONO_16K
+    assert audio[44:] == frame
+    assert stats['container'] == 'pcm'
+    assert stats['output_bytes'] == len(frame) + 44
+
+def test_silent_declared_pcm_is_skipped_by_vad():
+    audio, stats = an.normalize_audio(pcm_frame(np.zeros(2560)), declared_format=PCM_FORMAT)
+    audio, vad_stats = vad.apply_vad(audio, trim=False)
+
+    assert audio is None
+    assert vad_stats['duration'] == stats['duration'] == 0.16
+    assert vad_stats['skipped'] == vad_stats['duration']
+
+def test_declared_pcm_with_speech_reaches_noise_reduction():
+    t = np.arange(8000) / 16000
+    audio, _ = an.normalize_audio(pcm_frame(0.3 * np.sin(2 * np.pi * 220 * t)), declared_format=PCM_FORMAT)
+    audio, vad_stats = vad.apply_vad(audio, trim=False)
+
+    assert audio is not None
+    assert vad_stats['skipped'] == 0.0
+    assert ac.is_wav(nr.reduce_noise(audio))
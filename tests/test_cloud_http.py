@@ -0,0 +1,100 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import cloud_http as ch
+
+class StubBackend:
+    """Local HTTP server answering every request with a settable status"""
+
+    def __init__(self):
+        self.status = 200
+        self.hits = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.hits += 1
+                body = b'{"text": "hello"}'
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/recognize"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def stub():
+    stub = StubBackend()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(ch, 'RETRY_BACKOFF', 0.0)
+    client = ch.CloudClient('test')
+    client.breaker = ch.CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    return client
+
+def test_retries_stop_when_the_budget_is_spent(stub, client):
+    stub.status = 503
+    client.retry_budget = ch.RetryBudget(ratio=0.0, min_per_second=0.0, max_tokens=1.0)
+
+    with pytest.raises(ch.UpstreamError):
+        client.request('POST', stub.url, data=b'audio')
+    assert stub.hits == 2  # One retry, paid with the only token
+
+    with pytest.raises(ch.UpstreamError):
+        client.request('POST', stub.url, data=b'audio')
+    assert stub.hits == 3  # No retry left
+    assert client.stats['retries'] == 1
+    assert client.stats['failures'] == 2
+
+def test_circuit_opens_then_probes_and_closes(stub, client):
+    stub.status = 500
+    client.max_retries = 0
+    for _ in range(2):
+        with pytest.raises(ch.UpstreamError):
+            client.request('POST', stub.url, data=b'audio')
+    assert client.breaker.state == ch.CircuitBreaker.OPEN
+
+    with pytest.raises(ch.CircuitOpenError):
+        client.request('POST', stub.url, data=b'audio')
+    assert stub.hits == 2
+
+    time.sleep(0.25)
+    stub.status = 200
+    assert client.request('POST', stub.url, data=b'audio').json() == {'text': 'hello'}
+    assert client.breaker.state == ch.CircuitBreaker.CLOSED
+    assert client.is_available()
+
+def test_unexpected_error_in_probe_reopens_circuit(stub, client, monkeypatch):
+    client.breaker.record_failure()
+    client.breaker.record_failure()
+    time.sleep(0.25)
+
+    def broken_request(*args, **kwargs):
+        raise ValueError("unexpected")
+    monkeypatch.setattr(client.session, 'request', broken_request)
+    with pytest.raises(ch.UpstreamError):
+        client.request('POST', stub.url, data=b'audio')
+    # The failed probe opens the circuit again instead of leaving it half open
+    assert client.breaker.state == ch.CircuitBreaker.OPEN
+
+    monkeypatch.undo()
+    time.sleep(0.25)
+    assert client.request('POST', stub.url, data=b'audio').status_code == 200
+    assert client.breaker.state == ch.CircuitBreaker.CLOSED
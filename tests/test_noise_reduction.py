@@ -0,0 +1,17 @@
+import numpy as np
+
+import audio_codec as ac
+import noise_reduction as nr
+
+def test_flushed_stream_reducer_returns_the_whole_utterance():
+    t = np.arange(2560) / 16000
+    chunk = ac.encode_wav(0.3 * np.sin(2 * np.pi * 220 * t), 16000)
+    try:
+        denoised = [nr.reduce_noise(chunk, session_id='test-session') for _ in range(3)]
+        denoised.append(nr.flush_stream_reducer('test-session'))
+        reducer = nr.stream_reducers['test-session']
+    finally:
+        nr.release_stream_reducer('test-session')
+
+    n_samples = sum(len(ac.parse_wav(wav)[1]) // 2 for wav in denoised)
+    assert n_samples == 3 * 2560 - (3 * 2560 - reducer.frame_size) % reducer.frame_shift
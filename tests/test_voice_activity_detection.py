@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import audio_codec as ac
+import voice_activity_detection as vad
+
+FRAME_RATE = 16000
+CHUNK = 2560  # 160ms live frames
+
+def voiced(n, amplitude=0.05):
+    t = np.arange(n) / FRAME_RATE
+    return amplitude * sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((180, 360, 540), 1))
+
+def silence(n):
+    return 0.0005 * np.random.default_rng(0).standard_normal(n)
+
+def stream(sid, samples):
+    """Feed samples as live chunks, returning each chunk's (audio, stats)"""
+    return [vad.apply_vad(ac.encode_wav(samples[i:i + CHUNK], FRAME_RATE), session_id=sid)
+            for i in range(0, len(samples), CHUNK)]
+
+@pytest.fixture
+def sid():
+    yield 'test-session'
+    vad.release_stream_vad('test-session')
+
+def test_pauses_inside_an_utterance_are_kept(sid):
+    samples = np.concatenate((silence(CHUNK), voiced(4 * CHUNK), silence(2 * CHUNK), voiced(4 * CHUNK, 0.01)))
+    results = stream(sid, samples)
+
+    assert results[0][0] is None
+    assert all(audio is not None for audio, _ in results[1:])
+    assert not any(stats['end_of_utterance'] for _, stats in results)
+
+def test_sustained_silence_ends_the_utterance_once(sid):
+    results = stream(sid, np.concatenate((voiced(4 * CHUNK), silence(8 * CHUNK))))
+
+    ends = [i for i, (_, stats) in enumerate(results) if stats['end_of_utterance']]
+    assert len(ends) == 1
+    assert all(audio is not None for audio, _ in results[:ends[0] + 1])
+    assert all(audio is None for audio, _ in results[ends[0] + 1:])
+
+def test_speech_onset_gets_the_skipped_silence_as_preroll(sid):
+    audio, _ = stream(sid, np.concatenate((silence(CHUNK), voiced(CHUNK))))[1]
+
+    preroll = min(CHUNK, int(vad.HANGOVER_MS / 1000 * FRAME_RATE))
+    assert len(ac.parse_wav(audio)[1]) == 2 * (CHUNK + preroll)
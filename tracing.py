@@ -0,0 +1,207 @@
+import os
+import json
+import logging
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+import performance_metrics as pm
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Finished spans kept for export (0 keeps only the aggregated stage timings)
+TRACE_BUFFER_SPANS = int(os.environ.get("TRACE_BUFFER_SPANS", 10000))
+
+# perf_counter_ns has an arbitrary origin; this converts it to Unix time for exports
+EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+SERVICE_NAME = "speech-to-text"
+
+# Finished spans, oldest first
+finished_spans = deque(maxlen=TRACE_BUFFER_SPANS or None)
+
+# Root span of the trace in progress for each key (a session id or job id)
+active_traces = {}
+
+_span_ids = itertools.count(1)
+
+class Span:
+    """
+    A timed pipeline stage
+
+    Use as a context manager or call end(). Ending a span records its
+    duration in performance_metrics under the span's name and keeps it for
+    export. Times are perf_counter_ns values.
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'lane', 'attributes', 'start_ns', 'end_ns')
+
+    def __init__(self, name, trace_id=None, parent_id=None, lane=None, attributes=None, start_ns=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.lane = lane
+        self.attributes = attributes or {}
+        self.start_ns = start_ns if start_ns is not None else time.perf_counter_ns()
+        self.end_ns = None
+
+    def end(self, end_ns=None):
+        """Finish the span (only the first call has an effect)"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else time.perf_counter_ns()
+        pm.record_stage_time(self.name, (self.end_ns - self.start_ns) / 1e6)
+        if TRACE_BUFFER_SPANS:
+            finished_spans.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.end()
+        return False
+
+def start_trace(key, name, start_ns=None, **attributes):
+    """
+    Start a trace whose stages are recorded with span(key, ...)
+
+    Args:
+        key: Key the stages refer to (e.g. the session id)
+        name: Name of the root span
+        start_ns: Start time, if the work started before this call
+        **attributes: Attributes of the root span
+
+    Returns:
+        The root span
+    """
+    root = Span(name, uuid.uuid4().hex, lane=key, attributes=attributes, start_ns=start_ns)
+    active_traces[key] = root
+    return root
+
+def annotate(key, **attributes):
+    """Add attributes to the root span of a key's trace"""
+    root = active_traces.get(key)
+    if root is not None:
+        root.attributes.update(attributes)
+
+def end_trace(key):
+    """Finish a key's trace"""
+    root = active_traces.pop(key, None)
+    if root is not None:
+        root.end()
+
+def span(key, name, lane=None, start_ns=None, **attributes):
+    """
+    Start a span for a stage of a key's trace
+
+    Args:
+        key: Trace key; without an active trace the span stands alone
+        name: Stage name
+        lane: Timeline lane in exports (default: the key, or the thread name)
+        start_ns: Start time, if the stage started before this call
+        **attributes: Span attributes
+
+    Returns:
+        Span, to be used as a context manager or ended explicitly
+    """
+    root = active_traces.get(key) if key is not None else None
+    if lane is None:
+        lane = key if key is not None else threading.current_thread().name
+    if root is None:
+        return Span(name, lane=lane, attributes=attributes, start_ns=start_ns)
+    return Span(name, root.trace_id, root.span_id, lane, attributes, start_ns)
+
+def get_spans():
+    """Snapshot of the finished spans"""
+    return list(finished_spans)
+
+def to_chrome_trace(spans):
+    """
+    Convert spans to the Chrome trace event format (chrome://tracing, Perfetto)
+
+    Each lane (session, job or thread) becomes a thread track.
+    """
+    pid = os.getpid()
+    lanes = {}
+    events = []
+    for s in spans:
+        tid = lanes.setdefault(s.lane, len(lanes) + 1)
+        events.append({
+            'name': s.name,
+            'cat': 'pipeline',
+            'ph': 'X',
+            'ts': (s.start_ns + EPOCH_OFFSET_NS) / 1000,
+            'dur': (s.end_ns - s.start_ns) / 1000,
+            'pid': pid,
+            'tid': tid,
+            'args': {**s.attributes, 'trace_id': s.trace_id}
+        })
+
+    for lane, tid in lanes.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': str(lane)}})
+    events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': SERVICE_NAME}})
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def otlp_value(value):
+    """Wrap a Python value as an OTLP AnyValue"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def to_otlp(spans):
+    """Convert spans to OTLP/JSON (the body of an OTLP/HTTP trace export)"""
+    otlp_spans = []
+    for s in spans:
+        # Stand-alone spans get a trace of their own
+        trace_id = s.trace_id or f"{s.span_id:032x}"
+        otlp_span = {
+            'traceId': trace_id,
+            'spanId': f"{s.span_id:016x}",
+            'name': s.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(s.start_ns + EPOCH_OFFSET_NS),
+            'endTimeUnixNano': str(s.end_ns + EPOCH_OFFSET_NS),
+            'attributes': [{'key': key, 'value': otlp_value(value)}
+                           for key, value in {**s.attributes, 'lane': s.lane}.items()]
+        }
+        if s.parent_id is not None:
+            otlp_span['parentSpanId'] = f"{s.parent_id:016x}"
+        if 'error' in s.attributes:
+            otlp_span['status'] = {'code': 2}  # STATUS_CODE_ERROR
+        otlp_spans.append(otlp_span)
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': __name__}, 'spans': otlp_spans}]
+    }]}
+
+# Export formats by name
+EXPORTERS = {'chrome': to_chrome_trace, 'otlp': to_otlp}
+
+def export_traces(path, format='chrome'):
+    """
+    Write the finished spans to a JSON file
+
+    Args:
+        path: Output file path
+        format: 'chrome' or 'otlp'
+
+    Returns:
+        Number of spans written
+    """
+    spans = get_spans()
+    with open(path, 'w') as f:
+        json.dump(EXPORTERS[format](spans), f)
+    logger.info(f"Exported {len(spans)} spans to {path} ({format} format)")
+    return len(spans)
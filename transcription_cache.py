@@ -0,0 +1,166 @@
+import os
+import logging
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+import performance_metrics as pm
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Cache settings (overridable through environment variables)
+CACHE_MAX_ENTRIES = int(os.environ.get("TRANSCRIPTION_CACHE_SIZE", 1024))
+CACHE_TTL = float(os.environ.get("TRANSCRIPTION_CACHE_TTL", 3600))  # Seconds
+# Directory for the on-disk cache; disabled when not set
+CACHE_DIR = os.environ.get("TRANSCRIPTION_CACHE_DIR")
+CACHE_MAX_DISK_ENTRIES = int(os.environ.get("TRANSCRIPTION_CACHE_DISK_SIZE", 10000))
+
+class TranscriptionCache:
+    """
+    Size-bounded LRU cache of transcription results with a TTL
+
+    Results are keyed on the decoded audio content, so resubmitting the
+    same clip skips noise reduction and recognition. An optional on-disk
+    tier keeps results across restarts and is shared by worker processes.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, cache_dir=CACHE_DIR,
+                 max_disk_entries=CACHE_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            logger.info(f"On-disk transcription cache enabled at {self.cache_dir}")
+
+    def _disk_path(self, key):
+        """Path of a key's on-disk entry"""
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        """Read a non-expired entry from disk, or None"""
+        try:
+            with open(self._disk_path(key), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry['created'] > self.ttl:
+            self._remove_disk(key)
+            pm.record_cache_event('expired')
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        """Atomically write an entry to disk and enforce the disk size bound"""
+        path = self._disk_path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(temp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            logger.error(f"Error writing transcription cache entry: {str(e)}")
+
+    def _remove_disk(self, key):
+        """Delete a key's on-disk entry, if present"""
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """Remove the oldest on-disk entries beyond the size bound"""
+        files = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".json")]
+        excess = len(files) - self.max_disk_entries
+        if excess <= 0:
+            return
+
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:excess]:
+            try:
+                os.remove(entry.path)
+                pm.record_cache_event('evicted')
+            except OSError:
+                pass
+
+    def get(self, key):
+        """
+        Look up a cached result
+
+        Returns:
+            Tuple of (text, confidence), or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry['created'] > self.ttl:
+                del self._entries[key]
+                pm.record_cache_event('expired')
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.cache_dir:
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._store(key, entry)
+
+        if entry is None:
+            pm.record_cache_event('miss')
+            return None
+
+        pm.record_cache_event('hit')
+        return entry['text'], entry['confidence']
+
+    def _store(self, key, entry):
+        """Insert an entry into the in-memory LRU"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                pm.record_cache_event('evicted')
+            pm.update_cache_size(len(self._entries))
+
+    def put(self, key, text, confidence):
+        """Cache a recognition result"""
+        entry = {'text': text, 'confidence': confidence, 'created': time.time()}
+        self._store(key, entry)
+        if self.cache_dir:
+            self._write_disk(key, entry)
+
+    def clear(self):
+        """Remove all in-memory entries"""
+        with self._lock:
+            self._entries.clear()
+            pm.update_cache_size(0)
+
+def make_key(pcm, frame_rate, model, model_version, noise_reduction, vad=True):
+    """
+    Build a cache key for a recognition request
+
+    Args:
+        pcm: Decoded audio frames (the container header is not part of the key)
+        frame_rate: Sample rate of the frames
+        model: Recognition model id
+        model_version: Version of the model's backend
+        noise_reduction: Whether noise reduction is applied
+        vad: Whether voice activity detection is applied
+
+    Returns:
+        Hex digest identifying the request
+    """
+    digest = hashlib.sha256(pcm).hexdigest()
+    params = f"{frame_rate}|{model}|{model_version}|{int(bool(noise_reduction))}|{int(bool(vad))}"
+    return hashlib.sha256(f"{digest}|{params}".encode()).hexdigest()
+
+# Shared cache instance
+cache = TranscriptionCache()
@@ -0,0 +1,247 @@
+import logging
+import numpy as np
+import noise_reduction as nr
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Detection parameters
+FRAME_MS = 30  # Analysis frame length
+ABSOLUTE_THRESHOLD_DB = -50.0  # Frames quieter than this are never speech
+NOISE_MARGIN_DB = 9.0  # Speech must be this much louder than the noise floor
+FLATNESS_THRESHOLD = 0.4  # Speech is tonal; white noise has a flatness around 0.56
+HANGOVER_MS = 200  # Speech padding kept around detected speech frames
+END_SILENCE_MS = 300  # Non-speech after the hangover that ends a live utterance
+NOISE_FLOOR_RISE_DB = 3.0  # How fast a live stream's noise floor may rise, per second
+
+def frame_features(audio_array, frame_rate):
+    """
+    Compute per-frame energy and spectral flatness
+
+    Args:
+        audio_array: 1-D mono float samples in [-1, 1]
+        frame_rate: Sample rate
+
+    Returns:
+        Tuple of (energy_db, flatness, frame_size), one value per
+        non-overlapping frame
+    """
+    frame_size = int(FRAME_MS / 1000 * frame_rate)
+    n_frames = len(audio_array) // frame_size
+    frames = audio_array[:n_frames * frame_size].reshape(n_frames, frame_size)
+
+    energy_db = 10 * np.log10(np.mean(np.square(frames, dtype=np.float64), axis=1) + 1e-12)
+
+    # Spectral flatness: geometric mean over arithmetic mean of the power spectrum
+    power = np.square(np.abs(np.fft.rfft(frames * nr.hanning_window(frame_size), axis=1))) + 1e-12
+    flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+    return energy_db, flatness, frame_size
+
+def detect_speech_frames(audio_array, frame_rate):
+    """
+    Classify frames as speech or non-speech
+
+    A frame is speech when it is louder than both an absolute threshold and
+    the chunk's noise floor, and its spectrum is not flat. Detected speech
+    is padded by a hangover so word onsets and tails are kept.
+
+    Returns:
+        Tuple of (speech_mask, frame_size)
+    """
+    energy_db, flatness, frame_size = frame_features(audio_array, frame_rate)
+    if len(energy_db) == 0:
+        return np.zeros(0, dtype=bool), frame_size
+
+    noise_floor_db = np.percentile(energy_db, 10)
+    threshold_db = max(ABSOLUTE_THRESHOLD_DB, noise_floor_db + NOISE_MARGIN_DB)
+    speech = (energy_db > threshold_db) & (flatness < FLATNESS_THRESHOLD)
+
+    # A chunk that is loud throughout has no usable noise floor in it
+    if noise_floor_db > ABSOLUTE_THRESHOLD_DB + NOISE_MARGIN_DB:
+        speech |= flatness < FLATNESS_THRESHOLD
+
+    hangover = int(HANGOVER_MS / FRAME_MS)
+    if hangover > 0 and speech.any():
+        speech = np.convolve(speech, np.ones(2 * hangover + 1), mode='same') > 0
+
+    return speech, frame_size
+
+class StreamingVAD:
+    """
+    Voice activity detection for a live audio stream
+
+    The noise floor, hangover and the run of non-speech frames are kept
+    between chunks, so the short pauses inside an utterance don't end it:
+    an utterance only ends after END_SILENCE_MS of non-speech following the
+    hangover. The noise floor tracks the quietest recent frames and rises by
+    at most NOISE_FLOOR_RISE_DB per second, so speech doesn't raise it.
+    """
+
+    def __init__(self, frame_rate):
+        """
+        Args:
+            frame_rate: Sample rate of the stream
+        """
+        self.frame_rate = frame_rate
+        self.frame_size = int(FRAME_MS / 1000 * frame_rate)
+        self.noise_floor_db = None
+        self.reset()
+
+    def reset(self):
+        """Start a new utterance (the noise floor is kept)"""
+        self.in_utterance = False
+        self.hangover_frames = 0
+        self.silent_frames = 0
+        self._input_tail = np.zeros(0, dtype=np.float32)
+        self._preroll = np.zeros(0, dtype=np.float32)
+
+    def _is_speech(self, energy_db, flatness):
+        """Classify one frame, updating the noise floor"""
+        rise = NOISE_FLOOR_RISE_DB * FRAME_MS / 1000
+        self.noise_floor_db = min(energy_db, self.noise_floor_db + rise)
+        if flatness >= FLATNESS_THRESHOLD:
+            return False
+        # A stream that is loud throughout has no usable noise floor in it
+        if self.noise_floor_db > ABSOLUTE_THRESHOLD_DB + NOISE_MARGIN_DB:
+            return True
+        return energy_db > max(ABSOLUTE_THRESHOLD_DB, self.noise_floor_db + NOISE_MARGIN_DB)
+
+    def process(self, audio_array):
+        """
+        Run detection on the next chunk of the stream
+
+        Chunks inside an utterance are kept whole, pauses included; only
+        silence between utterances is skipped. The end of a skipped silent
+        chunk is kept and put in front of the next chunk, so speech onsets
+        aren't cut off.
+
+        Args:
+            audio_array: 1-D mono float samples in [-1, 1]
+
+        Returns:
+            Tuple of (samples, end_of_utterance). samples is None when the
+            chunk is silence between utterances, otherwise the chunk with
+            any pre-roll in front. end_of_utterance is set when the
+            utterance in progress ended in this chunk.
+        """
+        buffer = np.concatenate((self._input_tail, audio_array.astype(np.float32, copy=False)))
+        n_frames = len(buffer) // self.frame_size
+        self._input_tail = buffer[n_frames * self.frame_size:]
+        energy_db, flatness, _ = frame_features(buffer[:n_frames * self.frame_size], self.frame_rate)
+
+        if self.noise_floor_db is None and len(energy_db) > 0:
+            self.noise_floor_db = float(np.percentile(energy_db, 10))
+
+        hangover = int(HANGOVER_MS / FRAME_MS)
+        end_silence = max(1, int(END_SILENCE_MS / FRAME_MS))
+        active = self.in_utterance
+        ended = False
+        for frame_energy_db, frame_flatness in zip(energy_db, flatness):
+            if self._is_speech(frame_energy_db, frame_flatness):
+                self.in_utterance = active = True
+                self.hangover_frames = hangover
+                self.silent_frames = 0
+            elif self.hangover_frames > 0:
+                self.hangover_frames -= 1
+            elif self.in_utterance:
+                self.silent_frames += 1
+                if self.silent_frames >= end_silence:
+                    self.in_utterance = False
+                    ended = True
+
+        if not active:
+            self._preroll = audio_array[-int(HANGOVER_MS / 1000 * self.frame_rate):]
+            return None, False
+
+        samples = np.concatenate((self._preroll, audio_array)) if len(self._preroll) else audio_array
+        self._preroll = np.zeros(0, dtype=np.float32)
+        # Speech that started again later in the chunk continues the utterance
+        return samples, ended and not self.in_utterance
+
+# Voice activity detectors for live sessions, keyed by session id
+stream_vads = {}
+
+def get_stream_vad(session_id, frame_rate):
+    """Get the streaming voice activity detector for a session, creating it if needed"""
+    stream_vad = stream_vads.get(session_id)
+    if stream_vad is None or stream_vad.frame_rate != frame_rate:
+        logger.debug(f"Creating streaming VAD for session {session_id} at {frame_rate} Hz")
+        stream_vad = StreamingVAD(frame_rate)
+        stream_vads[session_id] = stream_vad
+    return stream_vad
+
+def reset_stream_vad(session_id):
+    """Start a new utterance for a session, keeping its noise floor"""
+    stream_vad = stream_vads.get(session_id)
+    if stream_vad is not None:
+        stream_vad.reset()
+
+def release_stream_vad(session_id):
+    """Discard the streaming voice activity detector for a session"""
+    stream_vads.pop(session_id, None)
+
+def apply_vad(audio_bytes, trim=True, session_id=None):
+    """
+    Run voice activity detection on a WAV chunk
+
+    Args:
+        audio_bytes: WAV audio bytes
+        trim: Trim leading and trailing non-speech
+        session_id: Optional live session id. When given, the chunk is
+            processed as part of that session's stream (see StreamingVAD)
+            and isn't trimmed, so audio stays contiguous between chunks
+
+    Returns:
+        Tuple of (audio, stats). audio is None when the chunk has no speech,
+        the trimmed WAV bytes, or the original bytes if it can't be analyzed.
+        stats has the chunk duration, skipped seconds and, for live
+        sessions, whether the chunk ended the utterance in progress.
+    """
+    stats = {'duration': 0.0, 'skipped': 0.0, 'end_of_utterance': False}
+
+    try:
+        audio_array, channels, frame_rate = nr.wav_bytes_to_audio_array(audio_bytes)
+        if audio_array is None or len(audio_array) == 0:
+            return audio_bytes, stats
+
+        if channels > 1:
+            audio_array = audio_array.reshape(-1, channels).mean(axis=1)
+
+        stats['duration'] = len(audio_array) / frame_rate
+        if session_id is not None:
+            samples, stats['end_of_utterance'] = get_stream_vad(session_id, frame_rate).process(audio_array)
+            if samples is None:
+                logger.debug(f"No speech in stream, skipping {stats['duration']:.2f}s of audio")
+                stats['skipped'] = stats['duration']
+                return None, stats
+            if len(samples) == len(audio_array):
+                return audio_bytes, stats
+            # Prepend the pre-roll kept from the skipped silence
+            with_preroll = nr.audio_array_to_wav_bytes(samples, 1, frame_rate)
+            return (with_preroll if with_preroll is not None else audio_bytes), stats
+
+        speech, frame_size = detect_speech_frames(audio_array, frame_rate)
+
+        if not speech.any():
+            logger.debug(f"No speech detected, skipping {stats['duration']:.2f}s of audio")
+            stats['skipped'] = stats['duration']
+            return None, stats
+
+        if not trim:
+            return audio_bytes, stats
+
+        speech_frames = np.flatnonzero(speech)
+        start = speech_frames[0] * frame_size
+        end = len(audio_array) if speech_frames[-1] == len(speech) - 1 else (speech_frames[-1] + 1) * frame_size
+        if start == 0 and end == len(audio_array):
+            return audio_bytes, stats
+
+        stats['skipped'] = float(len(audio_array) - (end - start)) / frame_rate
+        logger.debug(f"Trimmed {stats['skipped']:.2f}s of non-speech audio")
+        trimmed = nr.audio_array_to_wav_bytes(audio_array[start:end], 1, frame_rate)
+        return (trimmed if trimmed is not None else audio_bytes), stats
+    except Exception as e:
+        logger.error(f"Error in voice activity detection: {str(e)}")
+        return audio_bytes, stats
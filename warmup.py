@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import logging
+import subprocess
+import time
+import argparse
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Directory of the application modules
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def compile_bytecode():
+    """Compile the application modules so workers don't compile them on import"""
+    import compileall
+    return compileall.compile_dir(APP_DIR, maxlevels=0, quiet=1)
+
+def warm_up_nltk(download=False):
+    """Check for the NLTK data, downloading missing packages if asked to"""
+    import sentiment_analysis as sa
+    return all(sa.ensure_nltk_data(download).values())
+
+def warm_up_sentiment():
+    """Import TextBlob and load its sentiment lexicon in this process (CPU pool workers do this themselves)"""
+    import sentiment_analysis as sa
+    return sa.warmup()
+
+def warm_up_audio():
+    """Design the resampling filters for common input rates and run the audio stages once"""
+    import numpy as np
+    import audio_codec as ac
+    import audio_normalization as an
+    import noise_reduction as nr
+    import voice_activity_detection as vad
+
+    t = np.arange(an.TARGET_RATE) / an.TARGET_RATE
+    tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+    wav = ac.wav_header(len(tone) * 2, an.TARGET_RATE) + tone.tobytes()
+    for rate in (48000, 44100, 32000, 22050, 8000):
+        an.resample(tone.astype(np.float32) / 32768.0, an.TARGET_RATE, rate)
+        an.resample(np.zeros(rate // 10, dtype=np.float32), rate, an.TARGET_RATE)
+    vad.apply_vad(nr.reduce_noise(wav))
+    return True
+
+def warm_up_models(models=None):
+    """Load the recognizer backends"""
+    import speech_recognition_service as srs
+    ready = srs.warmup(models)
+    return bool(ready) and all(ready.values())
+
+# Warmup steps, in the order they run. Each returns whether it succeeded.
+COMPONENTS = {
+    'bytecode': compile_bytecode,
+    'nltk': warm_up_nltk,
+    'sentiment': warm_up_sentiment,
+    'audio': warm_up_audio,
+    'models': warm_up_models
+}
+
+def warmup(components=None, models=None, download_nltk=False):
+    """
+    Build the caches and load the components the first request would otherwise wait for
+
+    The bytecode and NLTK data persist on disk, so running this once when
+    building an image speeds up every later start. The other steps warm up
+    the current process only: run them in the gunicorn master (see
+    gunicorn.conf.py) so forked workers start with them ready. Sentiment
+    analysis normally runs in the spawned processes of pipeline.cpu_pool,
+    which share nothing with this process and warm up as they start (see
+    pipeline.warm_up_cpu_worker).
+
+    Args:
+        components: Names of COMPONENTS to run (default: all)
+        models: Recognizer models to load (default: all available)
+        download_nltk: Download missing NLTK data (needs network access)
+
+    Returns:
+        Dictionary of component to {'ok', 'seconds'}
+    """
+    results = {}
+    for name in components or COMPONENTS:
+        start = time.perf_counter()
+        try:
+            if name == 'nltk':
+                ok = warm_up_nltk(download_nltk)
+            elif name == 'models':
+                ok = warm_up_models(models)
+            else:
+                ok = COMPONENTS[name]()
+        except Exception as e:
+            logger.error(f"Error warming up {name}: {str(e)}")
+            ok = False
+        results[name] = {'ok': bool(ok), 'seconds': time.perf_counter() - start}
+        logger.info(f"Warmed up {name} in {results[name]['seconds']:.3f}s (ok: {bool(ok)})")
+    return results
+
+def parse_import_times(output):
+    """
+    Parse the output of `python -X importtime`
+
+    Returns:
+        List of (module, self_seconds, cumulative_seconds) in import order
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+def startup_report(module='app'):
+    """
+    Measure the import time of a module in a fresh interpreter
+
+    Returns:
+        Dictionary with the total import time, the time of each application
+        module (including the third-party packages it was first to import)
+        and the self time of each top-level package
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=APP_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"importing {module} failed: {completed.stderr.strip().splitlines()[-1:]}")
+
+    app_modules = {name[:-3] for name in os.listdir(APP_DIR) if name.endswith('.py')}
+    imports = parse_import_times(completed.stderr)
+
+    packages = {}
+    for name, self_time, _ in imports:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + self_time
+
+    return {
+        'module': module,
+        'process_seconds': elapsed,
+        'import_seconds': sum(self_time for _, self_time, _ in imports),
+        'app_modules': {name: cumulative for name, _, cumulative in imports if name in app_modules},
+        'packages': dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+    }
+
+def print_report(report, warmup_results=None, top=15):
+    print(f"Importing {report['module']}: {report['import_seconds'] * 1000:.0f}ms "
+          f"({report['process_seconds'] * 1000:.0f}ms including interpreter start)")
+    print("\nApplication modules (including the packages they import first):")
+    for name, seconds in sorted(report['app_modules'].items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<32} {seconds * 1000:8.1f}ms")
+    print(f"\nTop {top} packages by own import time:")
+    for name, seconds in list(report['packages'].items())[:top]:
+        print(f"  {name:<32} {seconds * 1000:8.1f}ms")
+    if warmup_results:
+        print("\nWarmup:")
+        for name, result in warmup_results.items():
+            print(f"  {name:<32} {result['seconds'] * 1000:8.1f}ms{'' if result['ok'] else '  (failed)'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm up caches and report where startup time goes")
+    parser.add_argument('--components', nargs='+', choices=list(COMPONENTS), help='Warmup steps to run (default: all)')
+    parser.add_argument('--models', nargs='+', help='Recognizer models to load (default: all available)')
+    parser.add_argument('--download-nltk', action='store_true', help='Download missing NLTK data')
+    parser.add_argument('--report', action='store_true', help='Measure the import time of the app by module')
+    parser.add_argument('--no-warmup', action='store_true', help='Only print the startup report')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = None if args.no_warmup else warmup(args.components, args.models, args.download_nltk)
+    report = startup_report() if args.report or args.no_warmup else None
+
+    if args.json:
+        print(json.dumps({'warmup': results, 'startup': report}, indent=2))
+    elif report:
+        print_report(report, results)
+    else:
+        for name, result in results.items():
+            print(f"{name:<12} {result['seconds'] * 1000:8.1f}ms{'' if result['ok'] else '  (failed)'}")
+
+    if results and not all(result['ok'] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()